@@ -1,10 +1,25 @@
 from abc import ABC, ABCMeta, abstractmethod
-from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 from discord.ext.commands.cog import CogMeta
 from redbot.core.bot import Red
 from redbot.core.config import Config
 
+from .common.archive import WeeklyArchive
+from .common.cache import RemoteImageCache, RenderCache, SingleFlight
+from .common.scheduler import RenderScheduler
+
+if TYPE_CHECKING:
+    # Imported for hints only, the worker module imports the generator which needs this module
+    from .common.catalog import AssetCatalog
+    from .common.gallery import Gallery
+    from .common.notify import NotificationDispatcher
+    from .common.renderd import RenderService
+    from .common.resets import ResetScheduler
+    from .common.rolesync import RoleQueue
+    from .common.worker import ProcessPool
+    from .utils.core import EmojiProvider
+
 
 class CompositeMetaClass(CogMeta, ABCMeta):
     """Type detection"""
@@ -15,16 +30,40 @@ class MixinMeta(ABC):
 
     bot: Red
     config: Config
-    executor: ThreadPoolExecutor
+    scheduler: RenderScheduler
+    pool: "ProcessPool"
+    service: "RenderService"
+    bg_catalog: "AssetCatalog"
+    font_catalog: "AssetCatalog"
+    bg_gallery: "Gallery"
+    font_gallery: "Gallery"
+    emojis: "EmojiProvider"
 
     # Cog cache
     data: dict
     cache_seconds: int
     render_gifs: bool
-    bgdata: dict
-    fdata: dict
+    animated_webp: bool
     stars: dict
-    profiles: dict
+    profiles: RenderCache
+    levelups: RenderCache
+    remote: RemoteImageCache
+    banners: dict
+    ladders: dict
+    watermarks: dict
+    weekly_stats: dict
+    archive: WeeklyArchive
+    role_syncs: dict
+    role_queue: "RoleQueue"
+    notifier: "NotificationDispatcher"
+    resets: "ResetScheduler"
+    notify_window: float
+    image_cache_mb: int
+    renders: SingleFlight
+    prerenders: set
+    render_workers: int
+    render_queue: int
+    render_backend: str
 
     @abstractmethod
     def generate_profile(
@@ -45,6 +84,7 @@ class MixinMeta(ABC):
         font_name: str = None,
         render_gifs: bool = False,
         blur: bool = False,
+        animated_format: str = "gif",
     ):
         raise NotImplementedError
 
@@ -67,6 +107,7 @@ class MixinMeta(ABC):
         font_name: str = None,
         render_gifs: bool = False,
         blur: bool = False,
+        animated_format: str = "gif",
     ):
         raise NotImplementedError
 
@@ -82,9 +123,5 @@ class MixinMeta(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def get_all_fonts(self):
-        raise NotImplementedError
-
-    @abstractmethod
-    def get_all_backgrounds(self):
+    def encode_image(self, img) -> tuple:
         raise NotImplementedError
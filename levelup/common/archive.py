@@ -0,0 +1,170 @@
+import logging
+import mmap
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import msgpack
+
+log = logging.getLogger("red.vrt.levelup.archive")
+
+
+class Week(NamedTuple):
+    timestamp: int  # When the week was reset
+    ids: List[int]  # User IDs, the stat columns below line up with these
+    xp: List[int]
+    messages: List[int]
+    voice: List[int]  # Seconds
+
+
+class WeeklyArchive:
+    """
+    Append-only record of every finished week, one pair of files per guild
+
+    Each reset appends one msgpack record holding the week's stats as columns, and the record's
+    byte offset is appended to a separate index of 8 byte integers. Reads memory-map the records
+    and use the index to seek straight to the weeks they need, unpacking them one at a time,
+    so queries never hold more than a single week in memory no matter how long the history gets.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.lock = threading.Lock()
+
+    def paths(self, guild_id: int) -> Tuple[Path, Path]:
+        return self.folder / f"{guild_id}.msgpack", self.folder / f"{guild_id}.idx"
+
+    def offsets(self, guild_id: int) -> array:
+        offsets = array("Q")
+        __, index = self.paths(guild_id)
+        if index.exists():
+            raw = index.read_bytes()
+            # A write cut short leaves a partial offset at the end, ignore it
+            offsets.frombytes(raw[: len(raw) - len(raw) % offsets.itemsize])
+        return offsets
+
+    def count(self, guild_id: int) -> int:
+        return len(self.offsets(guild_id))
+
+    def append(self, guild_id: int, timestamp: int, weekly: Dict[str, dict]) -> None:
+        ids = list(weekly)
+        record = {
+            "ts": int(timestamp),
+            "ids": [int(uid) for uid in ids],
+            "xp": [int(round(weekly[uid]["xp"])) for uid in ids],
+            "messages": [int(weekly[uid]["messages"]) for uid in ids],
+            "voice": [int(round(weekly[uid]["voice"])) for uid in ids],
+        }
+        data, index = self.paths(guild_id)
+        with self.lock:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            self.drop_unindexed(guild_id)
+            # The index is written last, so a record is only visible once it's complete
+            with data.open("ab") as f:
+                offset = f.tell()
+                f.write(msgpack.packb(record, use_bin_type=True))
+            with index.open("ab") as f:
+                if f.tell() % 8:
+                    # Drop a partial offset left by a write that was cut short
+                    f.truncate(f.tell() - f.tell() % 8)
+                f.write(array("Q", [offset]).tobytes())
+
+    def drop_unindexed(self, guild_id: int) -> None:
+        """Cut off bytes left after the last indexed record by a write that never made it into the index"""
+        data, __ = self.paths(guild_id)
+        if not data.exists():
+            return
+        offsets = self.offsets(guild_id)
+        end = 0
+        if offsets:
+            with data.open("rb") as f:
+                f.seek(offsets[-1])
+                unpacker = msgpack.Unpacker(f, raw=False)
+                try:
+                    unpacker.unpack()
+                except (ValueError, msgpack.UnpackException, msgpack.OutOfData):
+                    # Can't tell where the last record ends, leave the file as it is
+                    return
+                end = offsets[-1] + unpacker.tell()
+        if data.stat().st_size > end:
+            log.warning(f"Dropping an incomplete week from the archive for guild {guild_id}")
+            with data.open("r+b") as f:
+                f.truncate(end)
+
+    def weeks(self, guild_id: int, last: int = 0) -> Iterator[Week]:
+        """Oldest to newest, only the most recent `last` weeks if given"""
+        offsets = self.offsets(guild_id)
+        if not offsets:
+            return
+        data, __ = self.paths(guild_id)
+        start = max(len(offsets) - last, 0) if last else 0
+        with data.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(start, len(offsets)):
+                end = offsets[i + 1] if i + 1 < len(offsets) else len(mm)
+                # Only the first object is read, so stray bytes after a record can't hide it
+                unpacker = msgpack.Unpacker(raw=False)
+                unpacker.feed(mm[offsets[i] : end])
+                try:
+                    record = unpacker.unpack()
+                except (ValueError, msgpack.UnpackException, msgpack.OutOfData):
+                    log.warning(f"Skipping unreadable week {i} in the archive for guild {guild_id}")
+                    continue
+                yield Week(record["ts"], record["ids"], record["xp"], record["messages"], record["voice"])
+
+    def top(self, guild_id: int, weeks: int, stat: str = "xp") -> List[Tuple[int, int]]:
+        """(User ID, total) summed over the last few weeks, highest first"""
+        totals: Dict[int, int] = {}
+        for week in self.weeks(guild_id, weeks):
+            for uid, value in zip(week.ids, getattr(week, stat)):
+                totals[uid] = totals.get(uid, 0) + value
+        return sorted(((uid, total) for uid, total in totals.items() if total), key=lambda x: x[1], reverse=True)
+
+    def history(self, guild_id: int, user_id: int, weeks: int = 0) -> List[Tuple[int, int, int, int]]:
+        """(timestamp, xp, messages, voice) for a user each week, weeks they weren't around are all 0"""
+        history = []
+        for week in self.weeks(guild_id, weeks):
+            try:
+                i = week.ids.index(user_id)
+            except ValueError:
+                history.append((week.timestamp, 0, 0, 0))
+                continue
+            history.append((week.timestamp, week.xp[i], week.messages[i], week.voice[i]))
+        return history
+
+    def streaks(self, guild_id: int) -> Dict[int, Tuple[int, int]]:
+        """User ID -> (current, longest) run of consecutive weeks with exp earned"""
+        current: Dict[int, int] = {}
+        longest: Dict[int, int] = {}
+        for week in self.weeks(guild_id):
+            active = {uid for uid, xp in zip(week.ids, week.xp) if xp > 0}
+            current = {uid: current.get(uid, 0) + 1 for uid in active}
+            for uid, run in current.items():
+                if run > longest.get(uid, 0):
+                    longest[uid] = run
+        return {uid: (current.get(uid, 0), best) for uid, best in longest.items()}
+
+    def purge_user(self, user_id: int) -> None:
+        """Rewrite every guild's archive without a user, for data deletion requests"""
+        if not self.folder.exists():
+            return
+        with self.lock:
+            for index in self.folder.glob("*.idx"):
+                guild_id = int(index.stem)
+                weeks = list(self.weeks(guild_id))
+                if not any(user_id in week.ids for week in weeks):
+                    continue
+                data, __ = self.paths(guild_id)
+                tmp_data, tmp_index = data.with_suffix(".tmp"), index.with_suffix(".idxtmp")
+                offsets = array("Q")
+                with tmp_data.open("wb") as f:
+                    for week in weeks:
+                        keep = [i for i, uid in enumerate(week.ids) if uid != user_id]
+                        record = {"ts": week.timestamp, "ids": [week.ids[i] for i in keep]}
+                        for stat in ("xp", "messages", "voice"):
+                            record[stat] = [getattr(week, stat)[i] for i in keep]
+                        offsets.append(f.tell())
+                        f.write(msgpack.packb(record, use_bin_type=True))
+                tmp_index.write_bytes(offsets.tobytes())
+                tmp_data.replace(data)
+                tmp_index.replace(index)
@@ -1,18 +1,17 @@
 import asyncio
-import datetime
 import logging
 import math
 import random
+import re
 import traceback
 from abc import ABC
 from io import BytesIO
 from pathlib import Path
-from time import perf_counter
-from typing import Optional, Union
+from time import monotonic, perf_counter
+from typing import List, Optional, Tuple, Union
 
 import discord
 import validators
-from aiocache import cached
 from redbot.core import VersionInfo, bank, commands, version_info
 from redbot.core.data_manager import bundled_data_path, cog_data_path
 from redbot.core.i18n import Translator, cog_i18n
@@ -33,7 +32,10 @@ from levelup.utils.formatter import (
 )
 
 from ..abc import MixinMeta
+from .catalog import Asset, AssetCatalog
 from .constants import default_guild
+from .renderd import RenderServiceDown
+from .scheduler import BACKGROUND, INTERACTIVE, PREFETCH, RenderQueueFull
 
 if version_info >= VersionInfo.from_str("3.5.0"):
     from .dpymenu import DEFAULT_CONTROLS, menu
@@ -46,126 +48,230 @@ else:
 
 log = logging.getLogger("red.vrt.levelup.commands")
 _ = Translator("LevelUp", __file__)
+# Banners only change when the user edits their profile, which drops the cached one
+BANNER_TTL = 43200
+# Custom emojis in names, captures the emoji ID
+CUSTOM_EMOJI = re.compile(r"<a?:\w{2,32}:(\d{17,22})>")
 
 
 @cog_i18n(_)
 class UserCommands(MixinMeta, ABC):
+    async def prefetch_assets(self, params: dict) -> dict:
+        """Download any image urls up front so renders only do CPU work and can run in another process"""
+        params = params.copy()
+        keys = [k for k in ("bg_image", "profile_image", "role_icon") if str(params.get(k)).startswith("http")]
+        if "bg_image" in keys and self.get_pinned(params["bg_image"]):
+            # Already on disk, every render backend can read it from there
+            keys.remove("bg_image")
+        results = await asyncio.gather(
+            *[asyncio.to_thread(self.get_image_content_from_url, str(params[k])) for k in keys]
+        )
+        for key, content in zip(keys, results):
+            params[key] = content
+        await self.prefetch_emojis(params.get("user_name"), params.get("user_display_name"))
+        return params
+
+    async def prefetch_emojis(self, *texts: Optional[str]) -> None:
+        """Save custom emojis used in names to the local emoji pack so renders never have to download them"""
+        source = self.emojis.source
+        ids = {int(i) for text in texts if text for i in CUSTOM_EMOJI.findall(text)}
+        missing = [i for i in ids if not source.discord_emoji_path(i).exists()]
+        if not missing:
+            return
+        results = await asyncio.gather(
+            *[get_content_from_url(f"{source.BASE_DISCORD_EMOJI_URL}{i}.png") for i in missing]
+        )
+        for emoji_id, content in zip(missing, results):
+            # Error pages aren't worth keeping
+            if content and content.startswith(b"\x89PNG"):
+                await asyncio.to_thread(source.save, source.discord_emoji_path(emoji_id), content)
+
+    async def submit_render(self, method: str, params: dict, priority: int) -> Tuple[bytes, str]:
+        """Render and encode an image on the configured backend"""
+        params = await self.prefetch_assets(params)
+        if self.render_backend == "process" and self.pool.running:
+            return await self.scheduler.submit(
+                self.pool.render, priority=priority, timeout=60, method=method, params=params
+            )
+        if self.render_backend == "service":
+            try:
+                if not self.service.alive:
+                    raise RenderServiceDown("Render service is not running")
+                return await self.scheduler.submit(
+                    self.service.render, priority=priority, timeout=60, method=method, params=params
+                )
+            except RenderServiceDown as e:
+                # Render in process this time, the health check will bring the service back
+                log.warning(f"Render service unavailable, rendering in process: {e}")
+                self.service.fallbacks += 1
+        return await self.scheduler.submit(self.render_image, priority=priority, timeout=60, method=method, **params)
+
     # Generate level up image
-    async def gen_levelup_img(self, params: dict):
-        task = asyncio.to_thread(self.generate_levelup, **params)
+    async def gen_levelup_img(self, params: dict) -> Optional[Tuple[bytes, str]]:
         try:
-            img = await asyncio.wait_for(task, timeout=60)
-        except asyncio.TimeoutError:
+            return await self.submit_render("generate_levelup", params, BACKGROUND)
+        except (asyncio.TimeoutError, RenderQueueFull):
             return None
-        return img
 
     # Generate profile image
-    async def gen_profile_img(self, params: dict, full: bool = True):
-        method = self.generate_profile if full else self.generate_slim_profile
-        task = asyncio.to_thread(method, **params)
+    async def gen_profile_img(self, params: dict, full: bool = True) -> Optional[Tuple[bytes, str]]:
+        method = "generate_profile" if full else "generate_slim_profile"
         try:
-            img = await asyncio.wait_for(task, timeout=60)
+            return await self.submit_render(method, params, INTERACTIVE)
         except asyncio.TimeoutError:
             return None
-        return img
 
     # Function to test a given URL and see if it's valid
-    async def valid_url(self, ctx: commands.Context, image_url: str):
+    async def pin_url(self, ctx: commands.Context, image_url: str):
+        """Download and validate a background url, storing it locally so profiles don't have to fetch it again"""
         valid = validators.url(image_url)
         if not valid:
             await ctx.send(_("Uh Oh, looks like that is not a valid URL"))
             return
+        content = await asyncio.to_thread(self.get_image_content_from_url, image_url)
+        if not content:
+            await ctx.send(_("Uh Oh, looks like that is not a valid image"))
+            return
         try:
-            # Try running it through profile generator blind to see if it errors
-
-            params = {"bg_image": image_url}
-            await asyncio.to_thread(self.generate_profile, **params)
+            await asyncio.to_thread(self.pin_background, image_url, content)
         except Exception as e:
             if "cannot identify image file" in str(e):
                 await ctx.send(_("Uh Oh, looks like that is not a valid image, cannot identify the file"))
                 return
+            elif "exceeds the limit" in str(e):
+                await ctx.send(_("Uh Oh, that image is way too big, try one with a lower resolution"))
+                return
             else:
                 log.warning(f"background set failed: {traceback.format_exc()}")
                 await ctx.send(_("Uh Oh, looks like that is not a valid image"))
                 return
         return True
 
-    async def get_or_fetch_fonts(self):
-        maindir = bundled_data_path(self)
-        savedir = cog_data_path(self)
-        fonts = maindir / "fonts"
-        saved_fonts = savedir / "fonts"
-        available = list(fonts.iterdir()) + list(saved_fonts.iterdir())
-        match = all(i.name in self.fdata["names"] for i in available)
-        if match and self.fdata["img"]:
-            return self.fdata["img"]
-
+    async def prune_backgrounds(self) -> None:
+        """Delete pinned backgrounds no longer used by anyone"""
+        urls = [
+            user["background"]
+            for conf in self.data.values()
+            for user in conf["users"].values()
+            if str(user.get("background")).startswith("http")
+        ]
+        removed = await asyncio.to_thread(self.prune_pinned, urls)
+        if removed:
+            log.debug(f"Removed {removed} unused pinned background files")
+
+    async def get_or_fetch_fonts(self, page: int = 0) -> Optional[Tuple[Path, List[Asset]]]:
+        """Get a page of the font gallery, only rebuilt if the fonts on it changed"""
         try:
-            task = asyncio.to_thread(self.get_all_fonts)
-            img = await asyncio.wait_for(task, timeout=60)
-            self.fdata["img"] = img
-            self.fdata["names"] = [i.name for i in available]
-            return img
+            task = asyncio.to_thread(self.font_gallery.get_page, page)
+            return await asyncio.wait_for(task, timeout=60)
+        except FileNotFoundError:
+            return None
         except asyncio.TimeoutError:
             log.warning("get_or_fetch_fonts took too long to generate!")
 
-    async def get_or_fetch_backgrounds(self):
-        maindir = bundled_data_path(self)
-        savedir = cog_data_path(self)
-        backgrounds = maindir / "backgrounds"
-        saved_backgrounds = savedir / "backgrounds"
-        available = list(backgrounds.iterdir()) + list(saved_backgrounds.iterdir())
-        match = all(i.name in self.bgdata["names"] for i in available)
-        if match and self.bgdata["img"]:
-            return self.bgdata["img"]
-
+    async def get_or_fetch_backgrounds(self, page: int = 0) -> Optional[Tuple[Path, List[Asset]]]:
+        """Get a page of the background gallery, only rebuilt if the backgrounds on it changed"""
         try:
-            task = asyncio.to_thread(self.get_all_backgrounds)
-            img = await asyncio.wait_for(task, timeout=60)
-            self.bgdata["img"] = img
-            self.bgdata["names"] = [i.name for i in available]
-            return img
+            task = asyncio.to_thread(self.bg_gallery.get_page, page)
+            return await asyncio.wait_for(task, timeout=60)
+        except FileNotFoundError:
+            return None
         except asyncio.TimeoutError:
             log.warning("get_or_fetch_backgrounds took too long to generate!")
 
-    async def get_or_fetch_profile(self, user: discord.Member, args: dict, full: bool) -> Union[discord.File, None]:
-        gid = user.guild.id
-        uid = str(user.id)
-        now = datetime.datetime.now()
-        if gid not in self.profiles:
-            self.profiles[gid] = {}
-        if uid not in self.profiles[gid]:
-            self.profiles[gid][uid] = {"img": None, "ts": now}
-
-        cache = self.profiles[gid][uid]
-        td = (now - cache["ts"]).total_seconds()
-        if td > self.cache_seconds or not cache["img"]:
-            img = await self.gen_profile_img(args, full)
-            self.profiles[gid][uid] = {"img": img, "ts": now}
-        else:
-            img = self.profiles[gid][uid]["img"]
+    @staticmethod
+    async def find_asset(catalog: AssetCatalog, name: str) -> Optional[Asset]:
+        """Look up a background or font, any rescan of the folders happens off the event loop"""
+        await asyncio.to_thread(catalog.refresh)
+        return catalog.find(name)
+
+    async def get_or_fetch_profile(self, user: discord.Member, args: dict, full: bool) -> Optional[Tuple[bytes, str]]:
+        """Get the encoded profile image bytes and file extension for a user"""
+        key = self.profiles.make_key(user.guild.id, user.id, full, args)
+        cached = self.profiles.get(key, max_age=self.cache_seconds)
+        if cached:
+            return cached
+
+        async def render() -> Optional[Tuple[bytes, str]]:
+            result = await self.gen_profile_img(args, full)
+            if not result:
+                return None
+            self.profiles.put(key, *result, tag=str(user.id))
+            return result
+
+        # Concurrent requests for the same profile share a single render
+        return await self.renders.run(key, render)
+
+    async def get_levelup_img(self, args: dict, user_id: int = None) -> Optional[Tuple[bytes, str]]:
+        """Get the encoded level up image bytes and file extension"""
+        # The args pin down the avatar hash, background, level, color and font, so a cached card is never stale
+        key = self.levelups.make_key("levelup", args)
+        cached = self.levelups.get(key)
+        if cached:
+            return cached
+
+        async def render() -> Optional[Tuple[bytes, str]]:
+            result = await self.gen_levelup_img(args)
+            if result:
+                self.levelups.put(key, *result, tag=str(user_id) if user_id else None)
+            return result
+
+        return await self.renders.run(key, render)
+
+    def prerender_levelup(self, args: dict, user_id: int) -> None:
+        """Render a level up card ahead of time while the renderer has nothing better to do"""
+        key = self.levelups.make_key("levelup", args)
+        if key in self.levelups or key in self.renders.inflight or not self.scheduler.idle:
+            return
 
-        if not img:
-            return None
-        animated = getattr(img, "is_animated", False)
-        ext = "GIF" if animated else "WEBP"
-        buffer = BytesIO()
-        buffer.name = f"{user.id}.{ext.lower()}"
-        try:
-            img.save(buffer, save_all=True, format=ext)
-        except KeyError:
-            img.save(buffer, save_all=True, format="PNG")
-        buffer.seek(0)
-        return discord.File(buffer, filename=buffer.name)
+        async def render():
+            try:
+                result = await self.submit_render("generate_levelup", args, PREFETCH)
+            except (asyncio.TimeoutError, RenderQueueFull):
+                return
+            except Exception as e:
+                log.debug("Failed to pre-render level up card", exc_info=e)
+                return
+            self.levelups.put(key, *result, tag=str(user_id))
+
+        task = asyncio.create_task(render())
+        self.prerenders.add(task)
+        task.add_done_callback(self.prerenders.discard)
+
+    @staticmethod
+    def get_levelup_color(member: discord.Member) -> tuple:
+        color = str(member.colour)
+        if color == "#000000":  # Don't use default color
+            # Picked from the user ID rather than at random so their cards can be cached
+            color = str(discord.Color.from_hsv(member.id % 360 / 360, 0.75, 1.0))
+        return hex_to_rgb(color)
 
     # Hacky way to get user banner
-    @cached(ttl=7200)
-    async def get_banner(self, user: discord.Member) -> str:
+    async def get_banner(self, user: discord.Member) -> Optional[str]:
+        if cached := self.banners.get(user.id):
+            banner_url, fetched = cached
+            if monotonic() - fetched < BANNER_TTL:
+                return banner_url
         req = await self.bot.http.request(discord.http.Route("GET", "/users/{uid}", uid=user.id))
         banner_id = req["banner"]
+        banner_url = None
         if banner_id:
             banner_url = f"https://cdn.discordapp.com/banners/{user.id}/{banner_id}?size=1024"
-            return banner_url
+        self.banners[user.id] = (banner_url, monotonic())
+        return banner_url
+
+    @staticmethod
+    def get_avatar_url(user: Union[discord.Member, discord.User]) -> str:
+        return str(user.display_avatar.url if DPY2 else user.avatar_url)
+
+    async def forget_user(self, user_id: int, *stale_urls: str) -> None:
+        """Drop everything cached for a user after their avatar, banner or name changed"""
+        self.profiles.invalidate(str(user_id))
+        self.levelups.invalidate(str(user_id))
+        self.banners.pop(user_id, None)
+        for url in stale_urls:
+            # Renders ask for different sizes of the same image, so match without the query
+            await asyncio.to_thread(self.remote.forget_matching, url.split("?")[0])
 
     # For testing purposes
     @commands.command(name="mocklvl", hidden=True)
@@ -182,7 +288,7 @@ class UserCommands(MixinMeta, ABC):
         if uid in conf:
             font = conf[uid]["font"]
         if DPY2:
-            pfp = user.display_avatar.url
+            pfp = user.display_avatar.with_size(512).url
         else:
             pfp = user.avatar_url
         args = {
@@ -192,15 +298,11 @@ class UserCommands(MixinMeta, ABC):
             "color": color,
             "font_name": font,
         }
-        img = await self.gen_levelup_img(args)
-        temp = BytesIO()
-        temp.name = f"{ctx.author.id}.webp"
-        try:
-            img.save(temp, format="WEBP")
-        except KeyError:
-            img.save(temp, format="PNG")
-        temp.seek(0)
-        file = discord.File(temp)
+        result = await self.get_levelup_img(args)
+        if not result:
+            return await ctx.send(_("Failed to generate level up image"))
+        data, ext = result
+        file = discord.File(BytesIO(data), filename=f"{ctx.author.id}.{ext}")
         await ctx.send(file=file)
 
     @commands.group(name="myprofile", aliases=["mypf", "pfset"])
@@ -244,25 +346,16 @@ class UserCommands(MixinMeta, ABC):
                 color=ctx.author.color,
             )
 
-            maindir = bundled_data_path(self)
-            savedir = cog_data_path(self)
-            backgrounds = maindir / "backgrounds"
-            saved_backgrounds = savedir / "backgrounds"
-            available = list(backgrounds.iterdir()) + list(saved_backgrounds.iterdir())
-
             file = None
             if bg:
                 if bg.lower().startswith("http"):
                     em.set_image(url=bg)
-                elif bg != "random":
-                    for bgfile in available:
-                        if bg.lower() in bgfile.name:
-                            try:
-                                file = discord.File(bgfile, filename=bgfile.name)
-                                em.set_image(url=f"attachment://{bg}")
-                                break
-                            except (WindowsError, PermissionError, OSError):
-                                pass
+                elif bg != "random" and (asset := await self.find_asset(self.bg_catalog, bg)):
+                    try:
+                        file = discord.File(asset.path, filename=asset.name)
+                        em.set_image(url=f"attachment://{bg}")
+                    except (WindowsError, PermissionError, OSError):
+                        pass
 
             await ctx.send(embed=em, file=file)
 
@@ -320,6 +413,7 @@ class UserCommands(MixinMeta, ABC):
                 filename = f"{preferred_filename}{ext}"
         filepath = cog_data_path(self) / "backgrounds" / filename
         filepath.write_bytes(bytes_file)
+        await asyncio.to_thread(self.bg_catalog.refresh, True)
         await ctx.send(_("Your custom background has been saved as ") + f"`{filename}`")
 
     @set_profile.command(name="rembackground")
@@ -337,6 +431,7 @@ class UserCommands(MixinMeta, ABC):
             file.unlink(missing_ok=True)
         except Exception as e:
             return await ctx.send(_("Could not delete file: ") + str(e))
+        await asyncio.to_thread(self.bg_catalog.refresh, True)
         await ctx.send(_("Background named {} has been removed!").format(f"`{file.name}`"))
 
     @set_profile.command(name="defaultfontpath")
@@ -388,6 +483,7 @@ class UserCommands(MixinMeta, ABC):
 
         filepath = cog_data_path(self) / "fonts" / filename
         filepath.write_bytes(bytes_file)
+        await asyncio.to_thread(self.font_catalog.refresh, True)
         await ctx.send(_("Your custom font file has been saved as ") + f"`{filename}`")
 
     @set_profile.command(name="remfont")
@@ -405,12 +501,13 @@ class UserCommands(MixinMeta, ABC):
             file.unlink(missing_ok=True)
         except Exception as e:
             return await ctx.send(_("Could not delete file: ") + str(e))
+        await asyncio.to_thread(self.font_catalog.refresh, True)
         await ctx.send(_("Font named {} has been removed!").format(f"`{file.name}`"))
 
     @set_profile.command(name="backgrounds")
     @commands.cooldown(1, 30, commands.BucketType.user)
     @commands.bot_has_permissions(attach_files=True)
-    async def view_all_backgrounds(self, ctx: commands.Context):
+    async def view_all_backgrounds(self, ctx: commands.Context, page: int = 1):
         """View the all available backgrounds"""
         if not self.data[ctx.guild.id]["usepics"]:
             txt = _("Image profiles are disabled on this server so this command is off")
@@ -421,20 +518,20 @@ class UserCommands(MixinMeta, ABC):
             return await ctx.send(txt)
 
         async with ctx.typing():
-            img = await self.get_or_fetch_backgrounds()
-            if img is None:
-                await ctx.send(_("Failed to generate background samples"))
-            buffer = BytesIO()
-            try:
-                img.save(buffer, format="WEBP")
-                buffer.name = f"{ctx.author.id}.webp"
-            except (ValueError, KeyError):
-                img.save(buffer, format="PNG", quality=50)
-                buffer.name = f"{ctx.author.id}.png"
-            buffer.seek(0)
-            file = discord.File(buffer)
+            await asyncio.to_thread(self.bg_catalog.refresh)
+            pages = self.bg_gallery.page_count()
+            page = max(1, min(page, pages))
+            result = await self.get_or_fetch_backgrounds(page - 1)
+            if result is None:
+                return await ctx.send(_("Failed to generate background samples"))
+            path, __ = result
+            file = discord.File(str(path), filename=f"backgrounds-{page}.webp")
             txt = _("Here are the current default backgrounds, to set one permanently you can use the ")
             txt += f"`{ctx.clean_prefix}mypf background <filename>` " + _("command")
+            if pages > 1:
+                txt += "\n" + _("Page {}/{}, use `{}` to view another page").format(
+                    page, pages, f"{ctx.clean_prefix}mypf backgrounds <page>"
+                )
             try:
                 await ctx.send(txt, file=file)
             except discord.HTTPException:
@@ -443,7 +540,7 @@ class UserCommands(MixinMeta, ABC):
     @set_profile.command(name="fonts")
     @commands.cooldown(1, 30, commands.BucketType.user)
     @commands.bot_has_permissions(attach_files=True)
-    async def view_fonts(self, ctx: commands.Context):
+    async def view_fonts(self, ctx: commands.Context, page: int = 1):
         """View available fonts to use"""
         if not self.data[ctx.guild.id]["usepics"]:
             txt = _("Image profiles are disabled on this server so this command is off")
@@ -451,22 +548,22 @@ class UserCommands(MixinMeta, ABC):
                 txt += _("\nUse the `{}` command to toggle image profiles and enable this command.").format(
                     f"{ctx.clean_prefix}lset embeds"
                 )
-            await ctx.send(txt)
+            return await ctx.send(txt)
         async with ctx.typing():
-            img = await self.get_or_fetch_fonts()
-            if img is None:
-                await ctx.send(_("Failed to generate background samples"))
-            buffer = BytesIO()
-            try:
-                img.save(buffer, format="WEBP")
-                buffer.name = f"{ctx.author.id}.webp"
-            except (ValueError, KeyError):
-                img.save(buffer, format="PNG", quality=50)
-                buffer.name = f"{ctx.author.id}.png"
-            buffer.seek(0)
-            file = discord.File(buffer)
+            await asyncio.to_thread(self.font_catalog.refresh)
+            pages = self.font_gallery.page_count()
+            page = max(1, min(page, pages))
+            result = await self.get_or_fetch_fonts(page - 1)
+            if result is None:
+                return await ctx.send(_("Failed to generate font samples"))
+            path, __ = result
+            file = discord.File(str(path), filename=f"fonts-{page}.webp")
             txt = _("Here are the current fonts, to set one permanently you can use the ")
             txt += f"`{ctx.clean_prefix}mypf font <fontname>` " + _("command")
+            if pages > 1:
+                txt += "\n" + _("Page {}/{}, use `{}` to view another page").format(
+                    page, pages, f"{ctx.clean_prefix}mypf fonts <page>"
+                )
             try:
                 await ctx.send(txt, file=file)
             except discord.HTTPException:
@@ -644,29 +741,22 @@ class UserCommands(MixinMeta, ABC):
         if user_id not in users:
             self.init_user(ctx.guild.id, user_id)
 
-        default_bg = bundled_data_path(self) / "backgrounds"
-        saved_bg = cog_data_path(self) / "backgrounds"
-
-        backgrounds = list(default_bg.iterdir()) + list(saved_bg.iterdir())
-
         # If image url is given, run some checks
         if not image_url and not get_attachments(ctx):
             return await ctx.send(_("You must provide a url, filename, or attach a file"))
 
+        previous = users[user_id]["background"]
         filepath = None
         if att := get_attachments(ctx):
             image_url = att[0].url
-            if not await self.valid_url(ctx, image_url):
+            if not await self.pin_url(ctx, image_url):
                 return
         elif image_url.lower().startswith("http"):
-            if not await self.valid_url(ctx, image_url):
+            if not await self.pin_url(ctx, image_url):
                 return
-        else:
-            for file in backgrounds:
-                if image_url.lower() in file.name.lower():
-                    image_url = file.name
-                    filepath = file
-                    break
+        elif asset := await self.find_asset(self.bg_catalog, image_url):
+            image_url = asset.name
+            filepath = asset.path
 
         if image_url:
             self.data[ctx.guild.id]["users"][user_id]["background"] = image_url
@@ -682,6 +772,8 @@ class UserCommands(MixinMeta, ABC):
         else:
             self.data[ctx.guild.id]["users"][user_id]["background"] = None
             await ctx.send(_("Your background has been removed since you did not specify a url!"))
+        if str(previous).startswith("http") and previous != users[user_id]["background"]:
+            await self.prune_backgrounds()
         await ctx.tick()
 
     @set_profile.command(name="font")
@@ -704,18 +796,12 @@ class UserCommands(MixinMeta, ABC):
             self.data[ctx.guild.id]["users"][user_id]["font"] = None
             return await ctx.send(_("Your profile font has been reverted to default"))
 
-        default_fonts = bundled_data_path(self) / "fonts"
-        saved_fonts = cog_data_path(self) / "fonts"
-
-        fonts = list(default_fonts.iterdir()) + list(saved_fonts.iterdir())
-        for file in fonts:
-            if font_name.lower() in file.name.lower():
-                break
-        else:
+        asset = await self.find_asset(self.font_catalog, font_name)
+        if not asset:
             return await ctx.send(_("I could not find a font file with that name"))
 
-        self.data[ctx.guild.id]["users"][user_id]["font"] = file.name
-        await ctx.send(_("Your profile font has been set to ") + f"`{file.name}`")
+        self.data[ctx.guild.id]["users"][user_id]["font"] = asset.name
+        await ctx.send(_("Your profile font has been set to ") + f"`{asset.name}`")
 
     @set_profile.command(name="blur")
     async def set_user_blur(self, ctx: commands.Context):
@@ -852,7 +938,8 @@ class UserCommands(MixinMeta, ABC):
 
             args = {
                 "bg_image": bg_image,  # Background image link
-                "profile_image": pfp,  # User profile picture link
+                # User profile picture link, at the size it will be drawn at
+                "profile_image": pfp.with_size(512 if full else 256) if DPY2 else pfp,
                 "level": level,  # User current level
                 "prev_xp": xp_prev,  # Preveious levels cap
                 "user_xp": xp,  # User current xp
@@ -868,21 +955,29 @@ class UserCommands(MixinMeta, ABC):
                 "role_icon": role_icon,
                 "font_name": font,
                 "render_gifs": self.render_gifs,
+                "animated_format": "webp" if self.animated_webp else "gif",
                 "blur": blur,
             }
             start = perf_counter()
-            file = await self.get_or_fetch_profile(user, args, full)
+            try:
+                result = await self.get_or_fetch_profile(user, args, full)
+            except RenderQueueFull:
+                return await ctx.send(_("Too many profiles are being generated right now, try again in a bit"))
             rtime = round((perf_counter() - start) * 1000)
-            if not file:
+            if not result:
                 return await ctx.send("Failed to generate profile image :( try again in a bit")
+            data, ext = result
+            filename = f"{user.id}.{ext}"
             start2 = perf_counter()
             try:
+                file = discord.File(BytesIO(data), filename=filename)
                 await ctx.reply(file=file, mention_author=mention)
             except Exception as e:
                 if "In message_reference: Unknown message" not in str(e):
                     log.error(f"Failed to send profile pic: {e}")
                 try:
-                    file = await self.get_or_fetch_profile(user, args, full)
+                    # Re-use the already encoded image rather than rendering again
+                    file = discord.File(BytesIO(data), filename=filename)
                     if mention:
                         await ctx.send(ctx.author.mention, file=file)
                     else:
@@ -973,25 +1068,26 @@ class UserCommands(MixinMeta, ABC):
             stat = "exp"
         if global_stats:
             conf = {"users": {}, "weekly": {"users": {}}}
-            for data in self.data.values():
-                # Load user stats
-                for uid, stats in data["users"].items():
-                    if uid in conf["users"]:
-                        conf["users"][uid]["xp"] += stats["xp"]
-                        conf["users"][uid]["voice"] += stats["voice"]
-                        conf["users"][uid]["messages"] += stats["messages"]
+            weekly = conf["weekly"]["users"]
+            for gid, data in self.data.items():
+                if not data["weekly"]["on"]:
+                    continue
+                # Load weekly user stats
+                for uid, stats in self.get_weekly_stats(gid).items():
+                    if uid in weekly:
+                        weekly[uid]["xp"] += stats["xp"]
+                        weekly[uid]["voice"] += stats["voice"]
+                        weekly[uid]["messages"] += stats["messages"]
                     else:
-                        conf["users"][uid] = {
-                            "xp": stats["xp"],
-                            "voice": stats["voice"],
-                            "messages": stats["messages"],
-                        }
+                        weekly[uid] = stats.copy()
         else:
             conf = self.data[ctx.guild.id]
             if not conf["weekly"]["on"]:
                 return await ctx.send(_("Weekly stats are disabled for this guild"))
-            if not conf["weekly"]["users"]:
+            weekly = self.get_weekly_stats(ctx.guild.id)
+            if not weekly:
                 return await ctx.send(_("There is no data for the weekly leaderboard yet, please chat a bit first."))
+            conf = {**conf, "weekly": {**conf["weekly"], "users": weekly}}
 
         embeds = await asyncio.to_thread(get_leaderboard, ctx, conf, stat, "weekly", global_stats)
         if isinstance(embeds, str):
@@ -1018,3 +1114,114 @@ class UserCommands(MixinMeta, ABC):
         new_desc = _("{}\n`Last Reset:     `{}").format(embed.description, f"<t:{conf['weekly']['last_reset']}:R>")
         embed.description = new_desc
         await ctx.send(embed=embed)
+
+    @staticmethod
+    def archive_stat(stat: Optional[str]) -> Tuple[str, str]:
+        """Archive column and display name for a stat argument"""
+        stat = (stat or "exp").lower()
+        if "v" in stat:
+            return "voice", _("Voicetime")
+        if "m" in stat:
+            return "messages", _("Messages")
+        return "xp", _("Exp")
+
+    @commands.command(name="weeklytop")
+    @commands.guild_only()
+    @commands.bot_has_permissions(embed_links=True)
+    async def weekly_top(self, ctx: commands.Context, weeks: int = 4, stat: Optional[str] = None):
+        """
+        View the top members over the last few weeks
+
+        **Arguments**
+        `weeks`: How many of the most recent weeks to include
+        `stat`: What kind of stat to rank by
+        - Valid options are `exp`, `messages`, and `voice`
+        """
+        if weeks < 1:
+            return await ctx.send(_("Weeks must be at least 1"))
+        archived = await asyncio.to_thread(self.archive.count, ctx.guild.id)
+        if not archived:
+            return await ctx.send(_("There are no past weeks recorded yet"))
+        key, statname = self.archive_stat(stat)
+        top = await asyncio.to_thread(self.archive.top, ctx.guild.id, weeks, key)
+        if not top:
+            return await ctx.send(_("Nobody has any {} in that time").format(statname.lower()))
+
+        weeks = min(weeks, archived)
+        lines = []
+        for place, (uid, total) in enumerate(top[:10], start=1):
+            member = ctx.guild.get_member(uid)
+            value = time_formatter(total) if key == "voice" else humanize_number(total)
+            lines.append(f"**{place}.** {member.name if member else uid}: `{value}`")
+        embed = discord.Embed(
+            title=_("Top {} over the last {} week(s)").format(statname, weeks),
+            description="\n".join(lines),
+            color=ctx.author.color,
+        )
+        for place, (uid, total) in enumerate(top, start=1):
+            if uid == ctx.author.id:
+                embed.set_footer(text=_("You: {}/{}").format(place, len(top)))
+                break
+        await ctx.send(embed=embed)
+
+    @commands.command(name="weeklyhistory")
+    @commands.guild_only()
+    @commands.bot_has_permissions(embed_links=True)
+    async def weekly_history(self, ctx: commands.Context, member: Optional[discord.Member] = None, weeks: int = 8):
+        """
+        View a member's stats for each of the last few weeks
+
+        **Arguments**
+        `member`: Whose history to view, defaults to you
+        `weeks`: How many of the most recent weeks to show (up to 25)
+        """
+        member = member or ctx.author
+        weeks = max(1, min(weeks, 25))
+        history = await asyncio.to_thread(self.archive.history, ctx.guild.id, member.id, weeks)
+        if not history:
+            return await ctx.send(_("There are no past weeks recorded yet"))
+
+        lines = []
+        for timestamp, xp, messages, voice in reversed(history):
+            line = _("`Exp: `{} `Messages: `{} `Voice: `{}").format(
+                humanize_number(xp), humanize_number(messages), time_formatter(voice)
+            )
+            lines.append(f"<t:{timestamp}:d> {line}")
+        total = sum(i[1] for i in history)
+        embed = discord.Embed(
+            title=_("{}'s Weekly History").format(member.name),
+            description="\n".join(lines),
+            color=member.color,
+        )
+        embed.set_footer(
+            text=_("{} exp over {} week(s), {} per week on average").format(
+                humanize_number(total), len(history), humanize_number(round(total / len(history)))
+            )
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="weeklystreaks")
+    @commands.guild_only()
+    @commands.bot_has_permissions(embed_links=True)
+    async def weekly_streaks(self, ctx: commands.Context):
+        """
+        View who has earned exp the most weeks in a row
+
+        Streaks count consecutive past weeks with any exp earned, up to the most recent reset.
+        """
+        streaks = await asyncio.to_thread(self.archive.streaks, ctx.guild.id)
+        if not streaks:
+            return await ctx.send(_("There are no past weeks recorded yet"))
+
+        ranked = sorted(streaks.items(), key=lambda x: x[1], reverse=True)
+        lines = []
+        for place, (uid, (current, best)) in enumerate(ranked[:10], start=1):
+            member = ctx.guild.get_member(uid)
+            lines.append(
+                _("**{}.** {}: `{}` week(s), best `{}`").format(place, member.name if member else uid, current, best)
+            )
+        embed = discord.Embed(title=_("Weekly Streaks"), description="\n".join(lines), color=ctx.author.color)
+        if ctx.author.id in streaks:
+            current, best = streaks[ctx.author.id]
+            embed.set_footer(text=_("Your streak: {} week(s), best {}").format(current, best))
+        await ctx.send(embed=embed)
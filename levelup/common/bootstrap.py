@@ -0,0 +1,31 @@
+"""
+Entry point for spawned render processes
+
+Spawned children unpickle their target by module name, which only works if they can import this
+package. Red doesn't always load cogs from a folder that's on sys.path, so instead of pointing the
+child at a function in this package directly, it's pointed at runpy.run_path (always importable)
+with this file's path. Run that way, it puts the folder the cog lives in on sys.path, then imports
+and calls the real target.
+"""
+import runpy
+import sys
+from pathlib import Path
+from typing import Callable, Tuple
+
+
+def spawn_target(func: Callable, *args) -> Tuple[Callable, tuple]:
+    """Target and args for a spawned process or pool initializer that calls func(*args) in the child"""
+    package = func.__module__.split(".")[0]
+    root = str(Path(sys.modules[package].__file__).parent.parent)
+    params = {"root": root, "module": func.__module__, "func": func.__name__, "args": args}
+    return runpy.run_path, (__file__, params)
+
+
+if __name__ == "<run_path>":
+    import importlib
+
+    # Globals passed in by spawn_target
+    params = globals()
+    if params["root"] not in sys.path:
+        sys.path.insert(0, params["root"])
+    getattr(importlib.import_module(params["module"]), params["func"])(*params["args"])
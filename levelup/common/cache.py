@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from time import monotonic, time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import requests
+
+T = TypeVar("T")
+log = logging.getLogger("red.vrt.levelup.cache")
+# Discord CDN paths that include a hash of the image, the content behind them never changes
+HASHED_PATHS = ("/avatars/", "/banners/", "/role-icons/", "/emojis/")
+
+
+class RenderCache:
+    """
+    Byte-bounded LRU cache for encoded images
+
+    Entries are keyed by a hash of the arguments used to render them, so a changed profile
+    always produces a new key and can never be served stale.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # key -> (encoded bytes, file extension, time stored)
+        self.entries: "OrderedDict[str, Tuple[bytes, str, float]]" = OrderedDict()
+        self.size = 0
+        # Optional owner of each entry (a user ID) so everything belonging to them can be dropped at once
+        self.tags: Dict[str, str] = {}
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash any json-able render arguments into a cache key"""
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[bytes, str]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        data, ext, ts = entry
+        if max_age is not None and monotonic() - ts > max_age:
+            self.pop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return data, ext
+
+    def put(self, key: str, data: bytes, ext: str, tag: Optional[str] = None) -> None:
+        if key in self.entries:
+            self.pop(key)
+        if len(data) > self.max_bytes:
+            # Never let a single entry flush the whole cache
+            return
+        self.entries[key] = (data, ext, monotonic())
+        self.size += len(data)
+        if tag is not None:
+            self.tags[key] = tag
+        self.evict()
+
+    def pop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+        self.tags.pop(key, None)
+
+    def invalidate(self, tag: str) -> int:
+        """Drop every entry stored under a tag, returns how many were dropped"""
+        keys = [k for k, t in self.tags.items() if t == tag]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def evict(self) -> None:
+        while self.size > self.max_bytes and self.entries:
+            key, (data, __, __) = self.entries.popitem(last=False)
+            self.size -= len(data)
+            self.tags.pop(key, None)
+            self.evictions += 1
+
+    def set_budget(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.tags.clear()
+        self.size = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single task
+
+    The first caller for a key starts the work, anyone asking for the same key while it is
+    still running awaits that task and shares its result.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Task] = {}
+
+        # Stats
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self.inflight)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        if task := self.inflight.get(key):
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.started += 1
+        task = asyncio.ensure_future(factory())
+        self.inflight[key] = task
+
+        def done(t: asyncio.Task):
+            if self.inflight.get(key) is t:
+                del self.inflight[key]
+            # Mark the exception as retrieved in case every waiter was cancelled
+            if not t.cancelled():
+                t.exception()
+
+        task.add_done_callback(done)
+        # Shield so one impatient caller being cancelled doesn't cancel the render for everyone else
+        return await asyncio.shield(task)
+
+
+class RemoteImageCache:
+    """
+    Size-bounded disk cache for downloaded images that survives restarts
+
+    Content is stored once per sha256 so the same image behind several urls only takes up space once.
+    Urls are served from disk without a request while fresh, then revalidated with ETag/Last-Modified
+    so unchanged images are never downloaded twice. Failed urls are remembered for a while so a dead
+    link isn't hit on every render.
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        max_bytes: int,
+        fresh: float = 3600,
+        negative: float = 300,
+        hashed: float = 86400,
+    ):
+        self.folder = folder
+        self.blobs = folder / "blobs"
+        self.index = folder / "index.json"
+        self.max_bytes = max_bytes
+        self.fresh = fresh  # Seconds to trust a cached url without asking the server
+        self.negative = negative  # Seconds to remember a failed url
+        self.hashed = hashed  # Seconds to trust a Discord CDN url that includes the image hash
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+
+        # url -> {"blob", "size", "etag", "modified", "checked", "used", "failed"}
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+        self.saved_at = 0.0
+        self.load()
+
+        # Stats
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.failures = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def size(self) -> int:
+        return sum({e["blob"]: e["size"] for e in self.entries.values() if e.get("blob")}.values())
+
+    def load(self) -> None:
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        if not self.index.exists():
+            return
+        try:
+            self.entries = json.loads(self.index.read_text())
+        except (ValueError, OSError):
+            log.warning("Remote image cache index is unreadable, starting fresh")
+            self.entries = {}
+
+    def save(self, force: bool = False) -> None:
+        """Write the index if it changed, at most every 30 seconds unless forced"""
+        with self.lock:
+            if not self.dirty or (not force and monotonic() - self.saved_at < 30):
+                return
+            raw = json.dumps(self.entries)
+            self.dirty = False
+            self.saved_at = monotonic()
+        tmp = self.index.with_suffix(".tmp")
+        tmp.write_text(raw)
+        tmp.replace(self.index)
+
+    def fresh_for(self, url: str) -> float:
+        if url.startswith(("https://cdn.discordapp.com", "https://media.discordapp.net")) and any(
+            p in url for p in HASHED_PATHS
+        ):
+            return self.hashed
+        return self.fresh
+
+    def read_blob(self, entry: dict) -> Optional[bytes]:
+        try:
+            return (self.blobs / entry["blob"]).read_bytes()
+        except (KeyError, OSError):
+            return None
+
+    def update(self, url: str, **fields) -> None:
+        with self.lock:
+            self.entries.setdefault(url, {}).update(fields)
+            self.dirty = True
+
+    def get(self, url: str) -> Optional[bytes]:
+        now = time()
+        with self.lock:
+            entry = dict(self.entries.get(url, {}))
+
+        if entry.get("failed") and now - entry.get("checked", 0) < self.negative:
+            return None
+        data = self.read_blob(entry) if entry.get("blob") else None
+        if data is not None and now - entry.get("checked", 0) < self.fresh_for(url):
+            self.hits += 1
+            self.update(url, used=now)
+            return data
+
+        headers = {}
+        if data is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("modified"):
+                headers["If-Modified-Since"] = entry["modified"]
+        try:
+            res = self.session.get(url, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            log.warning(f"Failed to get image from url: {url}\nError: {e}")
+            if data is not None:
+                # Serve what we have, it'll be revalidated next time
+                return data
+            self.failures += 1
+            self.update(url, failed=True, checked=now)
+            return None
+
+        if res.status_code == 304 and data is not None:
+            self.revalidated += 1
+            self.update(url, checked=now, used=now)
+            return data
+        if not res.ok or not res.content:
+            self.failures += 1
+            self.update(url, failed=True, checked=now)
+            return None
+
+        data = res.content
+        blob = hashlib.sha256(data).hexdigest()
+        path = self.blobs / blob
+        if not path.exists():
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        self.downloads += 1
+        self.update(
+            url,
+            blob=blob,
+            size=len(data),
+            etag=res.headers.get("ETag"),
+            modified=res.headers.get("Last-Modified"),
+            checked=now,
+            used=now,
+            failed=False,
+        )
+        self.evict()
+        self.save()
+        return data
+
+    def evict(self) -> None:
+        """Drop the least recently used urls until the stored images fit the budget"""
+        with self.lock:
+            # Failures that have expired are just dead weight in the index
+            expired = time() - self.negative
+            for url in [u for u, e in self.entries.items() if e.get("failed") and e.get("checked", 0) < expired]:
+                del self.entries[url]
+                self.dirty = True
+            blobs: Dict[str, int] = {}
+            refs: Dict[str, int] = {}
+            for entry in self.entries.values():
+                if blob := entry.get("blob"):
+                    blobs[blob] = entry["size"]
+                    refs[blob] = refs.get(blob, 0) + 1
+            size = sum(blobs.values())
+            if size <= self.max_bytes:
+                return
+            for url, entry in sorted(self.entries.items(), key=lambda i: i[1].get("used", 0)):
+                if size <= self.max_bytes:
+                    break
+                del self.entries[url]
+                self.evictions += 1
+                if blob := entry.get("blob"):
+                    refs[blob] -= 1
+                    if not refs[blob]:
+                        size -= blobs[blob]
+                        (self.blobs / blob).unlink(missing_ok=True)
+            self.dirty = True
+
+    def set_budget(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def forget(self, url: str) -> None:
+        """Drop a url so the next request downloads it again"""
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is None:
+                return
+            self.dirty = True
+            blob = entry.get("blob")
+            if blob and not any(e.get("blob") == blob for e in self.entries.values()):
+                (self.blobs / blob).unlink(missing_ok=True)
+
+    def forget_matching(self, text: str) -> int:
+        """Drop every url containing the given text, returns how many were dropped"""
+        with self.lock:
+            urls = [url for url in self.entries if text in url]
+        for url in urls:
+            self.forget(url)
+        return len(urls)
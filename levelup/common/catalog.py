@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageFont, UnidentifiedImageError
+
+log = logging.getLogger("red.vrt.levelup.catalog")
+
+IMAGE_TYPES = {".webp", ".png", ".jpg", ".jpeg", ".gif"}
+FONT_TYPES = {".ttf", ".otf"}
+
+
+class Asset(NamedTuple):
+    name: str  # File name
+    path: Path
+    format: str  # Image format or font file type
+    size: Optional[Tuple[int, int]]  # Image dimensions, None for fonts
+    family: Optional[str]  # Font family, None for images
+    mtime: int
+
+
+def normalize(name: str) -> str:
+    return name.strip().lower()
+
+
+class AssetCatalog:
+    """
+    In-memory index of the backgrounds or fonts spread over the bundled and saved folders
+
+    Entries are keyed by normalized file name and file stem so lookups don't need to touch the disk.
+    The folders' mtimes are checked on access, so files added or removed by hand are picked up without a reload.
+    Scans open every file, callers on the event loop should refresh in a thread before looking anything up.
+    """
+
+    def __init__(self, *folders: Path, fonts: bool = False):
+        self.folders = folders
+        self.fonts = fonts
+        self.suffixes = FONT_TYPES if fonts else IMAGE_TYPES
+        self.lock = threading.Lock()
+
+        self.entries: Dict[str, Asset] = {}  # normalized file name -> Asset
+        self.stems: Dict[str, Asset] = {}  # normalized file name without extension -> Asset
+        self.partials: Dict[str, Optional[Asset]] = {}  # resolved substring lookups
+        self.stamp: Tuple[int, ...] = ()
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Asset]:
+        self.refresh()
+        return iter(list(self.entries.values()))
+
+    def names(self) -> List[str]:
+        return [asset.name for asset in self]
+
+    def get_stamp(self) -> Tuple[int, ...]:
+        stamp = []
+        for folder in self.folders:
+            try:
+                stamp.append(folder.stat().st_mtime_ns)
+            except FileNotFoundError:
+                stamp.append(0)
+        return tuple(stamp)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rebuild the index if forced or if any folder changed since the last scan"""
+        stamp = self.get_stamp()
+        if not force and stamp == self.stamp:
+            return False
+        with self.lock:
+            if not force and stamp == self.stamp:
+                return False
+            self.scan()
+            self.stamp = stamp
+        return True
+
+    def scan(self) -> None:
+        entries: Dict[str, Asset] = {}
+        stems: Dict[str, Asset] = {}
+        for folder in self.folders:
+            if not folder.exists():
+                continue
+            for path in sorted(folder.iterdir()):
+                if not path.is_file() or path.suffix.lower() not in self.suffixes:
+                    continue
+                asset = self.describe(path)
+                if asset is None:
+                    continue
+                entries[normalize(path.name)] = asset
+                stems.setdefault(normalize(path.stem), asset)
+        self.entries = entries
+        self.stems = stems
+        self.partials = {}
+
+    def describe(self, path: Path) -> Optional[Asset]:
+        mtime = path.stat().st_mtime_ns
+        if self.fonts:
+            try:
+                family = ImageFont.truetype(str(path), 12).getname()[0]
+            except OSError:
+                log.warning(f"Skipping unreadable font {path.name}")
+                return None
+            return Asset(path.name, path, path.suffix[1:].upper(), None, family, mtime)
+        try:
+            # Only reads the header
+            with Image.open(path) as img:
+                size, fmt = img.size, img.format
+        except (UnidentifiedImageError, OSError):
+            log.warning(f"Skipping unreadable background {path.name}")
+            return None
+        return Asset(path.name, path, fmt, size, None, mtime)
+
+    def get(self, name: str) -> Optional[Asset]:
+        """Exact lookup by file name, with or without its extension"""
+        if not name:
+            return None
+        self.refresh()
+        key = normalize(name)
+        return self.entries.get(key) or self.stems.get(key)
+
+    def find(self, name: str) -> Optional[Asset]:
+        """Like get, but falls back to the first file whose name contains the given text"""
+        if asset := self.get(name):
+            return asset
+        if not name:
+            return None
+        key = normalize(name)
+        if key not in self.partials:
+            self.partials[key] = next((a for k, a in self.entries.items() if key in k), None)
+        return self.partials[key]
+
+    def random(self) -> Optional[Asset]:
+        self.refresh()
+        if not self.entries:
+            return None
+        return random.choice(list(self.entries.values()))
+
+    def shuffled(self) -> List[Asset]:
+        assets = list(self)
+        random.shuffle(assets)
+        return assets
+
@@ -32,7 +32,7 @@ default_guild = {
     "notifylog": None,  # Notify member of level up in a set channel
     "notify": False,  # Toggle whether to notify member of levelups if notify log channel is not set,
     "weekly": {  # Weekly tracking
-        "users": {},  # Wiped weekly
+        "baseline": {"ids": [], "xp": [], "messages": [], "voice": []},  # Totals at the last reset, by column
         "on": False,  # Weekly stats are being tracked for this guild or not
         "autoreset": False,  # Whether to auto reset once a week or require manual reset
         "reset_hour": 0,  # 0 - 23 hour (UTC time)
@@ -59,5 +59,12 @@ default_guild = {
 default_global = {
     "ignored_guilds": [],
     "cache_seconds": 15,
+    "profile_cache_mb": 64,  # Memory budget for encoded profile images
+    "image_cache_mb": 256,  # Disk budget for downloaded avatars, banners and backgrounds
+    "notify_window": 2,  # Seconds level up alerts wait to be batched per channel
     "render_gifs": False,
+    "animated_webp": False,  # Encode animated profiles as WEBP instead of GIF
+    "render_workers": 2,  # Render threads
+    "render_queue": 32,  # Max renders waiting before new ones are rejected
+    "render_backend": "thread",  # thread, process or service
 }
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import threading
+from math import ceil
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from PIL import Image
+
+from .catalog import Asset, AssetCatalog, normalize
+
+log = logging.getLogger("red.vrt.levelup.gallery")
+# Bump when thumbnails or sheets are drawn differently so old files on disk get replaced
+VERSION = 1
+
+
+class Gallery:
+    """
+    Paginated preview sheets for everything in an asset catalog, persisted to disk
+
+    Each asset gets a small thumbnail that is cached on disk until the file changes, and each page
+    is saved under a fingerprint of the assets on it. Adding or removing a file only rebuilds pages
+    whose contents changed, and rebuilding a page only pastes the thumbnails that already exist.
+    """
+
+    def __init__(
+        self,
+        catalog: AssetCatalog,
+        folder: Path,
+        make_thumbnail: Callable[[Asset], Image.Image],
+        tile: Tuple[int, int],
+        columns: int,
+        rows: int,
+    ):
+        self.catalog = catalog
+        self.folder = folder
+        self.thumbs = folder / "thumbs"
+        self.make_thumbnail = make_thumbnail
+        self.tile = tile
+        self.columns = columns
+        self.rows = rows
+        self.lock = threading.Lock()
+
+    @property
+    def per_page(self) -> int:
+        return self.columns * self.rows
+
+    def get_pages(self) -> List[List[Asset]]:
+        assets = sorted(self.catalog, key=lambda a: normalize(a.name))
+        return [assets[i : i + self.per_page] for i in range(0, len(assets), self.per_page)]
+
+    def page_count(self) -> int:
+        return max(1, ceil(len(self.catalog) / self.per_page))
+
+    def fingerprint(self, assets: List[Asset]) -> str:
+        raw = json.dumps([VERSION, self.tile, self.columns, [(a.name, a.mtime) for a in assets]])
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def thumbnail_path(self, asset: Asset) -> Path:
+        raw = json.dumps([VERSION, self.tile, str(asset.path), asset.mtime])
+        return self.thumbs / f"{hashlib.sha1(raw.encode()).hexdigest()[:16]}.webp"
+
+    def get_thumbnail(self, asset: Asset) -> Image.Image:
+        path = self.thumbnail_path(asset)
+        if path.exists():
+            with Image.open(path) as img:
+                return img.convert("RGBA")
+        img = self.make_thumbnail(asset)
+        img.save(path, format="WEBP", quality=90)
+        return img
+
+    def get_page(self, page: int) -> Tuple[Path, List[Asset]]:
+        """
+        Get the sheet for a page (0 indexed), building it if it's missing or out of date
+
+        Returns the path to the sheet and the assets on it
+        """
+        pages = self.get_pages()
+        if not pages:
+            raise FileNotFoundError("There is nothing in this catalog to preview")
+        page = max(0, min(page, len(pages) - 1))
+        assets = pages[page]
+        path = self.folder / f"page-{page}-{self.fingerprint(assets)}.webp"
+        with self.lock:
+            if not path.exists():
+                self.thumbs.mkdir(parents=True, exist_ok=True)
+                self.build(path, assets)
+                self.prune(pages)
+        return path, assets
+
+    def build(self, path: Path, assets: List[Asset]) -> None:
+        width, height = self.tile
+        rows = ceil(len(assets) / self.columns)
+        columns = min(len(assets), self.columns)
+        # Sized once up front, thumbnails are pasted straight into their slot
+        sheet = Image.new("RGBA", (columns * width, rows * height), (0, 0, 0, 0))
+        for index, asset in enumerate(assets):
+            try:
+                thumb = self.get_thumbnail(asset)
+            except Exception as e:
+                log.warning(f"Failed to prep preview for {asset.name}", exc_info=e)
+                continue
+            row, column = divmod(index, self.columns)
+            sheet.paste(thumb, (column * width, row * height))
+
+        # Write then rename so a half written sheet is never served
+        tmp = path.with_suffix(".tmp")
+        sheet.save(tmp, format="WEBP", quality=85)
+        tmp.replace(path)
+
+    def prune(self, pages: List[List[Asset]]) -> None:
+        """Delete sheets and thumbnails that no longer match anything in the catalog"""
+        current = {f"page-{i}-{self.fingerprint(assets)}.webp" for i, assets in enumerate(pages)}
+        for file in self.folder.glob("page-*.webp"):
+            if file.name not in current:
+                file.unlink(missing_ok=True)
+        thumbs = {self.thumbnail_path(asset).name for assets in pages for asset in assets}
+        for file in self.thumbs.glob("*.webp"):
+            if file.name not in thumbs:
+                file.unlink(missing_ok=True)
@@ -1,11 +1,14 @@
+import hashlib
 import logging
 import os
 import random
+import threading
 from abc import ABC
+from functools import lru_cache
 from io import BytesIO
 from math import ceil, sqrt
 from pathlib import Path
-from typing import List, Union
+from typing import Callable, List, Optional, Tuple, Union
 from .base import get_level_color
 import colorgram
 from discord import Member
@@ -18,19 +21,72 @@ from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils.chat_formatting import humanize_number
 
 from ..abc import MixinMeta
-from ..utils.core import Pilmoji
+from ..utils.core import EmojiProvider, Pilmoji
+from ..utils.source import LocalEmojiSource
+from .cache import RemoteImageCache
+from .catalog import Asset, AssetCatalog
+from .gallery import Gallery
+from .scheduler import check_cancelled
 
 log = logging.getLogger("red.vrt.levelup.generator")
 _ = Translator("LevelUp", __file__)
 ASPECT_RATIO = (21, 9)
+# Animated profile limits
+MAX_FRAMES = 60
+MAX_DURATION = 15000  # ms
+MIN_FRAME_DURATION = 20  # ms, most clients slow down anything faster than this
+GIF_TRANSPARENT = 255  # Palette index reserved for transparent pixels in animated gifs
+# Images with more pixels than this are refused before decoding, a 6000x4000 wallpaper is 24 million
+MAX_PIXELS = 50_000_000
+# Level up cards keep the resolution of their background, so decode it no bigger than needed for this
+LEVELUP_SIZE = (900, 300)
+# Background previews in the gallery, same aspect ratio as the full card backgrounds
+BG_THUMBNAIL = (350, 150)
+FONT_THUMBNAIL = (650, 65)
+# Sizes user background urls are stored at when set, and the aspect ratio each is cropped to
+PINNED_SIZES = {(1050, 450): ASPECT_RATIO, (770, 240): (22, 7)}
+
+# Per thread font cache, FreeType faces should not be shared between render threads
+_fonts = threading.local()
+
+
+def get_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    cache = getattr(_fonts, "cache", None)
+    if cache is None:
+        cache = _fonts.cache = lru_cache(maxsize=256)(ImageFont.truetype)
+    return cache(str(path), size)
+
+
+def read_asset(path: Path) -> bytes:
+    """Read a local asset, keeping recently used files in memory until they change on disk"""
+    return _read_asset(str(path), os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=32)
+def _read_asset(path: str, mtime: int) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
 
 @cog_i18n(_)
 class Generator(MixinMeta, ABC):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.setup_assets(bundled_data_path(self), cog_data_path(self))
+
+        # Cleanup old files from conversion to webp
+        delete: List[Path] = []
+        for file in self.backgrounds.iterdir():
+            if file.name.endswith(".py") or file.is_dir():
+                continue
+            if not file.name.endswith(".webp"):
+                delete.append(file)
+        for i in delete:
+            i.unlink(missing_ok=True)
+
+    def setup_assets(self, maindir: Path, savedir: Path):
+        """Point the generator at its asset folders, kept apart from __init__ so render workers can use it"""
         # Included Assets
-        maindir = bundled_data_path(self)
         self.default_pfp = maindir / "defaultpfp.png"
         self.status = {
             "online": maindir / "online.png",
@@ -44,21 +100,46 @@ class Generator(MixinMeta, ABC):
         self.backgrounds = maindir / "backgrounds"
 
         # Saved Assets
-        savedir = cog_data_path(self)
         self.saved_bgs = savedir / "backgrounds"
         self.saved_bgs.mkdir(exist_ok=True)
         self.saved_fonts = savedir / "fonts"
         self.saved_fonts.mkdir(exist_ok=True)
+        # User background urls, downloaded and resized when they're set
+        self.pinned = savedir / "pinned"
+        self.pinned.mkdir(exist_ok=True)
+
+        # Indexed lookups so renders don't list the folders every time
+        self.bg_catalog = AssetCatalog(self.backgrounds, self.saved_bgs)
+        self.font_catalog = AssetCatalog(self.fonts, self.saved_fonts, fonts=True)
+
+        # Disk cache for downloaded images, only the cog sets one up
+        self.remote: Optional[RemoteImageCache] = None
+
+        # Shared by every render so emojis are only downloaded and resized once
+        self.emojis = EmojiProvider(LocalEmojiSource(maindir / "emojis", savedir=savedir / "emojis"))
+
+        # Preview sheets for the gallery commands, built lazily
+        self.bg_gallery = Gallery(
+            self.bg_catalog,
+            savedir / "gallery" / "backgrounds",
+            self.get_background_thumbnail,
+            tile=BG_THUMBNAIL,
+            columns=4,
+            rows=5,
+        )
+        self.font_gallery = Gallery(
+            self.font_catalog,
+            savedir / "gallery" / "fonts",
+            self.get_font_thumbnail,
+            tile=FONT_THUMBNAIL,
+            columns=2,
+            rows=15,
+        )
 
-        # Cleanup old files from conversion to webp
-        delete: List[Path] = []
-        for file in self.backgrounds.iterdir():
-            if file.name.endswith(".py") or file.is_dir():
-                continue
-            if not file.name.endswith(".webp"):
-                delete.append(file)
-        for i in delete:
-            i.unlink(missing_ok=True)
+    def render_image(self, method: str, **kwargs) -> Tuple[bytes, str]:
+        """Render and encode an image in one go so only bytes have to leave the render worker"""
+        img = getattr(self, method)(**kwargs)
+        return self.encode_image(img)
 
     @perf(max_entries=1000)
     def generate_profile(
@@ -81,36 +162,12 @@ class Generator(MixinMeta, ABC):
         font_name: str = None,
         render_gifs: bool = False,
         blur: bool = True,
+        animated_format: str = "gif",
     ):
         # get profile pic
-        if profile_image:
-            pfp_image = self.get_image_content_from_url(str(profile_image))
-            profile_bytes = BytesIO(pfp_image)
-            profile = Image.open(profile_bytes)
-        else:
-            profile = Image.open(self.default_pfp)
+        profile = self.load_profile(profile_image, (300, 300))
         # Get background
-        available = list(self.backgrounds.iterdir()) + list(self.saved_bgs.iterdir())
-        card = None
-        if bg_image and str(bg_image) != "random":
-            if not bg_image.lower().startswith("http"):
-                for file in available:
-                    if bg_image.lower() in file.name.lower():
-                        try:
-                            card = Image.open(file)
-                            break
-                        except OSError:
-                            log.info(f"Failed to load {bg_image}")
-
-            if not card and bg_image.lower().startswith("http"):
-                try:
-                    bg_bytes = self.get_image_content_from_url(bg_image)
-                    card = Image.open(BytesIO(bg_bytes))
-                except UnidentifiedImageError:
-                    pass
-
-        if not card:
-            card = self.get_random_background()
+        card = self.load_background(bg_image, (1050, 450))
 
         card = (
             self.force_aspect_ratio(card)
@@ -118,6 +175,7 @@ class Generator(MixinMeta, ABC):
             .resize((1050, 450), Image.Resampling.NEAREST)
         )
 
+        check_cancelled()
         # Colors
         # Color distancing is more strict if user hasn't defined color
         namedistance = 200
@@ -204,8 +262,10 @@ class Generator(MixinMeta, ABC):
         final = Image.alpha_composite(card, blank)
 
         # Make the level progress bar
+        # Drawn at 4x within the bar's own bounds and resampled down to 1x for smooth edges
+        bar_size = (bar_end - bar_start + 1, bar_bottom - bar_top + 1)
         progress_bar = Image.new(
-            "RGBA", (card.size[0] * 4, card.size[1] * 4), (255, 255, 255, 0)
+            "RGBA", (bar_size[0] * 4, bar_size[1] * 4), (255, 255, 255, 0)
         )
         progress_bar_draw = ImageDraw.Draw(progress_bar)
         # Calculate data for level bar
@@ -213,11 +273,11 @@ class Generator(MixinMeta, ABC):
         next_xp_diff = next_xp - prev_xp
         xp_ratio = user_xp_progress / next_xp_diff
         end_of_inner_bar = ((bar_end - bar_start) * xp_ratio) + bar_start
-        # Rectangle 0:left x, 1:top y, 2:right x, 3:bottom y
+        # Rectangle 0:left x, 1:top y, 2:right x, 3:bottom y, relative to the bar
         # Draw level bar outline
         thickness = 8
         progress_bar_draw.rounded_rectangle(
-            (bar_start * 4, bar_top * 4, bar_end * 4, bar_bottom * 4),
+            (0, 0, (bar_end - bar_start) * 4, (bar_bottom - bar_top) * 4),
             fill=(255, 255, 255, 0),
             outline=lvlbarcolor,
             width=thickness,
@@ -227,17 +287,17 @@ class Generator(MixinMeta, ABC):
         if end_of_inner_bar > bar_start + 10:
             progress_bar_draw.rounded_rectangle(
                 (
-                    bar_start * 4 + thickness,
-                    bar_top * 4 + thickness,
-                    end_of_inner_bar * 4 - thickness,
-                    bar_bottom * 4 - thickness,
+                    thickness,
+                    thickness,
+                    (end_of_inner_bar - bar_start) * 4 - thickness,
+                    (bar_bottom - bar_top) * 4 - thickness,
                 ),
                 fill=lvlbarcolor,
                 radius=89,
             )
-        progress_bar = progress_bar.resize(card.size, Image.Resampling.NEAREST)
+        progress_bar = progress_bar.resize(bar_size, Image.Resampling.NEAREST)
         # Image with level bar and pfp on background
-        final = Image.alpha_composite(final, progress_bar)
+        final.alpha_composite(progress_bar, (bar_start, bar_top))
 
         # Stat strings
         rank = _("Rank: #") + str(user_position)
@@ -251,17 +311,15 @@ class Generator(MixinMeta, ABC):
 
         # Get base font
         base_font = self.font
-        if font_name:
-            fontfile = os.path.join(self.fonts, font_name)
-            if os.path.exists(fontfile):
-                base_font = fontfile
+        if font_name and (font_asset := self.font_catalog.get(font_name)):
+            base_font = str(font_asset.path)
         # base_font = self.get_random_font()
         # Setup font sizes
         name_size = 60
-        name_font = ImageFont.truetype(base_font, name_size)
+        name_font = get_font(base_font, name_size)
         while (name_font.getlength(user_display_name) + bar_start + 20) > 900:
             name_size -= 1
-            name_font = ImageFont.truetype(base_font, name_size)
+            name_font = get_font(base_font, name_size)
             name_y += 0.1
         name_y = round(name_y)
         nameht = name_font.getbbox(user_display_name)
@@ -270,27 +328,27 @@ class Generator(MixinMeta, ABC):
         emoji_scale = 1.2
         stats_size = 35
         stat_offset = stats_size + 5
-        stats_font = ImageFont.truetype(base_font, stats_size)
+        stats_font = get_font(base_font, stats_size)
         while (stats_font.getlength(leveltxt) + bar_start + 10) > bar_start + 210:
             stats_size -= 1
             emoji_scale += 0.1
-            stats_font = ImageFont.truetype(base_font, stats_size)
+            stats_font = get_font(base_font, stats_size)
         # Also check message box
         while (
             stats_font.getlength(message_count) + bar_start + 220
         ) > final.width - 10:
             stats_size -= 1
             emoji_scale += 0.1
-            stats_font = ImageFont.truetype(base_font, stats_size)
+            stats_font = get_font(base_font, stats_size)
         # And rank box
         while (stats_font.getlength(rank) + bar_start + 10) > bar_start + 210:
             stats_size -= 1
             emoji_scale += 0.1
-            stats_font = ImageFont.truetype(base_font, stats_size)
+            stats_font = get_font(base_font, stats_size)
         # And exp text
         while (stats_font.getlength(exp) + bar_start + 10) > final.width - 10:
             stats_size -= 1
-            stats_font = ImageFont.truetype(base_font, stats_size)
+            stats_font = get_font(base_font, stats_size)
 
         # Get status image and paste to profile
         blank = Image.new("RGBA", card.size, (255, 255, 255, 0))
@@ -303,7 +361,7 @@ class Generator(MixinMeta, ABC):
         status = status_img.convert("RGBA").resize((60, 60), Image.Resampling.NEAREST)
 
         # Role icon
-        role_bytes = self.get_image_content_from_url(role_icon) if role_icon else None
+        role_bytes = self.load_bytes(role_icon)
         if role_bytes:
             role_bytes = BytesIO(role_bytes)
             role_icon_img = Image.open(role_bytes).resize(
@@ -314,9 +372,10 @@ class Generator(MixinMeta, ABC):
         # New final
         final = Image.alpha_composite(final, blank)
 
+        check_cancelled()
         # Add stats text
         # Render name and credits text through pilmoji in case there are emojis
-        with Pilmoji(final) as pilmoji:
+        with Pilmoji(final, provider=self.emojis) as pilmoji:
             # Name text
             name_bbox = name_font.getbbox(user_display_name)
             name_emoji_y = name_bbox[3] - name_size
@@ -406,94 +465,31 @@ class Generator(MixinMeta, ABC):
         final.paste(circle_img, (circle_x - 15, circle_y - 15), circle_img)
 
         # Handle profile pic image to paste to card
+        # Only the avatar's bounding box changes between frames, everything around it is rendered once
+        box = (circle_x, circle_y, circle_x + 300, circle_y + 300)
+        backdrop = final.crop(box)
+        # Mask to crop profile pic image to a circle
+        # draw at 4x size and resample down to 1x for a nice smooth circle
+        mask = Image.new("L", (1200, 1200), 0)
+        ImageDraw.Draw(mask).ellipse([0, 0, 1200, 1200], fill=255)
+        mask = mask.resize((300, 300), Image.Resampling.NEAREST)
+
+        def avatar_tile(avatar: Image.Image) -> Image.Image:
+            layer = Image.new("RGBA", mask.size, (0, 0, 0, 0))
+            layer.paste(avatar, (0, 0), mask)
+            tile = Image.alpha_composite(backdrop, layer)
+            # Paste status over profile ring
+            tile.alpha_composite(status, (230, 240))
+            return tile
+
         # If animated and render gifs enabled, render as a gif
         is_animated = getattr(profile, "is_animated", False)
         if is_animated and render_gifs:
-            duration = self.get_avg_duration(profile)
-            frames = []
-            for i in range(profile.n_frames):
-                profile.seek(i)
-                prof_img = profile.convert("RGBA").resize(
-                    (300, 300), Image.Resampling.NEAREST
-                )
-                # Mask to crop profile pic image to a circle
-                # draw at 4x size and resample down to 1x for a nice smooth circle
-                mask = Image.new("RGBA", ((card.size[0] * 4), (card.size[1] * 4)), 0)
-                mask_draw = ImageDraw.Draw(mask)
-                mask_draw.ellipse(
-                    [
-                        circle_x * 4,
-                        circle_y * 4,
-                        (300 + circle_x) * 4,
-                        (300 + circle_y) * 4,
-                    ],
-                    fill=(255, 255, 255, 255),
-                )
-                mask = mask.resize(card.size, Image.Resampling.NEAREST)
-                # make a new Image to set up card-sized image for pfp layer and the circle mask for it
-                profile_pic_holder = Image.new("RGBA", card.size, (255, 255, 255, 0))
-                # paste on square profile pic in appropriate spot
-                profile_pic_holder.paste(prof_img, (circle_x, circle_y))
-                # make a new Image at card size to crop pfp with transparency to the circle mask
-                pfp_composite_holder = Image.new("RGBA", card.size, (0, 0, 0, 0))
-                pfp_composite_holder = Image.composite(
-                    profile_pic_holder, pfp_composite_holder, mask
-                )
-                # Profile image is on the background tile now
-                pre = Image.alpha_composite(final, pfp_composite_holder)
-                # Paste status over profile ring
-                blank = Image.new("RGBA", card.size, (255, 255, 255, 0))
-                blank.paste(status, (circle_x + 230, circle_y + 240))
-                pre = Image.alpha_composite(pre, blank)
-                frames.append(pre)
-
-            tmp = BytesIO()
-            frames[0].save(
-                tmp,
-                save_all=True,
-                append_images=frames[1:],
-                duration=duration,
-                format="GIF",
-                loop=0,
-                quality=25,
-            )
-            tmp.seek(0)
-            final = Image.open(tmp)
-
-        else:
-            profile = profile.convert("RGBA").resize(
-                (300, 300), Image.Resampling.NEAREST
-            )
-            # Mask to crop profile pic image to a circle
-            # draw at 4x size and resample down to 1x for a nice smooth circle
-            mask = Image.new("RGBA", ((card.size[0] * 4), (card.size[1] * 4)), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse(
-                [
-                    circle_x * 4,
-                    circle_y * 4,
-                    (300 + circle_x) * 4,
-                    (300 + circle_y) * 4,
-                ],
-                fill=(255, 255, 255, 255),
-            )
-            mask = mask.resize(card.size, Image.Resampling.NEAREST)
-            # make a new Image to set up card-sized image for pfp layer and the circle mask for it
-            profile_pic_holder = Image.new("RGBA", card.size, (255, 255, 255, 0))
-            # paste on square profile pic in appropriate spot
-            profile_pic_holder.paste(profile, (circle_x, circle_y))
-            # make a new Image at card size to crop pfp with transparency to the circle mask
-            pfp_composite_holder = Image.new("RGBA", card.size, (0, 0, 0, 0))
-            pfp_composite_holder = Image.composite(
-                profile_pic_holder, pfp_composite_holder, mask
-            )
-            # Profile image is on the background tile now
-            final = Image.alpha_composite(final, pfp_composite_holder)
-            # Paste status over profile ring
-            blank = Image.new("RGBA", card.size, (255, 255, 255, 0))
-            blank.paste(status, (circle_x + 230, circle_y + 240))
-            final = Image.alpha_composite(final, blank)
+            tiles = self.get_avatar_tiles(profile, (300, 300), avatar_tile)
+            return self.encode_animation(final, box, tiles, animated_format)
 
+        profile = profile.convert("RGBA").resize((300, 300), Image.Resampling.NEAREST)
+        final.paste(avatar_tile(profile), box[:2])
         return final
 
     @perf(max_entries=1000)
@@ -517,6 +513,7 @@ class Generator(MixinMeta, ABC):
         font_name: str = None,
         render_gifs: bool = False,
         blur: bool = True,
+        animated_format: str = "gif",
     ):
         
         # Color distancing is more strict if user hasn't defined color
@@ -543,27 +540,7 @@ class Generator(MixinMeta, ABC):
         aspect_ratio = (22, 7)
 
         # Get background
-        available = list(self.backgrounds.iterdir()) + list(self.saved_bgs.iterdir())
-        card = None
-        if bg_image and str(bg_image) != "random":
-            if not bg_image.lower().startswith("http"):
-                for file in available:
-                    if bg_image.lower() in file.name.lower():
-                        try:
-                            card = Image.open(file)
-                            break
-                        except OSError:
-                            log.info(f"Failed to load {bg_image}")
-
-            if not card and bg_image.lower().startswith("http"):
-                try:
-                    bg_bytes = self.get_image_content_from_url(bg_image)
-                    card = Image.open(BytesIO(bg_bytes))
-                except UnidentifiedImageError:
-                    pass
-
-        if not card:
-            card = self.get_random_background()
+        card = self.load_background(bg_image, (770, 240))
 
         card = self.force_aspect_ratio(card, aspect_ratio)
         card = card.convert("RGBA").resize((770, 240), Image.Resampling.NEAREST)
@@ -573,6 +550,7 @@ class Generator(MixinMeta, ABC):
             log.error(f"Failed to get slim profile BG color: {e}")
             bgcolor = base
 
+        check_cancelled()
         # Compare text colors to BG
         iters = 0
         while self.distance(namecolor, bgcolor) < namedistance:
@@ -632,24 +610,22 @@ class Generator(MixinMeta, ABC):
         name = user_name
 
         base_font = self.font
-        if font_name:
-            fontfile = os.path.join(self.fonts, font_name)
-            if os.path.exists(fontfile):
-                base_font = fontfile
+        if font_name and (font_asset := self.font_catalog.get(font_name)):
+            base_font = str(font_asset.path)
         displaynamesize = 35
         statsize = 25
-        displaynamefont = ImageFont.truetype(base_font, displaynamesize)
-        statfont = ImageFont.truetype(base_font, statsize)
+        displaynamefont = get_font(base_font, displaynamesize)
+        statfont = get_font(base_font, statsize)
 
         while (displaynamefont.getlength(display_name) + 260) > 770:
             displaynamesize -= 1
-            displaynamefont = ImageFont.truetype(base_font, displaynamesize)
+            displaynamefont = get_font(base_font, displaynamesize)
         while (statfont.getlength(messages) + 465) > 890:
             statsize -= 1
-            statfont = ImageFont.truetype(base_font, statsize)
+            statfont = get_font(base_font, statsize)
         while (statfont.getlength(level) + 260) > 455:
             statsize -= 1
-            statfont = ImageFont.truetype(base_font, statsize)
+            statfont = get_font(base_font, statsize)
 
         # Stat text
         draw.text(
@@ -712,14 +688,15 @@ class Generator(MixinMeta, ABC):
             stroke_fill=text_bg,
         )
 
-        # Adding another blank layer for the progress bar
-        progress_bar = Image.new("RGBA", card.size, (255, 255, 255, 0))
-        progress_bar_draw = ImageDraw.Draw(progress_bar)
+        # Adding another blank layer for the progress bar, only as big as the bar itself
         bar_start = 260
         bar_end = 740
-        # rectangle 0:x, 1:top y, 2:length, 3:bottom y
+        bar_top = 200
+        progress_bar = Image.new("RGBA", (bar_end - bar_start + 1, 16), (255, 255, 255, 0))
+        progress_bar_draw = ImageDraw.Draw(progress_bar)
+        # rectangle 0:x, 1:top y, 2:length, 3:bottom y, relative to the bar
         progress_bar_draw.rounded_rectangle(
-            (bar_start, 200, bar_end, 215),
+            (0, 0, bar_end - bar_start, 15),
             fill=(255, 255, 255, 0),
             outline=lvlbarcolor,
             radius=90,
@@ -729,7 +706,9 @@ class Generator(MixinMeta, ABC):
         end_of_inner_bar = ((bar_end - bar_start) * xp_ratio) + bar_start
         barx, barlength = bar_start + 2, end_of_inner_bar - 2
         if barlength > barx:
-            progress_bar_draw.rounded_rectangle((barx, 203, barlength, 212), fill=lvlbarcolor, radius=89)
+            progress_bar_draw.rounded_rectangle(
+                (barx - bar_start, 3, barlength - bar_start, 12), fill=lvlbarcolor, radius=89
+            )
 
         # pfp border - draw at 4x and resample down to 1x for nice smooth circles
         circle_img = Image.new("RGBA", (800, 800))
@@ -741,38 +720,25 @@ class Generator(MixinMeta, ABC):
         card.paste(circle_img, (19, 19), circle_img)
 
         # get profile pic
-        if profile_image:
-            pfp_image = self.get_image_content_from_url(str(profile_image))
-            profile_bytes = BytesIO(pfp_image)
-            profile = Image.open(profile_bytes)
-        else:
-            profile = Image.open(self.default_pfp)
+        profile = self.load_profile(profile_image, (180, 180))
 
         profile = profile.convert("RGBA").resize((180, 180), Image.Resampling.NEAREST)
 
         # Mask to crop profile pic image to a circle
-        # draw at 4x size and resample down to 1x for a nice smooth circle
-        mask = Image.new("RGBA", ((card.size[0] * 4), (card.size[1] * 4)), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse((116, 116, 836, 836), fill=(255, 255, 255, 255))
-        mask = mask.resize(card.size, Image.Resampling.NEAREST)
-
-        # make a new Image to set up card-sized image for pfp layer and the circle mask for it
-        profile_pic_holder = Image.new("RGBA", card.size, (255, 255, 255, 0))
-
-        # paste on square profile pic in appropriate spot
-        profile_pic_holder.paste(profile, (29, 29, 209, 209))
-
-        # make a new Image at card size to crop pfp with transparency to the circle mask
-        pfp_composite_holder = Image.new("RGBA", card.size, (0, 0, 0, 0))
-        pfp_composite_holder = Image.composite(
-            profile_pic_holder, pfp_composite_holder, mask
-        )
-
-        # layer the pfp_composite_holder onto the card
-        pre = Image.alpha_composite(card, pfp_composite_holder)
+        # draw at 4x the avatar's size and resample down to 1x for a nice smooth circle
+        mask = Image.new("L", (720, 720), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, 720, 720), fill=255)
+        mask = mask.resize(profile.size, Image.Resampling.NEAREST)
+
+        # crop the pfp with transparency to the circle mask
+        pfp_layer = Image.new("RGBA", profile.size, (0, 0, 0, 0))
+        pfp_layer.paste(profile, (0, 0), mask)
+
+        # layer the pfp onto the card
+        pre = card
+        pre.alpha_composite(pfp_layer, (29, 29))
         # layer on the progress bar
-        pre = Image.alpha_composite(pre, progress_bar)
+        pre.alpha_composite(progress_bar, (bar_start, bar_top))
 
         status = (
             self.status[user_status]
@@ -799,28 +765,9 @@ class Generator(MixinMeta, ABC):
         color: tuple = (0, 0, 0),
         font_name: str = None,
     ):
-        available = list(self.backgrounds.iterdir()) + list(self.saved_bgs.iterdir())
-        card = None
-        if bg_image and str(bg_image) != "random":
-            if not bg_image.lower().startswith("http"):
-                for file in available:
-                    if bg_image.lower() in file.name.lower():
-                        try:
-                            card = Image.open(file)
-                            break
-                        except OSError:
-                            log.info(f"Failed to load {bg_image}")
-
-            if not card and bg_image.lower().startswith("http"):
-                try:
-                    bg_bytes = self.get_image_content_from_url(bg_image)
-                    card = Image.open(BytesIO(bg_bytes))
-                except UnidentifiedImageError:
-                    pass
-
-        if not card:
-            card = self.get_random_background()
+        card = self.load_background(bg_image, LEVELUP_SIZE)
 
+        check_cancelled()
         # Get coords and fonts setup
         card_size = (180, 60)
         aspect_ratio = (18, 6)
@@ -832,17 +779,15 @@ class Generator(MixinMeta, ABC):
         fontsize = int(card.height / 2.5)
         string = _("Level ") + str(level)
         base_font = self.font
-        if font_name:
-            fontfile = os.path.join(self.fonts, font_name)
-            if os.path.exists(fontfile):
-                base_font = fontfile
+        if font_name and (font_asset := self.font_catalog.get(font_name)):
+            base_font = str(font_asset.path)
         # base_font = self.get_random_font()
-        font = ImageFont.truetype(base_font, fontsize)
+        font = get_font(base_font, fontsize)
         while font.getlength(string) + int(card.height * 1.2) > card.width - (
             int(card.height * 1.2) - card.height
         ):
             fontsize -= 1
-            font = ImageFont.truetype(base_font, fontsize)
+            font = get_font(base_font, fontsize)
 
         # Draw rounded rectangle at 4x size and scale down to crop card to
         mask = Image.new("RGBA", ((card.size[0]), (card.size[1])), 0)
@@ -859,12 +804,7 @@ class Generator(MixinMeta, ABC):
         final = Image.composite(card, composite_holder, mask)
 
         # Prep profile to paste
-        pfp_image = self.get_image_content_from_url(str(profile_image))
-        if pfp_image:
-            profile_bytes = BytesIO(pfp_image)
-            profile = Image.open(profile_bytes)
-        else:
-            profile = Image.open(self.default_pfp)
+        profile = self.load_profile(profile_image, pfpsize)
         profile = profile.convert("RGBA").resize(pfpsize, Image.Resampling.LANCZOS)
 
         # Create mask for profile image crop
@@ -900,118 +840,179 @@ class Generator(MixinMeta, ABC):
         return final
 
     @perf(max_entries=1000)
-    def get_all_fonts(self) -> Image.Image:
-        fonts = [i for i in os.listdir(self.fonts)]
-        count = len(fonts)
-        fontsize = 50
-        res = (650, fontsize * count + (count * 15))
-        img = Image.new("RGBA", res, 0)
-        color = (255, 255, 255)
+    def get_font_thumbnail(self, asset: Asset) -> Image.Image:
+        """Font name written in its own font for the gallery"""
+        img = Image.new("RGBA", FONT_THUMBNAIL, 0)
         draw = ImageDraw.Draw(img)
-        for index, i in enumerate(fonts):
-            fontname = i.replace(".ttf", "")
-            font = ImageFont.truetype(os.path.join(self.fonts, i), fontsize)
-            draw.text(
-                (5, index * (fontsize + 15)),
-                fontname,
-                color,
-                font=font,
-                stroke_width=1,
-                stroke_fill=(0, 0, 0),
-            )
+        fontsize = 50
+        font = ImageFont.truetype(str(asset.path), fontsize)
+        # Long names get shrunk to fit rather than cut off
+        while fontsize > 20 and font.getlength(asset.path.stem) > FONT_THUMBNAIL[0] - 10:
+            fontsize -= 5
+            font = ImageFont.truetype(str(asset.path), fontsize)
+        draw.text(
+            (5, FONT_THUMBNAIL[1] // 2),
+            asset.path.stem,
+            (255, 255, 255),
+            font=font,
+            anchor="lm",
+            stroke_width=1,
+            stroke_fill=(0, 0, 0),
+        )
         return img
 
     @perf(max_entries=1000)
-    def get_all_backgrounds(self):
-        available: List[Path] = list(self.saved_bgs.iterdir()) + list(
-            self.backgrounds.iterdir()
+    def get_background_thumbnail(self, asset: Asset) -> Image.Image:
+        """Labeled preview tile of a background for the gallery"""
+        # Straight from disk, gallery builds would just churn the read_asset cache
+        img = self.open_image(asset.path.read_bytes(), BG_THUMBNAIL)
+        img = self.force_aspect_ratio(img).convert("RGBA").resize(BG_THUMBNAIL, Image.Resampling.LANCZOS)
+        draw = ImageDraw.Draw(img)
+        # Add a black outline to the text
+        draw.text(
+            (5, 5),
+            asset.path.stem,
+            font=get_font(self.font, 30),
+            fill=(255, 255, 255),
+            stroke_width=2,
+            stroke_fill="#000000",
         )
-        imgs = []
-        for file in available:
-            if file.is_dir() or file.suffix == ".py":
-                continue
-            try:
-                img = self.force_aspect_ratio(Image.open(file))
-                img = img.convert("RGBA").resize((1050, 450), Image.Resampling.NEAREST)
-                draw = ImageDraw.Draw(img)
-                ext_replace = [".png", ".jpg", ".jpeg", ".webp", ".gif"]
-                txt = file.name
-                for ext in ext_replace:
-                    txt = txt.replace(ext, "")
-                # Add a black outline to the text
-                draw.text(
-                    (10, 10),
-                    txt,
-                    font=ImageFont.truetype(self.font, 100),
-                    fill=(255, 255, 255),
-                    stroke_width=5,
-                    stroke_fill="#000000",
-                )
-                if not img:
-                    log.error(f"Failed to load image for default background '{file}`")
-                    continue
-                imgs.append((img, file.name))
-            except Exception as e:
-                log.warning(f"Failed to prep background image: {file}", exc_info=e)
-
-        # Sort by name
-        imgs = sorted(imgs, key=lambda key: key[1])
-
-        # Make grid 4 wide by however many tall
-        rowcount = ceil(len(imgs) / 4)
-        # Make a bunch of rows of 4
-        rows = []
-        index = 0
-        for __ in range(rowcount):
-            final = None
-            for __ in range(4):
-                if index >= len(imgs):
-                    continue
-
-                img_obj = imgs[index][0]
-                index += 1
-
-                if final is None:
-                    final = img_obj
-                else:
-                    final = self.concat_img_h(final, img_obj)
-
-            if final:
-                rows.append(final)
-
-        # Now concat the rows vertically
-        final = None
-        for row_img_obj in rows:
-            if final is None:
-                final = row_img_obj
-            else:
-                final = self.concat_img_v(final, row_img_obj)
-
-        return final
+        return img
 
     @staticmethod
     @perf(max_entries=1000)
-    def concat_img_v(im1: Image, im2: Image) -> Image:
-        new = Image.new("RGBA", (im1.width, im1.height + im2.height))
-        new.paste(im1, (0, 0))
-        new.paste(im2, (0, im1.height))
-        return new
+    def get_avatar_tiles(
+        profile: Image.Image, size: Tuple[int, int], make_tile: Callable[[Image.Image], Image.Image]
+    ) -> List[Tuple[Image.Image, int]]:
+        """
+        Render the avatar region of every frame of an animated avatar
+
+        Identical consecutive frames are merged, long animations are thinned out to MAX_FRAMES
+        and cut off after MAX_DURATION. Returns (tile, duration in ms) pairs.
+        """
+        step = max(1, ceil(profile.n_frames / MAX_FRAMES))
+        tiles: List[List] = []
+        last = None
+        elapsed = 0
+        for i in range(profile.n_frames):
+            if elapsed >= MAX_DURATION:
+                break
+            profile.seek(i)
+            duration = profile.info.get("duration") or 100
+            elapsed += duration
+            if i % step:
+                # Thinned out frame, the one before it stays up for longer
+                tiles[-1][1] += duration
+                continue
+            check_cancelled()
+            avatar = profile.convert("RGBA").resize(size, Image.Resampling.NEAREST)
+            raw = avatar.tobytes()
+            if raw == last:
+                tiles[-1][1] += duration
+                continue
+            last = raw
+            tiles.append([make_tile(avatar), duration])
+        return [(tile, max(duration, MIN_FRAME_DURATION)) for tile, duration in tiles]
 
     @staticmethod
     @perf(max_entries=1000)
-    def concat_img_h(im1: Image, im2: Image) -> Image:
-        new = Image.new("RGBA", (im1.width + im2.width, im1.height))
-        new.paste(im1, (0, 0))
-        new.paste(im2, (im1.width, 0))
-        return new
+    def encode_animation(
+        base: Image.Image, box: tuple, tiles: List[Tuple[Image.Image, int]], animated_format: str = "gif"
+    ) -> bytes:
+        """Paste each avatar tile onto the static card and encode the whole animation in one pass"""
+        durations = [duration for __, duration in tiles]
+        buffer = BytesIO()
+        if animated_format == "webp":
+            frames = []
+            for tile, __ in tiles:
+                frame = base.copy()
+                frame.paste(tile, box[:2])
+                frames.append(frame)
+            frames[0].save(
+                buffer,
+                format="WEBP",
+                save_all=True,
+                append_images=frames[1:],
+                duration=durations,
+                loop=0,
+                quality=80,
+            )
+            return buffer.getvalue()
+
+        # Build one palette for every frame from the card with a thumbnail of each avatar frame below it,
+        # the last palette slot is left free for transparency so the gif keeps the card's clear areas
+        thumb = 75
+        per_row = base.width // thumb
+        rows = ceil(len(tiles) / per_row)
+        sample = Image.new("RGB", (base.width, base.height + rows * thumb))
+        sample.paste(base.convert("RGB"), (0, 0))
+        for index, (tile, __) in enumerate(tiles):
+            row, col = divmod(index, per_row)
+            small = tile.convert("RGB").resize((thumb, thumb), Image.Resampling.NEAREST)
+            sample.paste(small, (col * thumb, base.height + row * thumb))
+        palette = sample.quantize(colors=GIF_TRANSPARENT, method=Image.Quantize.MEDIANCUT)
+
+        def quantize(image: Image.Image) -> Image.Image:
+            quantized = image.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE)
+            if "A" in image.getbands():
+                # Gifs only have on/off transparency
+                clear = image.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+                quantized.paste(GIF_TRANSPARENT, mask=clear)
+            return quantized
+
+        # Quantize the static card once and only the avatar region per frame
+        card = quantize(base)
+        colors = card.getpalette()[: GIF_TRANSPARENT * 3]
+        card.putpalette(colors + [0] * (768 - len(colors)))
+        frames = []
+        for tile, __ in tiles:
+            frame = card.copy()
+            frame.paste(quantize(tile), box[:2])
+            frames.append(frame)
+        frames[0].save(
+            buffer,
+            format="GIF",
+            save_all=True,
+            append_images=frames[1:],
+            duration=durations,
+            loop=0,
+            optimize=False,
+            transparency=GIF_TRANSPARENT,
+            # Clear each frame before drawing the next so transparent pixels don't show the one before
+            disposal=2,
+        )
+        return buffer.getvalue()
 
     @staticmethod
     @perf(max_entries=1000)
-    def get_image_content_from_url(url: str) -> Union[bytes, None]:
+    def encode_image(img: Union[Image.Image, bytes]) -> Tuple[bytes, str]:
+        """Encode a rendered image to bytes, returning the data and file extension"""
+        if isinstance(img, bytes):
+            # Animated profiles come out of the generator already encoded
+            if img[:4] == b"GIF8":
+                return img, "gif"
+            if img[8:12] == b"WEBP":
+                return img, "webp"
+            return img, "png"
+        animated = getattr(img, "is_animated", False)
+        ext = "GIF" if animated else "WEBP"
+        buffer = BytesIO()
+        try:
+            img.save(buffer, save_all=True, format=ext)
+        except KeyError:
+            ext = "PNG"
+            buffer = BytesIO()
+            img.save(buffer, save_all=True, format=ext)
+        return buffer.getvalue(), ext.lower()
+
+    @perf(max_entries=1000)
+    def get_image_content_from_url(self, url: str) -> Union[bytes, None]:
         if url is None:
             return None
         if str(url) == "None":
             return None
+        if self.remote is not None:
+            return self.remote.get(str(url))
         try:
             res = requests.get(url)
             return res.content
@@ -1105,20 +1106,126 @@ class Generator(MixinMeta, ABC):
         cropped = image.crop(box)
         return cropped
 
+    @staticmethod
+    @perf(max_entries=1000)
+    def open_image(data: bytes, size: Tuple[int, int] = None) -> Image.Image:
+        """
+        Open an image, decoding it no larger than needed to still cover `size` once cropped
+
+        Anything over the pixel budget is refused from its header, before any pixels are decoded
+        """
+        img = Image.open(BytesIO(data))
+        width, height = img.size
+        if width * height > MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image size ({width}x{height}) exceeds the limit of {humanize_number(MAX_PIXELS)} pixels"
+            )
+        if not size:
+            return img
+        factor = int(min(width / size[0], height / size[1]))
+        if factor < 2:
+            return img
+        if img.format == "JPEG":
+            # Let the decoder skip the detail we would throw away anyway
+            img.draft(img.mode, (ceil(width / factor), ceil(height / factor)))
+        elif not getattr(img, "is_animated", False):
+            if img.mode not in ("RGB", "RGBA", "L", "LA"):
+                img = img.convert("RGBA")
+            img = img.reduce(factor)
+        return img
+
+    def load_bytes(self, source: Union[str, bytes, None]) -> Union[bytes, None]:
+        """Get image bytes from either pre-fetched content or a url"""
+        if isinstance(source, bytes):
+            return source
+        return self.get_image_content_from_url(str(source)) if source else None
+
+    def load_profile(self, profile_image: Union[str, bytes, None], size: Tuple[int, int] = None) -> Image.Image:
+        pfp_image = self.load_bytes(profile_image)
+        if pfp_image:
+            try:
+                return self.open_image(pfp_image, size)
+            except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+                log.info(f"Failed to load profile image: {e}")
+        return Image.open(self.default_pfp)
+
+    def load_background(self, bg_image: Union[str, bytes, None], size: Tuple[int, int] = None) -> Image.Image:
+        """Open a background from pre-fetched bytes, a url or a background name, falling back to a random one"""
+        card = None
+        data = None
+        if isinstance(bg_image, bytes):
+            data = bg_image
+        elif bg_image and str(bg_image) != "random":
+            if bg_image.lower().startswith("http"):
+                if pinned := self.get_pinned(bg_image, size):
+                    card = Image.open(pinned)
+                else:
+                    data = self.get_image_content_from_url(bg_image)
+            elif asset := self.bg_catalog.find(bg_image):
+                try:
+                    card = self.open_image(read_asset(asset.path), size)
+                except OSError:
+                    log.info(f"Failed to load {bg_image}")
+
+        if data:
+            try:
+                card = self.open_image(data, size)
+            except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+                log.info(f"Failed to load background: {e}")
+
+        if not card:
+            card = self.get_random_background(size)
+        return card
+
+    def pinned_path(self, url: str, size: Tuple[int, int]) -> Path:
+        key = hashlib.sha1(url.encode()).hexdigest()[:20]
+        return self.pinned / f"{key}.{size[0]}x{size[1]}.webp"
+
+    def get_pinned(self, url: str, size: Tuple[int, int] = None) -> Union[Path, None]:
+        """Local copy of a user background url closest to the requested size, if it was pinned"""
+        if size not in PINNED_SIZES:
+            # Level up cards and anything else crop from the full size copy
+            size = next(iter(PINNED_SIZES))
+        path = self.pinned_path(url, size)
+        return path if path.exists() else None
+
+    @perf(max_entries=1000)
+    def pin_background(self, url: str, data: bytes) -> None:
+        """
+        Validate a background and store it at every size profiles use, so renders read it from disk
+
+        Raises the same errors as open_image if the image is unusable
+        """
+        img = self.open_image(data, next(iter(PINNED_SIZES)))
+        img = img.convert("RGBA")
+        for size, aspect_ratio in PINNED_SIZES.items():
+            path = self.pinned_path(url, size)
+            resized = self.force_aspect_ratio(img, aspect_ratio).resize(size, Image.Resampling.LANCZOS)
+            tmp = path.with_name(f"{path.name}.tmp")
+            resized.save(tmp, format="WEBP", quality=90)
+            tmp.replace(path)
+
+    def prune_pinned(self, urls: List[str]) -> int:
+        """Delete pinned backgrounds that none of the given urls use anymore, returns how many files were removed"""
+        keep = {self.pinned_path(url, size).name for url in urls for size in PINNED_SIZES}
+        removed = 0
+        for file in self.pinned.glob("*.webp"):
+            if file.name not in keep:
+                file.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
     @perf(max_entries=1000)
-    def get_random_background(self) -> Image:
-        available = list(self.backgrounds.iterdir()) + list(self.saved_bgs.iterdir())
-        random.shuffle(available)
-        for path in available:
+    def get_random_background(self, size: Tuple[int, int] = None) -> Image:
+        for asset in self.bg_catalog.shuffled():
             try:
-                return Image.open(path)
-            except UnidentifiedImageError:
+                return self.open_image(read_asset(asset.path), size)
+            except (UnidentifiedImageError, IsADirectoryError):
                 pass
         return Image.new("RGBA", (2000, 1000), (0, 0, 0, 0))
 
     def get_random_font(self) -> str:
-        available = list(self.fonts.iterdir()) + list(self.saved_fonts.iterdir())
-        return random.choice(available)
+        return self.font_catalog.random().path
 
     @staticmethod
     def has_emoji(text: str) -> Union[str, bool]:
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import discord
+from redbot.core.i18n import Translator
+
+log = logging.getLogger("red.vrt.levelup.notify")
+_ = Translator("LevelUp", __file__)
+
+
+class Notice(NamedTuple):
+    member: discord.Member
+    level: int
+    role: Optional[str]  # Mention of the role earned, if any
+    mention: bool  # Ping the member
+    avatar: Optional[str]
+    card: Optional[Tuple[bytes, str]]  # Encoded level up card and its extension, None for embed alerts
+
+
+class NotificationDispatcher:
+    """
+    Queues level up alerts per channel and sends each burst as one message
+
+    The first alert for a channel opens a window of `window` seconds, everything else that levels
+    up in that channel before it closes goes out together. A single alert looks the same as it always has,
+    several are merged into a summary embed, or one message carrying all of the level up cards.
+    DMs can't be merged, so they go through a few workers with a bounded backlog instead.
+    """
+
+    def __init__(self, window: float = 2, max_pending: int = 100, dm_workers: int = 2, max_dms: int = 200):
+        self.window = window
+        self.max_pending = max_pending  # Per channel
+        self.dm_workers = dm_workers
+        self.pending: Dict[int, List[Notice]] = {}
+        self.flushes: Set[asyncio.Task] = set()
+        self.dms: asyncio.Queue = asyncio.Queue(maxsize=max_dms)
+        self.workers: List[asyncio.Task] = []
+
+        # Stats
+        self.queued = 0
+        self.merged = 0  # Alerts that went out as part of a summary
+        self.sent = 0  # Messages sent
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        """Alerts waiting to be sent"""
+        return sum(len(i) for i in self.pending.values()) + self.dms.qsize()
+
+    def start(self) -> None:
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.dm_worker()) for __ in range(self.dm_workers)]
+
+    def stop(self) -> None:
+        for task in self.workers + list(self.flushes):
+            task.cancel()
+        self.workers = []
+
+    def push(self, channel: discord.TextChannel, notice: Notice) -> None:
+        queue = self.pending.get(channel.id)
+        if queue is None:
+            queue = self.pending[channel.id] = []
+            task = asyncio.create_task(self.flush_later(channel))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+        if len(queue) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.queued += 1
+        queue.append(notice)
+
+    def push_dm(self, member: discord.Member, content: str = None, embed: discord.Embed = None, card=None) -> None:
+        try:
+            self.dms.put_nowait((member, content, embed, card))
+            self.queued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def flush_later(self, channel: discord.TextChannel) -> None:
+        await asyncio.sleep(self.window)
+        notices = self.pending.pop(channel.id, [])
+        if not notices:
+            return
+        try:
+            await self.flush(channel, notices)
+        except Exception as e:
+            log.warning(f"Failed to send levelup alert to {channel.name}!", exc_info=e)
+            self.failed += 1
+
+    async def flush(self, channel: discord.TextChannel, notices: List[Notice]) -> None:
+        cards = [i for i in notices if i.card]
+        embeds = [i for i in notices if not i.card]
+        if len(notices) > 1:
+            self.merged += len(notices)
+        if cards:
+            await self.send_cards(channel, cards)
+        if len(embeds) == 1:
+            await self.send_embed(channel, embeds[0])
+        elif embeds:
+            await self.send_summary(channel, embeds)
+
+    async def send(self, channel: discord.TextChannel, content: str = None, **kwargs) -> None:
+        await channel.send(content, **kwargs)
+        self.sent += 1
+
+    async def send_embed(self, channel: discord.TextChannel, notice: Notice) -> None:
+        member = notice.member
+        if notice.role:
+            txt = _("You have just reached level {} and obtained the {} role!").format(notice.level, notice.role)
+        else:
+            txt = _("Just reached level {}!").format(notice.level)
+        embed = discord.Embed(description=txt, color=member.color)
+        embed.set_author(name=member.name, icon_url=notice.avatar)
+        await self.send(channel, member.mention if notice.mention else None, embed=embed)
+
+    async def send_summary(self, channel: discord.TextChannel, notices: List[Notice]) -> None:
+        lines = []
+        for notice in notices:
+            if notice.role:
+                txt = _("{} reached level {} and obtained the {} role!")
+            else:
+                txt = _("{} reached level {}!")
+            lines.append(txt.format(f"**{notice.member.name}**", notice.level, notice.role))
+        mentions = [i.member.mention for i in notices if i.mention]
+        color = notices[0].member.color
+        for index, chunk in enumerate(chunks(lines, 4000)):
+            embed = discord.Embed(description="\n".join(chunk), color=color)
+            if index == 0:
+                embed.title = _("{} members leveled up!").format(len(notices))
+            await self.send(channel, " ".join(mentions)[:2000] if index == 0 and mentions else None, embed=embed)
+
+    async def send_cards(self, channel: discord.TextChannel, notices: List[Notice]) -> None:
+        # Discord shows up to 10 attached images as a grid under one message
+        for i in range(0, len(notices), 10):
+            batch = notices[i : i + 10]
+            lines = []
+            for notice in batch:
+                name = notice.member.mention if notice.mention else notice.member.name
+                if notice.role:
+                    lines.append(_("**{} just leveled up and obtained the {} role!**").format(name, notice.role))
+                else:
+                    lines.append(_("**{} just leveled up!**").format(name))
+            files = [
+                discord.File(BytesIO(notice.card[0]), filename=f"{notice.member.id}.{notice.card[1]}")
+                for notice in batch
+            ]
+            await self.send(channel, "\n".join(lines)[:2000], files=files)
+
+    async def dm_worker(self) -> None:
+        while True:
+            member, content, embed, card = await self.dms.get()
+            file = discord.File(BytesIO(card[0]), filename=f"{member.id}.{card[1]}") if card else None
+            try:
+                await member.send(content, embed=embed, file=file)
+                self.sent += 1
+            except discord.Forbidden:
+                pass
+            except Exception as e:
+                log.warning(f"Failed to DM levelup alert to {member}", exc_info=e)
+                self.failed += 1
+            finally:
+                self.dms.task_done()
+
+
+def chunks(lines: List[str], limit: int) -> List[List[str]]:
+    """Split lines into groups whose joined length stays under a limit"""
+    groups: List[List[str]] = [[]]
+    size = 0
+    for line in lines:
+        if groups[-1] and size + len(line) + 1 > limit:
+            groups.append([])
+            size = 0
+        groups[-1].append(line)
+        size += len(line) + 1
+    return groups
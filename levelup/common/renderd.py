@@ -0,0 +1,259 @@
+"""
+Standalone render daemon
+
+Runs the same Generator code as the cog in its own process and serves renders over a Unix socket,
+so render memory and CPU stay out of the bot process.
+
+Every message either way is a 4 byte big-endian length followed by a msgpack map.
+Requests are {"op": "ping"} or {"op": "render", "method": str, "params": map}
+and replies are {"ok": True, ...} or {"ok": False, "error": str}.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Callable, Optional, Tuple
+
+import msgpack
+
+from .bootstrap import spawn_target
+from .scheduler import check_cancelled
+
+log = logging.getLogger("red.vrt.levelup.renderd")
+HEADER = struct.Struct("!I")
+# Requests bigger than this are refused instead of being read into memory
+MAX_MESSAGE = 64 * 1024 * 1024
+# The only Generator methods a client may call, anything else could touch files on disk
+RENDER_METHODS = {"generate_profile", "generate_slim_profile", "generate_levelup"}
+
+
+class RenderServiceDown(ConnectionError):
+    """The render daemon could not be reached or dropped the connection"""
+
+
+class RenderServiceError(Exception):
+    """The render daemon was reached but the render itself failed"""
+
+
+def recv_exact(sock: socket.socket, size: int, idle: Optional[Callable[[], None]] = None) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        try:
+            chunk = sock.recv(size - len(buffer))
+        except socket.timeout:
+            if idle is None:
+                raise
+            # Still waiting on the daemon, give the caller a chance to bail out
+            idle()
+            continue
+        if not chunk:
+            raise RenderServiceDown("Render service closed the connection")
+        buffer += chunk
+    return bytes(buffer)
+
+
+def send_message(sock: socket.socket, payload: dict) -> None:
+    data = msgpack.packb(payload, use_bin_type=True, default=str)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock: socket.socket, idle: Optional[Callable[[], None]] = None) -> dict:
+    (size,) = HEADER.unpack(recv_exact(sock, HEADER.size, idle))
+    if size > MAX_MESSAGE:
+        raise RenderServiceDown(f"Message of {size} bytes is too large")
+    # Arrays come back as tuples since PIL wants colors as tuples
+    return msgpack.unpackb(recv_exact(sock, size, idle), raw=False, use_list=False)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Daemon side
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+class RenderHandler(socketserver.BaseRequestHandler):
+    server: "RenderServer"
+
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (RenderServiceDown, ConnectionError, struct.error):
+                return
+            reply = self.server.dispatch(request)
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                # Client gave up waiting
+                return
+
+
+class RenderServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, renderer, workers: int):
+        super().__init__(path, RenderHandler)
+        self.renderer = renderer
+        # Connections are cheap, renders are not
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op != "render":
+            return {"ok": False, "error": f"Unknown op {op}"}
+        method = request.get("method")
+        if method not in RENDER_METHODS:
+            return {"ok": False, "error": f"Unknown render method {method}"}
+        with self.slots:
+            try:
+                data, ext = self.renderer.render_image(method, **request["params"])
+            except Exception as e:
+                log.warning(f"Render failed: {traceback.format_exc()}")
+                return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"ok": True, "data": data, "ext": ext}
+
+
+def watch_parent(server: RenderServer, parent: int) -> None:
+    """Shut down if the bot goes away without stopping us"""
+    while os.getppid() == parent:
+        sleep(5)
+    server.shutdown()
+
+
+def serve(path: str, maindir: str, savedir: str, workers: int) -> None:
+    """Entry point of the daemon process"""
+    from .worker import Renderer
+
+    Path(path).unlink(missing_ok=True)
+    server = RenderServer(path, Renderer(Path(maindir), Path(savedir)), workers)
+    threading.Thread(target=watch_parent, args=(server, os.getppid()), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        Path(path).unlink(missing_ok=True)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Cog side
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+class RenderService:
+    """Spawns, talks to, and babysits the render daemon"""
+
+    def __init__(self, maindir: Path, savedir: Path):
+        self.maindir = str(maindir)
+        self.savedir = str(savedir)
+        # Socket paths are limited to ~100 characters so it lives in a private temp folder instead
+        # of the cog data folder, created on start so only the bot's user can reach the socket
+        self.folder: Optional[str] = None
+        self.path = ""
+        self.workers = 0
+        self.process: Optional[multiprocessing.Process] = None
+        self.lock = threading.Lock()
+        self.started_at = 0.0
+
+        # Stats
+        self.restarts = 0
+        self.fallbacks = 0
+        self.latency: Optional[float] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, workers: int) -> None:
+        with self.lock:
+            if self.alive and workers == self.workers:
+                return
+            self._stop()
+            if not self.folder or not os.path.isdir(self.folder):
+                # mkdtemp creates the folder with 0700 permissions and an unguessable name
+                self.folder = tempfile.mkdtemp(prefix="levelup-renderd-")
+                self.path = os.path.join(self.folder, "render.sock")
+            self.workers = workers
+            target, args = spawn_target(serve, self.path, self.maindir, self.savedir, workers)
+            self.process = multiprocessing.get_context("spawn").Process(
+                target=target,
+                args=args,
+                name="levelup-renderd",
+                daemon=True,
+            )
+            self.process.start()
+            self.started_at = monotonic()
+
+    def stop(self) -> None:
+        with self.lock:
+            self._stop()
+            if self.folder:
+                shutil.rmtree(self.folder, ignore_errors=True)
+                self.folder = None
+                self.path = ""
+
+    def _stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+            self.process = None
+        if self.path:
+            Path(self.path).unlink(missing_ok=True)
+
+    def request(self, payload: dict, timeout: float, idle: Optional[Callable[[], None]] = None) -> dict:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.path)
+                send_message(sock, payload)
+                return recv_message(sock, idle)
+        except (OSError, struct.error, ValueError) as e:
+            if isinstance(e, RenderServiceDown):
+                raise
+            raise RenderServiceDown(str(e)) from e
+
+    def ping(self) -> bool:
+        start = monotonic()
+        try:
+            reply = self.request({"op": "ping"}, timeout=5)
+        except RenderServiceDown:
+            self.latency = None
+            return False
+        self.latency = monotonic() - start
+        return bool(reply.get("ok"))
+
+    def ensure(self) -> bool:
+        """Health check, restarts the daemon if it died or stopped answering. Returns True if it was restarted"""
+        if self.alive:
+            if self.ping():
+                return False
+            if monotonic() - self.started_at < 30:
+                # Still importing everything, give it a chance
+                return False
+        log.warning("Render service is not responding, restarting it")
+        with self.lock:
+            self._stop()
+        self.start(self.workers)
+        self.restarts += 1
+        return True
+
+    def render(self, method: str, params: dict) -> Tuple[bytes, str]:
+        """Called from a scheduler thread, blocks until the daemon replies"""
+        reply = self.request(
+            {"op": "render", "method": method, "params": params},
+            timeout=0.5,
+            idle=check_cancelled,
+        )
+        if not reply.get("ok"):
+            raise RenderServiceError(reply.get("error"))
+        return reply["data"], reply["ext"]
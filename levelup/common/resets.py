@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import logging
+from time import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger("red.vrt.levelup.resets")
+
+
+class ResetScheduler:
+    """
+    Fires each guild's weekly reset at its scheduled time
+
+    Keeps a min-heap of (timestamp, guild ID) and sleeps until the earliest one is due, so an idle week
+    costs nothing no matter how many guilds there are. Rescheduling a guild just pushes a new entry,
+    entries that no longer match a guild's current time are skipped when they come up.
+    Resets run with bounded concurrency so guilds sharing a reset hour don't all fire at once.
+    """
+
+    def __init__(self, fire: Callable[[int], Awaitable], concurrency: int = 3, max_sleep: float = 3600):
+        self.fire = fire  # Called with the guild ID once its reset is due
+        self.max_sleep = max_sleep  # Re-check the clock at least this often in case it jumps
+        self.heap: List[Tuple[float, int]] = []
+        self.due: Dict[int, float] = {}  # Guild ID -> current scheduled timestamp
+        self.running: Set[int] = set()
+        self.tasks: Set[asyncio.Task] = set()  # Resets in progress
+        self.limit = asyncio.Semaphore(concurrency)
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.worker())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+
+    def schedule(self, guild_id: int, when: float) -> None:
+        if self.due.get(guild_id) == when:
+            return
+        self.due[guild_id] = when
+        heapq.heappush(self.heap, (when, guild_id))
+        # Only matters if this is now the earliest, but waking up early is harmless
+        self.wakeup.set()
+
+    def cancel(self, guild_id: int) -> None:
+        self.due.pop(guild_id, None)
+
+    def next_due(self) -> Optional[float]:
+        # Drop entries that were rescheduled or cancelled since they were pushed
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    async def worker(self) -> None:
+        while True:
+            when = self.next_due()
+            now = time()
+            if when is None or when > now:
+                timeout = self.max_sleep if when is None else min(when - now, self.max_sleep)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            __, guild_id = heapq.heappop(self.heap)
+            del self.due[guild_id]
+            if guild_id in self.running:
+                continue
+            self.running.add(guild_id)
+            task = asyncio.create_task(self.run(guild_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, guild_id: int) -> None:
+        try:
+            async with self.limit:
+                await self.fire(guild_id)
+                self.fired += 1
+        except Exception as e:
+            log.error(f"Weekly reset failed for guild {guild_id}", exc_info=e)
+        finally:
+            self.running.discard(guild_id)
@@ -0,0 +1,54 @@
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class RoleLadder:
+    """
+    A guild's level roles sorted by level
+
+    Built once from the levelroles config and rebuilt whenever it changes, so working out
+    which roles a member should hold is a bisect instead of a scan over every level role.
+    """
+
+    def __init__(self, levelroles: Dict[str, int]):
+        pairs = []
+        for level, role_id in levelroles.items():
+            try:
+                pairs.append((int(level), int(role_id)))
+            except (TypeError, ValueError):
+                # Levels are stored as strings and were never validated
+                continue
+        pairs.sort()
+        self.levels: List[int] = [level for level, __ in pairs]
+        self.role_ids: List[int] = [role_id for __, role_id in pairs]
+        self.ids = set(self.role_ids)
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def earned(self, level: int) -> List[int]:
+        """Role IDs unlocked at or below a level, lowest level first"""
+        return self.role_ids[: bisect_right(self.levels, level)]
+
+    def highest(self, level: int) -> Optional[int]:
+        """Role ID of the highest level role unlocked at or below a level"""
+        index = bisect_right(self.levels, level)
+        return self.role_ids[index - 1] if index else None
+
+    def diff(self, level: int, held: Iterable[int], autoremove: bool) -> Tuple[List[int], List[int]]:
+        """
+        Role IDs to add and to remove so a member at this level holds the right level roles
+
+        With autoremove only the highest unlocked role is kept, otherwise every unlocked role stacks
+        and nothing is removed. Roles to add are ordered lowest level first.
+        """
+        held = set(held)
+        if autoremove:
+            top = self.highest(level)
+            wanted = [top] if top is not None else []
+            remove = [role_id for role_id in held if role_id in self.ids and role_id != top]
+        else:
+            wanted = self.earned(level)
+            remove = []
+        add = list(dict.fromkeys(role_id for role_id in wanted if role_id not in held))
+        return add, remove
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+from perftracker import get_stats
+from redbot.core.i18n import Translator
+
+from ..utils.formatter import get_level
+from .roles import RoleLadder
+
+log = logging.getLogger("red.vrt.levelup.rolesync")
+_ = Translator("LevelUp", __file__)
+
+# Member ID -> (role IDs to add, role IDs to remove)
+Changes = Dict[str, Tuple[List[int], List[int]]]
+
+
+def compute_changes(
+    ladder: RoleLadder,
+    members: Iterable[Tuple[int, int, List[int]]],
+    autoremove: bool,
+    assignable: Set[int],
+) -> Changes:
+    """
+    Work out the level role changes for a snapshot of (member ID, level, held role IDs)
+
+    Pure so it can run off the event loop. Roles the bot can't manage are left out
+    and members that already hold the right roles are skipped entirely.
+    """
+    changes: Changes = {}
+    for member_id, level, held in members:
+        add, remove = ladder.diff(level, held, autoremove)
+        add = [role_id for role_id in add if role_id in assignable]
+        remove = [role_id for role_id in remove if role_id in assignable]
+        if add or remove:
+            changes[str(member_id)] = (add, remove)
+    return changes
+
+
+def compute_levels(users: Iterable[Tuple[str, int, int]], base: int, exp: int) -> Dict[str, int]:
+    """
+    Re-derive levels for a snapshot of (user ID, XP, stored level)
+
+    Pure so it can run off the event loop. Only users whose stored level is wrong are returned.
+    """
+    levels = {}
+    for user_id, xp, level in users:
+        new_level = get_level(xp, base, exp)
+        if new_level != level:
+            levels[user_id] = new_level
+    return levels
+
+
+class RoleSync:
+    """
+    Applies level role changes to a whole guild
+
+    Each member gets a single role edit, sent by a few workers so discord.py's per-route
+    rate limit buckets pace the requests instead of piling them up. Whatever is left to do is
+    checkpointed to disk so a restart resumes the sync instead of starting over.
+    """
+
+    def __init__(self, guild: discord.Guild, changes: Changes, path: Path, workers: int = 3, total: int = None):
+        self.guild = guild
+        self.pending = changes
+        self.path = path
+        self.workers = workers
+        self.total = total if total is not None else len(changes)
+        self.task: Optional[asyncio.Task] = None
+        self.started = monotonic()
+
+        # Stats
+        self.done = 0
+        self.added = 0
+        self.removed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    @classmethod
+    def load(cls, guild: discord.Guild, path: Path, workers: int = 3) -> "RoleSync":
+        data = json.loads(path.read_text())
+        changes = {k: (v[0], v[1]) for k, v in data["pending"].items()}
+        return cls(guild, changes, path, workers, total=data["total"])
+
+    def checkpoint(self, pending: Changes) -> None:
+        """Write what's left to disk, takes a copy of pending since workers keep changing it"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"total": self.total, "pending": pending}))
+        tmp.replace(self.path)
+
+    @property
+    def finished(self) -> bool:
+        return not self.pending
+
+    @property
+    def rate(self) -> float:
+        """Members processed per second"""
+        elapsed = monotonic() - self.started
+        return self.done / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self) -> Optional[int]:
+        return int(len(self.pending) / self.rate) if self.rate else None
+
+    def start(self, progress: Callable[["RoleSync"], Awaitable] = None) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run(progress))
+        return self.task
+
+    async def run(self, progress: Callable[["RoleSync"], Awaitable] = None, interval: float = 5) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for member_id in list(self.pending):
+            queue.put_nowait(member_id)
+        workers = [asyncio.create_task(self.worker(queue)) for __ in range(self.workers)]
+        reporter = asyncio.create_task(self.report(progress, interval))
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            if self.finished:
+                self.path.unlink(missing_ok=True)
+            else:
+                await asyncio.to_thread(self.checkpoint, dict(self.pending))
+        if progress:
+            try:
+                await progress(self)
+            except discord.HTTPException:
+                pass
+
+    async def report(self, progress: Optional[Callable[["RoleSync"], Awaitable]], interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.checkpoint, dict(self.pending))
+            if progress:
+                try:
+                    await progress(self)
+                except discord.HTTPException:
+                    pass
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            member_id = await queue.get()
+            add, remove = self.pending[member_id]
+            try:
+                await self.apply(int(member_id), add, remove)
+            except asyncio.CancelledError:
+                # Left in pending so a resumed sync tries this member again
+                queue.task_done()
+                raise
+            except Exception as e:
+                log.warning(f"Role sync failed for {member_id} in {self.guild}", exc_info=e)
+                self.failed += 1
+            self.pending.pop(member_id, None)
+            self.done += 1
+            queue.task_done()
+
+    async def apply(self, member_id: int, add: List[int], remove: List[int]) -> None:
+        member = self.guild.get_member(member_id)
+        if not member:
+            self.skipped += 1
+            return
+        held = {role.id for role in member.roles}
+        adding = [role for role_id in add if role_id not in held and (role := self.guild.get_role(role_id))]
+        removing = [role_id for role_id in remove if role_id in held]
+        if not adding and not removing:
+            # Changed since the diff was computed
+            self.skipped += 1
+            return
+        roles = [role for role in member.roles if not role.is_default() and role.id not in removing] + adding
+        try:
+            # One request per member no matter how many roles change
+            await member.edit(roles=roles, reason=_("Level role sync"))
+        except discord.HTTPException as e:
+            log.warning(f"Failed to sync level roles for {member} in {self.guild}: {e}")
+            self.failed += 1
+            return
+        self.added += len(adding)
+        self.removed += len(removing)
+
+
+class RoleQueue:
+    """
+    Debounced level role updates for members who just leveled up
+
+    Level ups only note which member changed. Once a member has gone `delay` seconds without another
+    level up, their roles are brought in line with whatever level they're at by then in a single edit,
+    so several level ups in a row cost one request and XP handling never waits on the API.
+    Failed edits are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        resolve: Callable[[discord.Member], Tuple[List[discord.Role], List[discord.Role]]],
+        delay: float = 3,
+        retries: int = 3,
+    ):
+        self.resolve = resolve  # Roles to add and remove for a member right now
+        self.delay = delay
+        self.retries = retries
+        # (guild ID, member ID) -> (member, when to apply, attempts so far)
+        self.pending: Dict[Tuple[int, int], Tuple[discord.Member, float, int]] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.queued = 0
+        self.coalesced = 0
+        self.applied = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.worker())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+
+    def push(self, member: discord.Member) -> None:
+        key = (member.guild.id, member.id)
+        if key in self.pending:
+            self.coalesced += 1
+        self.queued += 1
+        self.pending[key] = (member, monotonic() + self.delay, 0)
+        self.wakeup.set()
+
+    async def worker(self) -> None:
+        while True:
+            if not self.pending:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            now = monotonic()
+            due = [key for key, (__, when, __) in self.pending.items() if when <= now]
+            if not due:
+                wait = min(when for __, when, __ in self.pending.values()) - now
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            for key in due:
+                member, __, attempt = self.pending.pop(key)
+                try:
+                    await self.apply(key, member, attempt)
+                except Exception as e:
+                    log.warning(f"Failed to update level roles for {member} in {member.guild}", exc_info=e)
+                    self.failed += 1
+
+    async def apply(self, key: Tuple[int, int], member: discord.Member, attempt: int) -> None:
+        adding, removing = self.resolve(member)
+        if not adding and not removing:
+            return
+        remove_ids = {role.id for role in removing}
+        roles = [role for role in member.roles if not role.is_default() and role.id not in remove_ids]
+        roles += [role for role in adding if role not in roles]
+        start = monotonic()
+        try:
+            await member.edit(roles=roles, reason=_("Leveled Up!"))
+        except discord.Forbidden:
+            log.warning(f"Lacking permissions to update level roles for {member.name} in {member.guild.name}")
+            self.failed += 1
+            return
+        except discord.HTTPException as e:
+            if attempt >= self.retries or key in self.pending:
+                # Out of retries, or a newer level up will try again anyway
+                log.warning(f"Failed to update level roles for {member.name} in {member.guild.name}: {e}")
+                self.failed += 1
+                return
+            self.retried += 1
+            self.pending[key] = (member, monotonic() + self.delay * 2 ** (attempt + 1), attempt + 1)
+            self.wakeup.set()
+            return
+        self.applied += 1
+        get_stats().add("levelup.level_assignment", int((monotonic() - start) * 1000))
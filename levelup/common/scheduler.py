@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Callable, Deque, List, Optional
+
+# Job priorities, lower values are picked first
+INTERACTIVE = 0  # Someone is waiting on a command response
+BACKGROUND = 1  # Level up cards and other fire-and-forget renders
+PREFETCH = 2  # Renders done ahead of time in case they're needed
+RETIRE = -1  # Tells the next free worker to exit when the pool shrinks
+
+_local = threading.local()
+
+
+class RenderQueueFull(Exception):
+    """Raised when a render is submitted while the queue is saturated"""
+
+
+class RenderCancelled(Exception):
+    """Raised inside a render thread once its job has been cancelled"""
+
+
+def check_cancelled() -> None:
+    """
+    Bail out of a render whose caller has given up on it
+
+    Render functions call this between expensive steps so a timed out job frees its worker
+    instead of finishing an image nobody will receive.
+    """
+    event: Optional[threading.Event] = getattr(_local, "cancelled", None)
+    if event is not None and event.is_set():
+        raise RenderCancelled
+
+
+class RenderJob:
+    __slots__ = ("func", "kwargs", "future", "cancelled", "queued_at")
+
+    def __init__(self, func: Callable, kwargs: dict, future: asyncio.Future):
+        self.func = func
+        self.kwargs = kwargs
+        self.future = future
+        self.cancelled = threading.Event()
+        self.queued_at = perf_counter()
+
+    def run(self) -> Any:
+        _local.cancelled = self.cancelled
+        try:
+            return self.func(**self.kwargs)
+        finally:
+            _local.cancelled = None
+
+
+class RenderScheduler:
+    """
+    Runs image renders on a dedicated, bounded thread pool
+
+    Jobs wait in a priority queue so interactive renders jump ahead of background ones,
+    and new jobs are rejected outright once the queue is full instead of piling up.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.tasks: List[asyncio.Task] = []
+        self.counter = itertools.count()
+        self.retiring = 0  # Retire markers still waiting in the queue
+
+        # Stats
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.wait_times: Deque[float] = deque(maxlen=500)
+        self.run_times: Deque[float] = deque(maxlen=500)
+
+    def start(self) -> None:
+        if self.tasks:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="levelup-render")
+        self.tasks = [asyncio.create_task(self.worker()) for __ in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        # Nothing will pick up what's still queued, so don't leave anyone waiting on it
+        while not self.queue.empty():
+            __, __, job = self.queue.get_nowait()
+            if job is None:
+                continue
+            job.cancelled.set()
+            self.cancelled += 1
+            if not job.future.done():
+                job.future.cancel()
+        self.retiring = 0
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def resize(self, workers: int, max_queue: int) -> None:
+        """
+        Change the worker count and queue depth without interrupting anything
+
+        Renders in flight finish on the old pool, extra workers are spawned when growing
+        and surplus ones exit once they're free when shrinking.
+        """
+        self.max_queue = max(1, max_queue)
+        workers = max(1, workers)
+        if workers == self.workers:
+            return
+        self.workers = workers
+        if not self.tasks:
+            return
+        # New jobs go to a pool of the new size, the old one winds down after its current renders
+        old = self.executor
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="levelup-render")
+        if old:
+            old.shutdown(wait=False)
+
+        current = len(self.tasks) - self.retiring
+        for __ in range(workers - current):
+            self.tasks.append(asyncio.create_task(self.worker()))
+        for __ in range(current - workers):
+            self.retiring += 1
+            self.queue.put_nowait((RETIRE, next(self.counter), None))
+
+    @property
+    def queued(self) -> int:
+        return self.queue.qsize() - self.retiring
+
+    @property
+    def idle(self) -> bool:
+        """Nothing waiting and at least one worker free"""
+        return not self.queued and self.running < self.workers
+
+    @property
+    def avg_wait(self) -> float:
+        return sum(self.wait_times) / len(self.wait_times) if self.wait_times else 0.0
+
+    @property
+    def avg_run(self) -> float:
+        return sum(self.run_times) / len(self.run_times) if self.run_times else 0.0
+
+    async def submit(self, func: Callable, priority: int = INTERACTIVE, timeout: float = 60, **kwargs) -> Any:
+        """
+        Queue a render and wait for its result
+
+        Raises RenderQueueFull when saturated and asyncio.TimeoutError if the render takes too long,
+        in which case the job is cancelled whether it has started yet or not.
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise RenderQueueFull
+
+        job = RenderJob(func, kwargs, asyncio.get_running_loop().create_future())
+        self.queue.put_nowait((priority, next(self.counter), job))
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            job.cancelled.set()
+            raise
+        except asyncio.CancelledError:
+            job.cancelled.set()
+            raise
+
+    async def worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            __, __, job = await self.queue.get()
+            if job is None:
+                self.retiring -= 1
+                self.tasks.remove(asyncio.current_task())
+                return
+            job: RenderJob
+            if job.cancelled.is_set():
+                # Caller gave up before the job ever started
+                self.cancelled += 1
+                continue
+
+            start = perf_counter()
+            self.wait_times.append(start - job.queued_at)
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.executor, job.run)
+            except RenderCancelled:
+                self.cancelled += 1
+                if not job.future.done():
+                    job.future.cancel()
+            except asyncio.CancelledError:
+                # Scheduler is stopping, let the render thread bail out at its next check
+                job.cancelled.set()
+                self.cancelled += 1
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.completed += 1
+                self.run_times.append(perf_counter() - start)
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.running -= 1
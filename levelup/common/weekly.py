@@ -0,0 +1,38 @@
+from typing import Dict, Optional
+
+STATS = ("xp", "messages", "voice")
+
+
+def capture(users: Dict[str, dict], weekly: Optional[Dict[str, dict]] = None) -> dict:
+    """
+    Columnar snapshot of everyone's totals that weekly stats are measured from
+
+    Stored as one list per stat instead of a dict per user so it stays small in the config.
+    Pass the weekly stats users should keep, otherwise everyone starts the week at 0.
+    """
+    weekly = weekly or {}
+    ids = list(users)
+    baseline = {"ids": ids}
+    for stat in STATS:
+        baseline[stat] = [users[uid].get(stat, 0) - weekly.get(uid, {}).get(stat, 0) for uid in ids]
+    return baseline
+
+
+def diff(users: Dict[str, dict], baseline: dict) -> Dict[str, dict]:
+    """
+    Weekly stats for everyone that has any, their current totals minus the baseline
+
+    Users missing from the baseline joined since it was captured, so all of their stats count.
+    """
+    index = {uid: i for i, uid in enumerate(baseline.get("ids", []))}
+    weekly = {}
+    for uid, user in users.items():
+        i = index.get(uid)
+        if i is None:
+            stats = {stat: user.get(stat, 0) for stat in STATS}
+        else:
+            # Totals can go down when an admin edits them, weekly stats can't
+            stats = {stat: max(user.get(stat, 0) - baseline[stat][i], 0) for stat in STATS}
+        if any(stats.values()):
+            weekly[uid] = stats
+    return weekly
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from pathlib import Path
+from time import perf_counter
+from typing import Optional, Tuple
+
+from .bootstrap import spawn_target
+from .generator import Generator
+from .scheduler import RenderCancelled, check_cancelled
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Generator instance living inside each worker process
+_renderer: Optional["Renderer"] = None
+
+
+class Renderer(Generator):
+    """Generator that runs outside of the cog, used by render worker processes"""
+
+    def __init__(self, maindir: Path, savedir: Path):
+        self.setup_assets(maindir, savedir)
+
+
+def init_worker(maindir: str, savedir: str) -> None:
+    global _renderer
+    _renderer = Renderer(Path(maindir), Path(savedir))
+
+
+def render(method: str, params: dict) -> Tuple[bytes, str]:
+    """Entry point for a render inside a worker process, asset urls must already be fetched into bytes"""
+    return _renderer.render_image(method, **params)
+
+
+def peak_rss() -> int:
+    """Highest resident memory of this process so far in bytes, 0 where it can't be measured"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_render(method: str, params: dict) -> int:
+    """How far a single render pushes the peak memory of a fresh worker above what it started at"""
+    before = peak_rss()
+    render(method, params)
+    return peak_rss() - before
+
+
+class ProcessPool:
+    """
+    Runs renders in separate processes so they don't fight the event loop for the GIL
+
+    Each worker keeps its own Generator, so fonts and backgrounds stay warm between renders.
+    Processes are spawned rather than forked to avoid inheriting the bot's event loop and threads.
+    """
+
+    def __init__(self, maindir: Path, savedir: Path):
+        self.maindir = str(maindir)
+        self.savedir = str(savedir)
+        self.workers = 0
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self.executor is not None
+
+    def start(self, workers: int) -> None:
+        if self.executor and workers == self.workers:
+            return
+        self.stop()
+        self.workers = workers
+        self.executor = self.make_executor(workers)
+
+    def stop(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def make_executor(self, workers: int) -> ProcessPoolExecutor:
+        # Once the initializer has put the cog on the child's path, render calls unpickle normally
+        initializer, initargs = spawn_target(init_worker, self.maindir, self.savedir)
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initializer,
+            initargs=initargs,
+        )
+
+    def render(self, method: str, params: dict) -> Tuple[bytes, str]:
+        """Called from a scheduler thread, blocks until the worker process is done"""
+        future = self.executor.submit(render, method, params)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                try:
+                    check_cancelled()
+                except RenderCancelled:
+                    # A render that already started can't be interrupted, but one still waiting can be dropped
+                    future.cancel()
+                    raise
+
+    def benchmark(self, workers: int, renders: int, method: str, params: dict) -> float:
+        """Time a batch of renders on a fresh pool of the given size, returns renders per second"""
+        executor = self.make_executor(workers)
+        try:
+            # Warm up every worker first so process startup isn't counted
+            list(executor.map(render, [method] * workers, [params] * workers))
+            start = perf_counter()
+            list(executor.map(render, [method] * renders, [params] * renders))
+            elapsed = perf_counter() - start
+        finally:
+            executor.shutdown(wait=True)
+        return renders / elapsed
+
+    def memory_benchmark(self, method: str, params: dict) -> int:
+        """Peak memory in bytes added by one render, measured in a brand new worker so nothing is warmed up yet"""
+        executor = self.make_executor(1)
+        try:
+            return executor.submit(measure_render, method, params).result()
+        finally:
+            executor.shutdown(wait=True)
+
+
+def benchmark_threads(generator: Generator, workers: int, renders: int, method: str, params: dict) -> float:
+    """Same as ProcessPool.benchmark but rendering on threads in this process, for comparison"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda __: generator.render_image(method, **params), range(workers)))
+        start = perf_counter()
+        list(executor.map(lambda __: generator.render_image(method, **params), range(renders)))
+        elapsed = perf_counter() - start
+    return renders / elapsed
+
+
+def cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
@@ -5,10 +5,13 @@ import logging
 import math
 import random
 import re
+import socket
 import sys
-from datetime import datetime
+from copy import deepcopy
+from datetime import datetime, timezone
 from io import BytesIO
-from time import monotonic, perf_counter
+from pathlib import Path
+from time import monotonic
 from typing import Dict, List, Optional, Set, Tuple, Union
 
 import discord
@@ -18,7 +21,7 @@ from discord.ext import tasks
 from perftracker import get_stats, perf
 from redbot.core import Config, VersionInfo, commands, version_info
 from redbot.core.bot import Red
-from redbot.core.data_manager import cog_data_path
+from redbot.core.data_manager import bundled_data_path, cog_data_path
 from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils import AsyncIter
 from redbot.core.utils.chat_formatting import (
@@ -39,22 +42,35 @@ from levelup.utils.formatter import (
     get_attachments,
     get_content_from_url,
     get_level,
+    get_level_bounds,
     get_level_color,
     get_next_reset,
     get_twemoji,
     get_xp,
-    hex_to_rgb,
     time_formatter,
     time_to_level,
 )
 
 from .abc import CompositeMetaClass
 from .common import constants
+from .common.archive import WeeklyArchive
 from .common.base import UserCommands
+from .common.cache import RemoteImageCache, RenderCache, SingleFlight
+from .common.notify import Notice, NotificationDispatcher
+from .common.renderd import RenderService
+from .common.resets import ResetScheduler
+from .common.roles import RoleLadder
+from .common.rolesync import RoleQueue, RoleSync, compute_changes, compute_levels
+from .common.scheduler import RenderScheduler
+from .common.weekly import capture
+from .common.weekly import diff as weekly_diff
 from .common.generator import Generator
+from .common.worker import ProcessPool, benchmark_threads, cpu_count
 
 log = logging.getLogger("red.vrt.levelup")
 _ = Translator("LevelUp", __file__)
+# How long a computed weekly leaderboard is reused for
+WEEKLY_TTL = 15
 
 
 async def confirm(ctx: commands.Context):
@@ -97,10 +113,17 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
 
     async def red_delete_data_for_user(self, *, requester, user_id: int):
         deleted = False
+        uid = str(user_id)
         for gid in self.data.copy().keys():
-            if str(user_id) in self.data[gid]["users"]:
-                del self.data[gid]["users"][user_id]
-                deleted = True
+            conf = self.data[gid]
+            if uid not in conf["users"] and uid not in conf["weekly"]["baseline"]["ids"]:
+                continue
+            weekly = self.get_weekly_stats(gid, cached=False)
+            conf["users"].pop(uid, None)
+            # Re-capturing without them drops their column from the baseline too
+            self.rebase_weekly(gid, weekly)
+            deleted = True
+        await asyncio.to_thread(self.archive.purge_user, user_id)
         if deleted:
             await self.save_cache()
 
@@ -117,18 +140,53 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         # Global conf cache
         self.ignored_guilds = []
         self.cache_seconds = 15
+        self.profile_cache_mb = 64
+        self.image_cache_mb = 256
+        self.notify_window = 2
         self.render_gifs = False
-
-        # Keep background compilation cached
-        self.bgdata = {"img": None, "names": []}
-        # Keep font compilation cached
-        self.fdata = {"img": None, "names": []}
+        self.animated_webp = False
+        self.render_workers = 2
+        self.render_queue = 32
+        self.render_backend = "thread"
 
         # Guild IDs as strings, user IDs as strings
         self.lastmsg = {}  # Last sent message for users
         self.voice = {}  # Voice channel info
         self.first_run = True
-        self.profiles = {}
+        # Encoded profile images, keyed by a hash of their render arguments
+        self.profiles = RenderCache(self.profile_cache_mb * 1024 * 1024)
+        # Encoded level up cards, including ones rendered ahead of the next level
+        self.levelups = RenderCache(16 * 1024 * 1024)
+        # Downloaded avatars, banners and backgrounds, kept on disk between restarts
+        self.remote = RemoteImageCache(cog_data_path(self) / "remote", self.image_cache_mb * 1024 * 1024)
+        # Guild ID -> level roles sorted for lookups, dropped whenever levelroles changes
+        self.ladders: Dict[int, RoleLadder] = {}
+        # Guild ID -> running or finished level role initialization
+        self.role_syncs: Dict[int, RoleSync] = {}
+        # Guild ID -> ((base, exp), {User ID: (level, XP it starts at, XP the next one starts at)})
+        self.watermarks: Dict[int, Tuple[tuple, Dict[str, Tuple[int, int, float]]]] = {}
+        # Guild ID -> (time computed, weekly stats), derived from totals and the weekly baseline
+        self.weekly_stats: Dict[int, Tuple[float, Dict[str, dict]]] = {}
+        # Every finished week's stats, kept on disk for trend commands
+        self.archive = WeeklyArchive(cog_data_path(self) / "weekly")
+        # Level role updates from level ups, coalesced per member and applied in the background
+        self.role_queue = RoleQueue(self.get_role_changes)
+        # Level up alerts, batched per channel so bursts go out as a single message
+        self.notifier = NotificationDispatcher(self.notify_window)
+        # Weekly auto-resets, each guild's fires at its scheduled time
+        self.resets = ResetScheduler(self.run_weekly_reset)
+        # User ID -> (banner url, time fetched), dropped when the user updates their profile
+        self.banners: Dict[int, Tuple[Optional[str], float]] = {}
+        # Renders currently in progress, so duplicate requests can share them
+        self.renders = SingleFlight()
+        # Speculative level up card renders, kept so they can be cancelled on unload
+        self.prerenders: Set[asyncio.Task] = set()
+        # Bounded pool that all image renders go through
+        self.scheduler = RenderScheduler(self.render_workers, self.render_queue)
+        # Worker processes for the process render backend, only started when enabled
+        self.pool = ProcessPool(bundled_data_path(self), cog_data_path(self))
+        # Standalone render daemon for the service render backend, only started when enabled
+        self.service = RenderService(bundled_data_path(self), cog_data_path(self))
 
         # For importing user levels from Fixator's Leveler cog
         self._db_ready = False
@@ -149,16 +207,44 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         }
 
         # Loopies
+        self.scheduler.start()
         self.cache_dumper.start()
         self.voice_checker.start()
-        self.weekly_checker.start()
+        self.resets.start()
+        self.render_service_checker.start()
+        self.role_queue.start()
+        self.notifier.start()
 
     def cog_unload(self):
         self.cache_dumper.cancel()
         self.voice_checker.cancel()
-        self.weekly_checker.cancel()
+        self.resets.stop()
+        self.render_service_checker.cancel()
+        for job in self.role_syncs.values():
+            # Checkpointed on the way out, resumed on next load
+            if job.task:
+                job.task.cancel()
+        self.role_queue.stop()
+        self.notifier.stop()
+        for task in self.prerenders:
+            task.cancel()
+        self.scheduler.stop()
+        self.pool.stop()
+        self.service.stop()
+        self.remote.save(force=True)
         asyncio.create_task(self.save_cache())
 
+    def apply_render_settings(self):
+        self.scheduler.resize(self.render_workers, self.render_queue)
+        if self.render_backend == "process":
+            self.pool.start(self.render_workers)
+        else:
+            self.pool.stop()
+        if self.render_backend == "service":
+            self.service.start(self.render_workers)
+        else:
+            self.service.stop()
+
     @staticmethod
     def get_size(num: float) -> str:
         for unit in ["B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB"]:
@@ -177,6 +263,31 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         if old_guild.id in self.data:
             await self.save_cache(old_guild)
             del self.data[old_guild.id]
+            self.resets.cancel(old_guild.id)
+            self.watermarks.pop(old_guild.id, None)
+            await self.prune_backgrounds()
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if self.get_avatar_url(before) == self.get_avatar_url(after) and str(before) == str(after):
+            # Banners aren't included in this event, so drop the cached one in case that's what changed
+            self.banners.pop(after.id, None)
+            return
+        await self.forget_user(after.id, self.get_avatar_url(before))
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if after.guild.id not in self.data:
+            return
+        if (
+            self.get_avatar_url(before) == self.get_avatar_url(after)
+            and before.display_name == after.display_name
+            and before.colour == after.colour
+            and before.top_role == after.top_role
+        ):
+            return
+        stale = [self.get_avatar_url(before)] if self.get_avatar_url(before) != self.get_avatar_url(after) else []
+        await self.forget_user(after.id, *stale)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -260,7 +371,23 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
     async def initialize(self):
         self.ignored_guilds = await self.config.ignored_guilds()
         self.cache_seconds = await self.config.cache_seconds()
+        self.profile_cache_mb = await self.config.profile_cache_mb()
+        self.profiles.set_budget(self.profile_cache_mb * 1024 * 1024)
+        self.image_cache_mb = await self.config.image_cache_mb()
+        self.remote.set_budget(self.image_cache_mb * 1024 * 1024)
+        self.notify_window = await self.config.notify_window()
+        self.notifier.window = self.notify_window
         self.render_gifs = await self.config.render_gifs()
+        self.animated_webp = await self.config.animated_webp()
+        self.render_workers = await self.config.render_workers()
+        self.render_queue = await self.config.render_queue()
+        self.render_backend = await self.config.render_backend()
+        self.apply_render_settings()
+        # Index backgrounds and fonts up front so commands don't scan them on the event loop
+        await asyncio.gather(
+            asyncio.to_thread(self.bg_catalog.refresh),
+            asyncio.to_thread(self.font_catalog.refresh),
+        )
         allclean = []
         for guild in self.bot.guilds:
             gid = guild.id
@@ -275,6 +402,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                         allclean.append(i)
                 log.info(f"Cleaned up {guild.name} config")
             self.data[gid] = data
+            self.ladders.pop(gid, None)
+            self.watermarks.pop(gid, None)
+            self.weekly_stats.pop(gid, None)
+            self.schedule_weekly(gid, catch_up=True)
             self.voice[gid] = {}
             self.lastmsg[gid] = {}
         if allclean and self.first_run:
@@ -282,6 +413,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             await self.save_cache()
         if self.first_run:
             log.info("Config initialized")
+            await self.prune_backgrounds()
+            await self.resume_role_syncs()
         self.first_run = False
 
     @staticmethod
@@ -329,6 +462,15 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                 conf["users"][uid][k] = int(v.replace(",", "")) if v is not None else 0
                 cleaned.append(f"{k} stat should be int")
 
+        # Weekly stats used to be separate counters, they're now measured from a baseline of the totals
+        weekly = conf["weekly"]
+        if "users" in weekly:
+            weekly["baseline"] = capture(conf["users"], weekly.pop("users"))
+            cleaned.append("weekly users converted to a baseline")
+        elif "baseline" not in weekly:
+            weekly["baseline"] = capture(conf["users"])
+            cleaned.append("weekly baseline missing")
+
         return cleaned, data
 
     @perf(max_entries=1000)
@@ -336,7 +478,15 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         if not target_guild:
             await self.config.ignored_guilds.set(self.ignored_guilds)
             await self.config.cache_seconds.set(self.cache_seconds)
+            await self.config.profile_cache_mb.set(self.profile_cache_mb)
+            await self.config.image_cache_mb.set(self.image_cache_mb)
+            await asyncio.to_thread(self.remote.save)
+            await self.config.notify_window.set(self.notify_window)
             await self.config.render_gifs.set(self.render_gifs)
+            await self.config.animated_webp.set(self.animated_webp)
+            await self.config.render_workers.set(self.render_workers)
+            await self.config.render_queue.set(self.render_queue)
+            await self.config.render_backend.set(self.render_backend)
 
         cache = self.data.copy()
         for gid, data in cache.items():
@@ -349,6 +499,29 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                 for k, v in data.copy().items():
                     conf[k] = v
 
+    def get_ladder(self, guild_id: int) -> RoleLadder:
+        if guild_id not in self.ladders:
+            self.ladders[guild_id] = RoleLadder(self.data[guild_id]["levelroles"])
+        return self.ladders[guild_id]
+
+    def get_role_changes(self, member: discord.Member) -> Tuple[List[discord.Role], List[discord.Role]]:
+        """Level roles to add to and remove from a member for the level they're at right now"""
+        conf = self.data.get(member.guild.id)
+        me = member.guild.me
+        if not conf or not me.guild_permissions.manage_roles:
+            return [], []
+        level = conf["users"].get(str(member.id), {}).get("level", 0)
+        add_ids, remove_ids = self.get_ladder(member.guild.id).diff(
+            level, [r.id for r in member.roles], conf["autoremove"]
+        )
+
+        def assignable(role_ids: List[int]) -> List[discord.Role]:
+            # Roles at or above the bot's top role would fail the whole edit
+            roles = [role for role_id in role_ids if (role := member.guild.get_role(role_id))]
+            return [role for role in roles if role < me.top_role and not role.managed]
+
+        return assignable(add_ids), assignable(remove_ids)
+
     def init_user(self, guild_id: int, user_id: str):
         if user_id in self.data[guild_id]["users"]:
             return
@@ -368,14 +541,22 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             "blur": True,
         }
 
-    def init_user_weekly(self, guild_id: int, user_id: str):
-        if user_id in self.data[guild_id]["weekly"]["users"]:
-            return
-        self.data[guild_id]["weekly"]["users"][user_id] = {
-            "xp": 0,
-            "voice": 0,  # Seconds,
-            "messages": 0,
-        }
+    def get_weekly_stats(self, guild_id: int, cached: bool = True) -> Dict[str, dict]:
+        """User ID -> weekly xp, messages and voice for everyone with stats this week"""
+        if cached and guild_id in self.weekly_stats:
+            computed, weekly = self.weekly_stats[guild_id]
+            if monotonic() - computed < WEEKLY_TTL:
+                return weekly
+        conf = self.data[guild_id]
+        weekly = weekly_diff(conf["users"], conf["weekly"]["baseline"])
+        self.weekly_stats[guild_id] = (monotonic(), weekly)
+        return weekly
+
+    def rebase_weekly(self, guild_id: int, weekly: Dict[str, dict] = None) -> None:
+        """Start the week over from everyone's current totals, keeping the given weekly stats if any"""
+        conf = self.data[guild_id]
+        conf["weekly"]["baseline"] = capture(conf["users"], weekly)
+        self.weekly_stats.pop(guild_id, None)
 
     async def check_levelups(
         self,
@@ -390,7 +571,17 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         background = user["background"]
         level = user["level"]
         xp = user["xp"]
+        # Most calls don't level anyone up, so only compare against the cached bounds of the stored level
+        curve, marks = self.watermarks.get(guild_id, (None, None))
+        if curve != (base, exp):
+            # Curve changed or first check in this guild, every cached bound is stale
+            marks = {}
+            self.watermarks[guild_id] = ((base, exp), marks)
+        mark = marks.get(user_id)
+        if mark and mark[0] == level and mark[1] <= xp < mark[2]:
+            return
         maybe_new_level = get_level(int(xp), base, exp)
+        marks[user_id] = (maybe_new_level, *get_level_bounds(maybe_new_level))
         if maybe_new_level == level:
             return
         guild = self.bot.get_guild(guild_id)
@@ -411,7 +602,6 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         channel_obj: discord.TextChannel = None,
     ):
         conf = self.data[guild.id]
-        levelroles = conf["levelroles"]
         roleperms = guild.me.guild_permissions.manage_roles
         autoremove = conf["autoremove"]
         dm = conf["notifydm"]
@@ -435,151 +625,65 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         member = guild.get_member(int(user))
         if not member:
             return
-        mentionuser = member.mention
-        name = member.name
         pfp = None
         try:
             if self.dpy2:
-                pfp = member.display_avatar.url
+                pfp = member.display_avatar.with_size(512).url
             else:
                 pfp = member.avatar_url
         except AttributeError:
             log.warning(f"Failed to get avatar url for {member.name} in {guild.name}. DPY2 = {self.dpy2}")
 
         # Get roles to be added and removed
-        roles_to_add = []
-        roles_to_remove = []
-        # Role adding/removal
-        if not autoremove:  # Level roles stack
-            for level, role_id in sorted(levelroles.items(), key=lambda x: x[0]):
-                if int(level) <= int(new_level):  # Then give user that role since they should stack
-                    role = guild.get_role(int(role_id))
-                    if not role:
-                        continue
-                    if role not in member.roles:
-                        roles_to_add.append(role)
-
-        else:  # No stacking so add role and remove the others below that level
-            role_applied = False
-            if str(new_level) in levelroles:
-                role_id = levelroles[str(new_level)]
-                role = guild.get_role(int(role_id))
-                if role not in member.roles:
-                    roles_to_add.append(role)
-                    # await member.add_roles(role)
-                    role_applied = True
-
-            # Remove any previous roles, but only if a new role was applied
-            if new_level > 1 and role_applied:
-                for role in member.roles:
-                    for level, role_id in levelroles.items():
-                        if role.id != role_id:
-                            continue
-                        if int(level) >= new_level:
-                            continue
-                        roles_to_remove.append(role)
+        add_ids, remove_ids = self.get_ladder(guild.id).diff(new_level, [r.id for r in member.roles], autoremove)
+        roles_to_add = [role for role_id in add_ids if (role := guild.get_role(role_id))]
+        roles_to_remove = [role for role_id in remove_ids if (role := guild.get_role(role_id))]
 
         new_role = roles_to_add[-1].mention if roles_to_add else None
 
-        # Send levelup messages
-        if not usepics:
-            if notify:
-                if dm:
-                    if new_role:
-                        txt = _("You have just reached level {} in {} and obtained the {} role!").format(
-                            new_level, guild.name, new_role
-                        )
-                    else:
-                        txt = _("You have just reached level {} in {}!").format(new_level, guild.name)
-                    dmembed = discord.Embed(description=txt, color=member.color)
-                    dmembed.set_thumbnail(url=pfp)
-                    try:
-                        await member.send(embed=dmembed)
-                    except discord.Forbidden:
-                        pass
-                elif all(perms) and channel:
-                    if new_role:
-                        txt = _("You have just reached level {} and obtained the {} role!").format(new_level, new_role)
-                    else:
-                        txt = _("Just reached level {}!").format(new_level)
-                    channelembed = discord.Embed(description=txt, color=member.color)
-                    channelembed.set_author(name=name, icon_url=pfp)
-                    try:
-                        if mention:
-                            await channel.send(mentionuser, embed=channelembed)
-                        else:
-                            await channel.send(embed=channelembed)
-                    except Exception as e:
-                        log.warning(f"Failed to send levelup alert to {channel.name}!", exc_info=e)
-
-        else:
+        # Send levelup messages, channel alerts are batched per channel by the dispatcher
+        card = None
+        if notify and usepics:
             # Generate LevelUP Image
             banner = bg if bg else await self.get_banner(member)
 
-            color = str(member.colour)
-            if color == "#000000":  # Don't use default color
-                color = str(discord.Color.random())
-            color = hex_to_rgb(color)
             font = conf["users"][str(user)]["font"]
             args = {
                 "bg_image": banner,
                 "profile_image": pfp,
                 "level": new_level,
-                "color": color,
+                "color": self.get_levelup_color(member),
                 "font_name": font,
             }
-            img = await self.gen_levelup_img(args)
-            temp = BytesIO()
-            try:
-                temp.name = f"{member.id}.webp"
-                img.save(temp, format="WEBP")
-            except KeyError:
-                temp.name = f"{member.id}.png"
-                img.save(temp, format="PNG")
-            temp.seek(0)
-            file = discord.File(temp)
-
-            if notify:
-                if dm:
-                    if new_role:
-                        txt = _("You have just leveled up in {} and obtained the {} role!").format(guild.name, new_role)
-                    else:
-                        txt = _("You just leveled up in {}!").format(guild.name)
-                    try:
-                        await member.send(txt, file=file)
-                    except discord.Forbidden:
-                        pass
-                elif all(perms) and channel:
-                    if new_role:
-                        txt = _("**{} just leveled up and obtained the {} role!**").format(
-                            mentionuser if mention else name, new_role
-                        )
-                    else:
-                        txt = _("**{} just leveled up!**").format(mentionuser if mention else name)
-                    try:
-                        await channel.send(txt, file=file)
-                    except Exception as e:
-                        log.warning(f"Failed to send levelup alert to {channel.name}!", exc_info=e)
+            card = await self.get_levelup_img(args, member.id)
+            # Have the next one ready so it's sent without waiting on a render
+            self.prerender_levelup({**args, "level": new_level + 1}, member.id)
+
+        if notify and dm:
+            if card:
+                if new_role:
+                    txt = _("You have just leveled up in {} and obtained the {} role!").format(guild.name, new_role)
+                else:
+                    txt = _("You just leveled up in {}!").format(guild.name)
+                self.notifier.push_dm(member, txt, card=card)
+            else:
+                if new_role:
+                    txt = _("You have just reached level {} in {} and obtained the {} role!").format(
+                        new_level, guild.name, new_role
+                    )
+                else:
+                    txt = _("You have just reached level {} in {}!").format(new_level, guild.name)
+                dmembed = discord.Embed(description=txt, color=member.color)
+                dmembed.set_thumbnail(url=pfp)
+                self.notifier.push_dm(member, embed=dmembed)
+        elif notify and all(perms) and channel:
+            self.notifier.push(channel, Notice(member, new_level, new_role, mention, pfp, card))
 
         if not roleperms:
             return
-        if not levelroles:
-            return
-
-        leveltime = monotonic()
-        if roles_to_add:
-            try:
-                await member.add_roles(*roles_to_add, reason=_("Leveled Up!"))
-            except discord.Forbidden:
-                log.warning(f"Lacking permissions to add roles to {member.name} in {member.guild.name}")
-        if roles_to_remove:
-            try:
-                await member.add_roles(*roles_to_remove, reason=_("Auto-remove previous level roles"))
-            except discord.Forbidden:
-                log.warning(f"Lacking permissions to remove roles from {member.name} in {member.guild.name}")
-
-        t = int((monotonic() - leveltime) * 1000)
-        get_stats().add("levelup.level_assignment", t)
+        if roles_to_add or roles_to_remove:
+            # Applied in the background once the member stops leveling, see get_role_changes
+            self.role_queue.push(member)
 
     @perf(max_entries=1000)
     async def message_handler(self, message: discord.Message):
@@ -601,11 +705,6 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         if uid not in users:
             self.init_user(gid, uid)
 
-        weekly_users = conf["weekly"]["users"]
-        weekly_on = conf["weekly"]["on"]
-        if weekly_on and uid not in weekly_users:
-            self.init_user_weekly(gid, uid)
-
         # Whether to award xp
         addxp = False
         if uid not in self.lastmsg[gid]:
@@ -658,12 +757,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                 xp_to_give += bxp
             self.lastmsg[gid][uid] = now
             self.data[gid]["users"][uid]["xp"] += xp_to_give
-            if weekly_on:
-                self.data[gid]["weekly"]["users"][uid]["xp"] += xp_to_give
 
         self.data[gid]["users"][uid]["messages"] += 1
-        if weekly_on:
-            self.data[gid]["weekly"]["users"][uid]["messages"] += 1
         await self.check_levelups(gid, uid, message)
 
     async def check_voice(self, guild: discord.guild):
@@ -679,7 +774,6 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         bonuses = conf["rolebonuses"]["voice"]
         channel_bonuses = conf["channelbonuses"]["voice"]
         stream_bonus = conf["streambonus"]
-        weekly_on = conf["weekly"]["on"]
         bonusrole = None
         async for member in AsyncIter(guild.members, steps=100, delay=0.001):
             member: discord.Member = member
@@ -698,9 +792,6 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             if uid not in self.data[gid]["users"]:
                 self.init_user(gid, uid)
 
-            if weekly_on and uid not in self.data[gid]["weekly"]["users"]:
-                self.init_user_weekly(gid, uid)
-
             ts = self.voice[gid][uid]
             td = (now - ts).total_seconds()
             xp_to_give = (td / 60) * xp_per_minute
@@ -756,11 +847,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                     bxp = random.choice(range(bmin, bmax))
                     xp_to_give += bxp
                 self.data[gid]["users"][uid]["xp"] += xp_to_give
-                if weekly_on:
-                    self.data[gid]["weekly"]["users"][uid]["xp"] += xp_to_give
             self.data[gid]["users"][uid]["voice"] += td
-            if weekly_on:
-                self.data[gid]["weekly"]["users"][uid]["voice"] += td
             self.voice[gid][uid] = now
             jobs.append(self.check_levelups(gid, uid, channel_obj=voice_state.channel))
         await asyncio.gather(*jobs)
@@ -792,59 +879,64 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await asyncio.sleep(300)
         log.info("Cache dumper ready")
 
-    @tasks.loop(minutes=15)
-    async def weekly_checker(self):
-        await self.check_weekly()
+    @tasks.loop(seconds=30)
+    async def render_service_checker(self):
+        if self.render_backend != "service":
+            return
+        restarted = await asyncio.to_thread(self.service.ensure)
+        if restarted:
+            log.warning(f"Render service restarted ({self.service.restarts} restarts so far)")
 
-    @weekly_checker.before_loop
-    async def before_weekly_checker(self):
+    @render_service_checker.before_loop
+    async def before_render_service_checker(self):
         await self.bot.wait_until_red_ready()
-        await asyncio.sleep(60)
 
     @perf(max_entries=1000)
-    async def check_weekly(self):
-        for gid, data in self.data.items():
-            w = data["weekly"]
-            if not w["autoreset"] or not w["on"]:
-                continue
-            now = datetime.utcnow()
-            last_reset = datetime.fromtimestamp(w["last_reset"])
-            if last_reset.day == now.day:
-                continue
-
-            td = now - last_reset
-
-            reset = False
-            conditions = [
-                w["reset_hour"] == now.hour,
-                w["reset_day"] == now.weekday(),
-            ]
-            if all(conditions):
-                reset = True
+    def schedule_weekly(self, guild_id: int, catch_up: bool = False) -> None:
+        """
+        (Re)schedule a guild's next weekly auto-reset, call whenever its weekly settings change
 
-            # Check if the bot just missed the last reset
-            if not reset and td.days > 7:
-                log.info("More than 7 days since last reset have passed. Resetting.")
-                reset = True
+        With `catch_up` a reset that was missed while the bot was down runs right away, only pass it
+        when loading or restoring a config, a settings change should never reset the week on the spot.
+        """
+        w = self.data.get(guild_id, {}).get("weekly")
+        if not w or not w["on"] or not w["autoreset"]:
+            return self.resets.cancel(guild_id)
+        when = get_next_reset(w["reset_day"], w["reset_hour"])
+        if catch_up and w["last_reset"] and w["last_reset"] < when - 604800:
+            # The bot was down for the last scheduled reset
+            log.info(f"Missed the last weekly reset for guild {guild_id}, resetting now")
+            when = int(datetime.now(timezone.utc).timestamp())
+        self.resets.schedule(guild_id, when)
 
-            if reset:
-                guild = self.bot.get_guild(gid)
-                if not guild:
-                    continue
-                await self.reset_weekly_stats(guild)
+    async def run_weekly_reset(self, guild_id: int) -> None:
+        await self.bot.wait_until_red_ready()
+        w = self.data.get(guild_id, {}).get("weekly")
+        guild = self.bot.get_guild(guild_id)
+        if not w or not guild or not w["on"] or not w["autoreset"]:
+            return
+        try:
+            await self.reset_weekly_stats(guild)
+        finally:
+            self.schedule_weekly(guild_id)
 
     @perf(max_entries=1000)
     async def reset_weekly_stats(self, guild: discord.Guild, ctx: commands.Context = None):
         """Announce and reset the weekly leaderboard"""
         w = self.data[guild.id]["weekly"].copy()
+        weekly = self.get_weekly_stats(guild.id, cached=False)
         users = {
-            guild.get_member(int(k)): v for k, v in w["users"].items() if (v["xp"] > 0 and guild.get_member(int(k)))
+            guild.get_member(int(k)): v for k, v in weekly.items() if (v["xp"] > 0 and guild.get_member(int(k)))
         }
         channel = guild.get_channel(w["channel"]) if w["channel"] else None
         if not users:
             if ctx:
                 await ctx.send(_("There are no users with exp"))
-            self.data[guild.id]["weekly"]["last_reset"] = int(datetime.utcnow().timestamp())
+            self.data[guild.id]["weekly"]["last_reset"] = int(datetime.now(timezone.utc).timestamp())
+            await asyncio.to_thread(
+                self.archive.append, guild.id, self.data[guild.id]["weekly"]["last_reset"], weekly
+            )
+            self.rebase_weekly(guild.id)
             return
 
         total_xp = humanize_number(round(sum(v["xp"] for v in users.values())))
@@ -918,8 +1010,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             for uid in top_uids:
                 self.data[guild.id]["users"][uid]["xp"] += bonus
 
-        self.data[guild.id]["weekly"]["last_reset"] = int(datetime.utcnow().timestamp())
-        self.data[guild.id]["weekly"]["users"].clear()
+        self.data[guild.id]["weekly"]["last_reset"] = int(datetime.now(timezone.utc).timestamp())
+        await asyncio.to_thread(self.archive.append, guild.id, self.data[guild.id]["weekly"]["last_reset"], weekly)
+        # Bonus exp was added first so it doesn't count towards next week
+        self.rebase_weekly(guild.id)
         self.data[guild.id]["weekly"]["last_embed"] = em.to_dict()
         await self.save_cache(guild)
 
@@ -1102,13 +1196,11 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         """Reset a user's weekly stats"""
         if not self.data[ctx.guild.id]["weekly"]["on"]:
             return await ctx.send(_("Weekly stats are not enabled"))
-        if str(user.id) not in self.data[ctx.guild.id]["weekly"]["users"]:
+        weekly = self.get_weekly_stats(ctx.guild.id, cached=False)
+        if str(user.id) not in weekly:
             return await ctx.send(_("That user has no weekly stats"))
-        self.data[ctx.guild.id]["weekly"]["users"][str(user.id)] = {
-            "xp": 0,
-            "voice": 0,
-            "messages": 0,
-        }
+        del weekly[str(user.id)]
+        self.rebase_weekly(ctx.guild.id, weekly)
         await ctx.send(_("Reset weekly stats for ") + user.name)
         await self.save_cache(ctx.guild)
 
@@ -1137,6 +1229,150 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await ctx.tick()
         await self.save_cache()
 
+    @admin_group.command(name="profilecachesize")
+    @commands.is_owner()
+    async def set_profile_cache_size(self, ctx: commands.Context, megabytes: int):
+        """
+        Set the memory budget for cached profile images
+
+        Profile images are kept encoded in memory and the least recently used ones are dropped
+        once the cache grows past this size.
+        Set to 0 to disable the cache
+        """
+        if megabytes < 0:
+            return await ctx.send(_("The cache size cannot be negative"))
+        self.profile_cache_mb = megabytes
+        self.profiles.set_budget(megabytes * 1024 * 1024)
+        await ctx.tick()
+        await self.save_cache()
+
+    @admin_group.command(name="imagecachesize")
+    @commands.is_owner()
+    async def set_image_cache_size(self, ctx: commands.Context, megabytes: int):
+        """
+        Set the disk budget for downloaded images
+
+        Avatars, banners and background urls are kept on disk so they aren't downloaded again after a restart.
+        The least recently used ones are deleted once the cache grows past this size.
+        """
+        if megabytes < 1:
+            return await ctx.send(_("The cache size must be at least 1 MB"))
+        self.image_cache_mb = megabytes
+        await asyncio.to_thread(self.remote.set_budget, megabytes * 1024 * 1024)
+        await ctx.tick()
+        await self.save_cache()
+
+    @admin_group.command(name="notifywindow")
+    @commands.is_owner()
+    async def set_notify_window(self, ctx: commands.Context, seconds: float):
+        """
+        Set how long level up alerts wait to be batched together
+
+        Alerts for the same channel that come in within this many seconds of each other are sent as one summary
+        message instead of one message per member.
+        Set to 0 to only merge alerts that happen at the same time
+        """
+        if not 0 <= seconds <= 60:
+            return await ctx.send(_("The window must be between 0 and 60 seconds"))
+        self.notify_window = seconds
+        self.notifier.window = seconds
+        await ctx.tick()
+        await self.save_cache()
+
+    @admin_group.command(name="renderworkers")
+    @commands.is_owner()
+    async def set_render_workers(self, ctx: commands.Context, workers: int, queue_size: int = None):
+        """
+        Set how many images can render at once and how many can wait in line
+
+        **Arguments**
+        `workers` - number of render threads, keep this at or below your CPU core count
+        `queue_size` - (Optional) how many renders can be waiting before new ones are turned away
+
+        Profile commands are always rendered ahead of level up cards
+        """
+        if workers < 1:
+            return await ctx.send(_("There must be at least 1 render worker"))
+        if queue_size is not None:
+            if queue_size < 1:
+                return await ctx.send(_("The render queue must hold at least 1 image"))
+            self.render_queue = queue_size
+        self.render_workers = workers
+        self.apply_render_settings()
+        await ctx.tick()
+        await self.save_cache()
+
+    @admin_group.command(name="renderbackend")
+    @commands.is_owner()
+    async def set_render_backend(self, ctx: commands.Context, backend: str):
+        """
+        Choose where images are rendered
+
+        **Backends**
+        `thread` - render on threads inside the bot process (default)
+        `process` - render in separate worker processes, one per render worker
+        `service` - render in a standalone daemon process the bot talks to over a local socket (Unix only)
+
+        The process backend lets renders use more than one CPU core at the cost of some extra memory per worker.
+        The service backend keeps all render memory out of the bot, falling back to rendering in the bot if the daemon is down.
+        Use `[p]lvlset admin renderbench` to see how each backend performs on your machine
+        """
+        backend = backend.lower()
+        if backend not in ("thread", "process", "service"):
+            return await ctx.send(_("The render backend must be `thread`, `process` or `service`"))
+        if backend == "service" and not hasattr(socket, "AF_UNIX"):
+            return await ctx.send(_("The render service needs Unix sockets, which this system doesn't have"))
+        self.render_backend = backend
+        self.apply_render_settings()
+        await ctx.tick()
+        await self.save_cache()
+
+    @admin_group.command(name="renderbench")
+    @commands.is_owner()
+    async def render_benchmark(self, ctx: commands.Context, renders: int = 20):
+        """
+        Benchmark profile rendering throughput
+
+        Renders your profile card on thread and process pools of increasing size and shows the renders per second for each,
+        along with how much memory a single render of each profile style adds at its peak.
+        This will use a lot of CPU while it runs
+        """
+        renders = max(1, min(renders, 200))
+        params = await self.prefetch_assets(
+            {
+                "bg_image": await self.get_banner(ctx.author) or "random",
+                "profile_image": str(
+                    ctx.author.display_avatar.with_size(512).url if self.dpy2 else ctx.author.avatar_url
+                ),
+                "user_display_name": ctx.author.display_name,
+                "user_name": ctx.author.name,
+            }
+        )
+        counts = [1]
+        while counts[-1] * 2 <= cpu_count():
+            counts.append(counts[-1] * 2)
+        if counts[-1] != cpu_count():
+            counts.append(cpu_count())
+
+        rows = []
+        async with ctx.typing():
+            for workers in counts:
+                threaded = await asyncio.to_thread(
+                    benchmark_threads, self, workers, renders, "generate_profile", params
+                )
+                processed = await asyncio.to_thread(
+                    self.pool.benchmark, workers, renders, "generate_profile", params
+                )
+                rows.append(f"{workers:<8}{round(threaded, 2):<10}{round(processed, 2)}")
+            full_peak = await asyncio.to_thread(self.pool.memory_benchmark, "generate_profile", params)
+            slim_peak = await asyncio.to_thread(self.pool.memory_benchmark, "generate_slim_profile", params)
+
+        txt = _("Workers Threads   Processes (renders/sec)\n") + "\n".join(rows)
+        if full_peak or slim_peak:
+            txt += _("\n\nPeak memory per render\n")
+            txt += _("Full: {}\nSlim: {}").format(self.get_size(full_peak), self.get_size(slim_peak))
+        await ctx.send(box(txt))
+
     @admin_group.command(name="rendergifs")
     @commands.is_owner()
     async def toggle_gif_render(self, ctx: commands.Context):
@@ -1151,6 +1387,23 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await ctx.tick()
         await self.save_cache()
 
+    @admin_group.command(name="animatedwebp")
+    @commands.is_owner()
+    async def toggle_animated_webp(self, ctx: commands.Context):
+        """
+        Toggle encoding animated profiles as WEBP instead of GIF
+
+        WEBP keeps full color where GIF is limited to 256 colors, but files are usually larger
+        """
+        if self.animated_webp:
+            self.animated_webp = False
+            await ctx.send(_("Animated profiles will be encoded as GIFs"))
+        else:
+            self.animated_webp = True
+            await ctx.send(_("Animated profiles will be encoded as WEBPs"))
+        await ctx.tick()
+        await self.save_cache()
+
     @admin_group.command(name="globalreset")
     @commands.is_owner()
     async def reset_all(self, ctx: commands.Context):
@@ -1162,7 +1415,11 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             text = _("Not resetting all guilds")
             return await msg.edit(content=text)
         for gid in self.data.copy():
-            self.data[gid] = constants.default_guild
+            self.data[gid] = deepcopy(constants.default_guild)
+            self.ladders.pop(gid, None)
+            self.watermarks.pop(gid, None)
+            self.weekly_stats.pop(gid, None)
+            self.schedule_weekly(gid)
         await msg.edit(content=_("Settings and stats for all guilds have been reset"))
         await ctx.tick()
         await self.save_cache()
@@ -1176,7 +1433,11 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         if not yes:
             text = _("Not resetting config")
             return await msg.edit(content=text)
-        self.data[ctx.guild.id] = constants.default_guild
+        self.data[ctx.guild.id] = deepcopy(constants.default_guild)
+        self.ladders.pop(ctx.guild.id, None)
+        self.watermarks.pop(ctx.guild.id, None)
+        self.weekly_stats.pop(ctx.guild.id, None)
+        self.schedule_weekly(ctx.guild.id)
         await msg.edit(content=_("All settings and stats reset"))
         await ctx.tick()
         await self.save_cache(ctx.guild)
@@ -1200,6 +1461,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                 self.data[ctx.guild.id]["users"][uid]["messages"] = 0
                 self.data[ctx.guild.id]["users"][uid]["level"] = 0
                 deleted += 1
+            self.rebase_weekly(ctx.guild.id)
             text = _("Reset stats for ") + str(deleted) + _(" users")
             await msg.edit(content=text)
         await ctx.tick()
@@ -1211,21 +1473,99 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         cache = [
             self.data.copy(),
             self.voice.copy(),
-            self.profiles.copy(),
         ]
         cachesize = self.get_size(sum(sys.getsizeof(i) for i in cache))
         ct = self.cache_seconds
         em = discord.Embed(description=_("Cog Stats"), color=ctx.author.color)
 
+        profiles = self.profiles
+        lookups = profiles.hits + profiles.misses
+        hitrate = round(profiles.hits / lookups * 100, 1) if lookups else 0
         cachetxt = _("`Profile Cache Time: `") + (_("Disabled\n") if not ct else f"{humanize_number(ct)} seconds\n")
-        cachetxt += _("`Cache Size:         `") + cachesize
+        cachetxt += _("`Cache Size:         `") + cachesize + "\n"
+        cachetxt += _("`Profile Images:     `") + _("{} ({}/{})\n").format(
+            humanize_number(len(profiles)),
+            self.get_size(profiles.size),
+            self.get_size(profiles.max_bytes),
+        )
+        cachetxt += _("`Profile Hit Rate:   `") + f"{hitrate}% ({humanize_number(profiles.evictions)} evicted)\n"
+        cachetxt += _("`Level Up Cards:     `") + _("{} ({}), {} hits\n").format(
+            humanize_number(len(self.levelups)),
+            self.get_size(self.levelups.size),
+            humanize_number(self.levelups.hits),
+        )
+        cachetxt += _("`Coalesced Renders:  `") + _("{} of {} requests").format(
+            humanize_number(self.renders.coalesced),
+            humanize_number(self.renders.started + self.renders.coalesced),
+        )
+        remote = self.remote
+        cachetxt += "\n" + _("`Downloaded Images:  `") + _("{} ({}/{})\n").format(
+            humanize_number(len(remote)),
+            self.get_size(remote.size),
+            self.get_size(remote.max_bytes),
+        )
+        cachetxt += _("`Image Requests:     `") + _("{} cached, {} revalidated, {} downloaded, {} failed").format(
+            humanize_number(remote.hits),
+            humanize_number(remote.revalidated),
+            humanize_number(remote.downloads),
+            humanize_number(remote.failures),
+        )
         em.add_field(name=_("Cache"), value=cachetxt, inline=False)
 
+        sched = self.scheduler
+        rendertxt = _("`Backend:            `") + self.render_backend.capitalize() + "\n"
+        if self.render_backend == "service":
+            service = self.service
+            status = _("Up") if service.alive else _("Down")
+            if service.latency is not None:
+                status += f" ({round(service.latency * 1000, 1)}ms ping)"
+            rendertxt += _("`Service:            `") + status + "\n"
+            rendertxt += _("`Restarts:           `") + _("{} ({} fallback renders)\n").format(
+                humanize_number(service.restarts), humanize_number(service.fallbacks)
+            )
+        rendertxt += _("`Workers:            `") + _("{} ({} busy)\n").format(sched.workers, sched.running)
+        rendertxt += _("`Queued:             `") + f"{sched.queued}/{sched.max_queue}\n"
+        rendertxt += _("`Completed:          `") + _("{} ({} failed)\n").format(
+            humanize_number(sched.completed), humanize_number(sched.failed)
+        )
+        rendertxt += _("`Rejected:           `") + humanize_number(sched.rejected) + "\n"
+        rendertxt += _("`Timed Out:          `") + _("{} ({} cancelled)\n").format(
+            humanize_number(sched.timed_out), humanize_number(sched.cancelled)
+        )
+        rendertxt += _("`Avg Wait:           `") + f"{round(sched.avg_wait * 1000)}ms\n"
+        rendertxt += _("`Avg Render:         `") + f"{round(sched.avg_run * 1000)}ms"
+        em.add_field(name=_("Render Queue"), value=rendertxt, inline=False)
+
+        queue = self.role_queue
+        roletxt = _("`Pending:            `") + humanize_number(len(queue.pending)) + "\n"
+        roletxt += _("`Applied:            `") + _("{} ({} coalesced)\n").format(
+            humanize_number(queue.applied), humanize_number(queue.coalesced)
+        )
+        roletxt += _("`Retried:            `") + _("{} ({} failed)").format(
+            humanize_number(queue.retried), humanize_number(queue.failed)
+        )
+        em.add_field(name=_("Level Roles"), value=roletxt, inline=False)
+
+        notifier = self.notifier
+        notifytxt = _("`Batch Window:       `") + _("{}s\n").format(notifier.window)
+        notifytxt += _("`Queued:             `") + _("{} ({} DMs)\n").format(
+            humanize_number(notifier.depth), humanize_number(notifier.dms.qsize())
+        )
+        notifytxt += _("`Sent:               `") + _("{} messages ({} alerts merged)\n").format(
+            humanize_number(notifier.sent), humanize_number(notifier.merged)
+        )
+        notifytxt += _("`Dropped:            `") + _("{} ({} failed)").format(
+            humanize_number(notifier.dropped), humanize_number(notifier.failed)
+        )
+        em.add_field(name=_("Level Up Alerts"), value=notifytxt, inline=False)
+
         render = _("(Disabled)")
         txt = _("Profiles will be static regardless of if the user has an animated profile")
         if self.render_gifs:
             render = _("(Enabled)")
             txt = _("Users with animated profiles will render as a gif")
+            if self.animated_webp:
+                txt = _("Users with animated profiles will render as an animated webp")
 
         em.add_field(name=_("GIF Rendering ") + render, value=txt, inline=False)
 
@@ -1296,9 +1636,14 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                 data = newdata
 
             self.data[int(gid)] = data
+            self.schedule_weekly(int(gid), catch_up=True)
 
         await self.save_cache()
         await ctx.send(_("Config restored from backup file!"))
+        for gid in config:
+            if guild := self.bot.get_guild(int(gid)):
+                self.ladders.pop(guild.id, None)
+                await self.recalculate_levels(guild)
 
     @admin_group.command(name="guildrestore")
     @commands.guildowner()
@@ -1321,8 +1666,11 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         if cleaned:
             config = newdata
         self.data[ctx.guild.id] = config
+        self.ladders.pop(ctx.guild.id, None)
+        self.schedule_weekly(ctx.guild.id, catch_up=True)
         await self.save_cache()
         await ctx.send(_("Config restored from backup file!"))
+        await self.recalculate_levels(ctx.guild, ctx)
 
     @admin_group.command(name="importmalarne")
     @commands.is_owner()
@@ -1352,6 +1700,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
 
         data = json.loads(path.read_text())["1099710897114110101"]["MEMBER"]
         imported = 0
+        # Imported totals shouldn't show up as this week's stats
+        weekly = {gid: self.get_weekly_stats(gid, cached=False) for gid in self.data}
         async with ctx.typing():
             for guild in self.bot.guilds:
                 if guild.id not in self.data:
@@ -1393,6 +1743,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             return await ctx.send(_("There were no profiles to import"))
         txt = _("Imported {} profile(s)").format(imported)
         await ctx.send(txt)
+        for guild in self.bot.guilds:
+            if guild.id in self.data:
+                self.rebase_weekly(guild.id, weekly.get(guild.id))
+                await self.recalculate_levels(guild)
 
     @retry(
         retry=retry_if_exception_type(json.JSONDecodeError),
@@ -1530,6 +1884,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                             level_requirement = entry["rank"]
                             role_id = entry["role"]["id"]
                             self.data[ctx.guild.id]["levelroles"][str(level_requirement)] = int(role_id)
+                        self.ladders.pop(ctx.guild.id, None)
                     await ctx.send("Settings imported!")
 
                 player_data = data.get("players")
@@ -1548,6 +1903,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await msg.edit(content=_("Data retrieved, importing..."))
         imported = 0
         failed = 0
+        # Imported totals shouldn't show up as this week's stats
+        weekly = self.get_weekly_stats(ctx.guild.id, cached=False)
         async with ctx.typing():
             async for user in AsyncIter(players):
                 uid = str(user["id"])
@@ -1585,6 +1942,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
 
                 imported += 1
 
+        self.rebase_weekly(ctx.guild.id, weekly)
         if not imported and not failed:
             await msg.edit(content=_("No MEE6 stats were found"))
         else:
@@ -1594,6 +1952,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             await msg.edit(content=txt)
             await ctx.tick()
             await self.save_cache(ctx.guild)
+            await self.recalculate_levels(ctx.guild, ctx)
 
     @admin_group.command(name="importamari")
     @commands.guildowner()
@@ -1676,6 +2035,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await msg.edit(content=_("Data retrieved, importing..."))
         imported = 0
         failed = 0
+        # Imported totals shouldn't show up as this week's stats, only AmariBot's own weekly exp
+        weekly = self.get_weekly_stats(ctx.guild.id, cached=False)
         async with ctx.typing():
             async for user in AsyncIter(players):
                 uid = user["id"]
@@ -1693,9 +2054,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                     self.init_user(ctx.guild.id, uid)
 
                 weekly_on = self.data[ctx.guild.id]["weekly"]["on"]
-
-                if weekly_on and uid not in self.data[ctx.guild.id]["weekly"]["users"]:
-                    self.init_user_weekly(ctx.guild.id, uid)
+                if weekly_on:
+                    weekly.setdefault(uid, {"xp": 0, "messages": 0, "voice": 0})
 
                 if replace:  # Replace stats
                     if "l" in import_by.lower():
@@ -1708,7 +2068,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                         self.data[ctx.guild.id]["users"][uid]["level"] = newlvl
 
                     if weekly_on:
-                        self.data[ctx.guild.id]["weekly"]["users"][uid]["xp"] = weekly_exp
+                        weekly[uid]["xp"] = weekly_exp
 
                 else:  # Add stats
                     if "l" in import_by.lower():
@@ -1721,10 +2081,11 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                         self.data[ctx.guild.id]["users"][uid]["level"] = newlvl
 
                     if weekly_on:
-                        self.data[ctx.guild.id]["weekly"]["users"][uid]["xp"] += weekly_exp
+                        weekly[uid]["xp"] += weekly_exp
 
                 imported += 1
 
+        self.rebase_weekly(ctx.guild.id, weekly)
         if not imported and not failed:
             await msg.edit(content=_("No AmariBot stats were found"))
         else:
@@ -1734,6 +2095,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             await msg.edit(content=txt)
             await ctx.tick()
             await self.save_cache(ctx.guild)
+            await self.recalculate_levels(ctx.guild, ctx)
 
     @admin_group.command(name="importpolaris")
     @commands.guildowner()
@@ -1817,6 +2179,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                     if role_rewards := data.get("rewards"):
                         for entry in role_rewards:
                             self.data[ctx.guild.id]["levelroles"][str(entry["level"])] = int(entry["id"])
+                        self.ladders.pop(ctx.guild.id, None)
 
                     await ctx.send("Settings imported!")
 
@@ -1836,6 +2199,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         await msg.edit(content=_("Data retrieved, importing..."))
         imported = 0
         failed = 0
+        # Imported totals shouldn't show up as this week's stats
+        weekly = self.get_weekly_stats(ctx.guild.id, cached=False)
         async with ctx.typing():
             async for user in AsyncIter(players):
                 uid = str(user["id"])
@@ -1859,6 +2224,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
 
                 imported += 1
 
+        self.rebase_weekly(ctx.guild.id, weekly)
         if not imported and not failed:
             await msg.edit(content=_("No Polaris stats were found"))
         else:
@@ -1868,6 +2234,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             await msg.edit(content=txt)
             await ctx.tick()
             await self.save_cache(ctx.guild)
+            await self.recalculate_levels(ctx.guild, ctx)
 
     @admin_group.command(name="importfixator")
     @commands.is_owner()
@@ -1941,6 +2308,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         embed.set_thumbnail(url=self.loading)
         msg = await ctx.send(embed=embed)
         users_imported = 0
+        # Imported totals shouldn't show up as this week's stats
+        weekly = {gid: self.get_weekly_stats(gid, cached=False) for gid in self.data}
         # Now to start the importing
         async with ctx.typing():
             min_message_length = global_config.get("message_length", 0)
@@ -1962,6 +2331,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
                             continue
                         level_req = data["level"]
                         self.data[guild.id]["levelroles"][level_req] = role.id
+                    self.ladders.pop(guild.id, None)
 
                 for user in guild.members:
                     user_id = str(user.id)
@@ -1996,6 +2366,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             embed.set_thumbnail(url=self.loading)
             await msg.edit(embed=embed)
             self._disconnect_mongo()
+        for guild in self.bot.guilds:
+            if guild.id in self.data:
+                self.rebase_weekly(guild.id, weekly.get(guild.id))
+                await self.recalculate_levels(guild)
 
     def _disconnect_mongo(self):
         if self.client:
@@ -2027,6 +2401,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         txt = _("Deleted ") + str(cleaned) + _(" user IDs from the config that are no longer in the server.")
         await ctx.send(txt)
         await self.save_cache(ctx.guild)
+        await self.prune_backgrounds()
 
     @lvl_group.group(name="messages", aliases=["message", "msg"])
     async def message_group(self, ctx: commands.Context):
@@ -2304,6 +2679,8 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         gid = ctx.guild.id
         if not user_or_role:
             return await ctx.send(_("I cannot find that user or role"))
+        # Exp granted by an admin doesn't count towards anyone's weekly stats
+        weekly = self.get_weekly_stats(gid, cached=False)
         if isinstance(user_or_role, discord.Member):
             uid = str(user_or_role.id)
             if uid not in self.data[gid]["users"]:
@@ -2325,6 +2702,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             txt = _("Added ") + str(xp) + _(" xp to ") + humanize_number(len(users)) + _(" users that had the ")
             txt += user_or_role.name + _("role")
             await ctx.send(txt)
+        self.rebase_weekly(gid, weekly)
         await self.save_cache(ctx.guild)
 
     @lvl_group.command(name="setlevel")
@@ -2338,8 +2716,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         base = conf["base"]
         exp = conf["exp"]
         xp = get_xp(int(level))
+        weekly = self.get_weekly_stats(ctx.guild.id, cached=False)
         conf["users"][uid]["level"] = int(level)
         conf["users"][uid]["xp"] = xp
+        self.rebase_weekly(ctx.guild.id, weekly)
         txt = _("User ") + user.name + _(" is now level ") + str(level)
         await ctx.send(txt)
 
@@ -2551,20 +2931,27 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
 
     @level_roles.command(name="initialize")
     @commands.bot_has_permissions(manage_roles=True, embed_links=True)
-    async def init_roles(self, ctx: commands.Context):
+    async def init_roles(self, ctx: commands.Context, dry_run: bool = False):
         """
         Initialize level roles
 
         This command is for if you added level roles after users have achieved that level,
         it will apply all necessary roles to a user according to their level
+
+        Members that already have the right roles are skipped, and progress is saved as it goes
+        so a restart picks up where it left off.
+        Use `dry_run` as `True` to see what would change without changing anything.
         """
-        start = perf_counter()
         guild = ctx.guild
         perms = guild.me.guild_permissions.manage_roles
         if not perms:
             return await ctx.send(_("I dont have the proper permissions to manage roles!"))
-        roles_added = 0
-        roles_removed = 0
+        if (job := self.role_syncs.get(guild.id)) and not job.task.done():
+            return await ctx.send(
+                _("Roles are already being initialized, {}/{} members done.").format(
+                    humanize_number(job.done), humanize_number(job.total)
+                )
+            )
         embed = discord.Embed(
             description=_("Calculating roles, this may take a while..."),
             color=discord.Color.magenta(),
@@ -2572,104 +2959,128 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         embed.set_thumbnail(url=self.loading)
         msg = await ctx.send(embed=embed)
 
-        to_add: Dict[discord.Member, Set[discord.Role]] = {}
-        to_remove: Dict[discord.Member, Set[discord.Role]] = {}
-
-        conf = self.data[ctx.guild.id]
-        level_roles = conf["levelroles"]
-        autoremove = conf["autoremove"]
-        users = [i for i in conf["users"]]
-        for user_id in users:
-            user = guild.get_member(int(user_id))
-            if not user:
-                continue
-            to_add[user] = set()
-            to_remove[user] = set()
-
-            data = conf["users"][user_id]
-            user_level = data["level"]
-            if autoremove:
-                highest_level = 0
-                for level, role_id in level_roles.items():
-                    if int(user_level) >= int(level) >= highest_level:
-                        highest_level = int(level)
-
-                if highest_level:
-                    role_id = level_roles[str(highest_level)]
-                    if role := guild.get_role(role_id):
-                        to_add[user].add(role)
-                        for user_role in user.roles:
-                            if user_role.id in level_roles.values() and user_role.id != role.id:
-                                to_remove[user].add(user_role)
+        conf = self.data[guild.id]
+        members = []
+        for user_id, data in conf["users"].items():
+            if member := guild.get_member(int(user_id)):
+                members.append((member.id, int(data["level"]), [role.id for role in member.roles]))
+        assignable = {role.id for role in guild.roles if role < guild.me.top_role and not role.is_default()}
+        changes = await asyncio.to_thread(
+            compute_changes, self.get_ladder(guild.id), members, conf["autoremove"], assignable
+        )
 
+        if not changes:
+            embed = discord.Embed(description=_("No roles needed to be added or removed!"), color=discord.Color.green())
+            return await msg.edit(embed=embed)
 
-            else:
-                user_role_ids = [role.id for role in user.roles]
-                for lvl, role_id in level_roles.items():
-                    if role := guild.get_role(int(role_id)):
-                        if int(lvl) <= int(user_level) and role.id not in user_role_ids:
-                            to_add[user].add(role)
+        if dry_run:
+            adding = sum(len(add) for add, __ in changes.values())
+            removing = sum(len(remove) for __, remove in changes.values())
+            desc = _("**Dry run**, nothing was changed\n")
+            desc += _("`Members to update: `{}\n").format(humanize_number(len(changes)))
+            desc += _("`Roles to add:      `{}\n").format(humanize_number(adding))
+            desc += _("`Roles to remove:   `{}").format(humanize_number(removing))
+            return await msg.edit(embed=discord.Embed(description=desc, color=discord.Color.blue()))
 
-        embed.description = _("Assigning roles, this may take a while...")
-        await msg.edit(embed=embed)
+        job = RoleSync(guild, changes, self.role_sync_path(guild.id))
+        self.role_syncs[guild.id] = job
 
-        add_fails = 0
-        remove_fails = 0
-        async with ctx.typing():
-            bot_top_role = max(role for role in guild.me.roles)
-            for user, adding in to_add.items():
-                removing = to_remove[user]
+        async def progress(sync: RoleSync):
+            await msg.edit(embed=self.role_sync_embed(sync))
 
-                # Update what can actually be assigned/removed
-                adding = [role for role in adding if role < bot_top_role]
-                removing = [role for role in removing if role < bot_top_role]
+        job.start(progress)
 
-                for role in removing:
-                    if role in adding and role in user.roles:
-                        adding.discard(role)
+    async def recalculate_levels(self, guild: discord.Guild, destination: discord.abc.Messageable = None) -> None:
+        """
+        Re-derive every stored level in a guild from XP, then sync level roles for the members whose level changed
 
-                for role in adding:
-                    if role in removing and role not in user.roles:
-                        removing.discard(role)
+        Run after anything that rewrites levels in bulk, since stored levels are otherwise only corrected
+        the next time each user gains XP. Everyone else's roles are left alone, a full sync is what
+        `[p]lvlset roles initialize` is for. Progress of the role sync is posted to `destination` if one is given.
+        """
+        conf = self.data.get(guild.id)
+        if not conf:
+            return
+        users = [(uid, int(data["xp"]), data["level"]) for uid, data in conf["users"].items()]
+        levels = await asyncio.to_thread(compute_levels, users, conf["base"], conf["exp"])
+        for uid, level in levels.items():
+            if uid in conf["users"]:
+                conf["users"][uid]["level"] = level
+        self.watermarks.pop(guild.id, None)
+        if not levels:
+            return
+        log.info(f"Recalculated levels in {guild.name}, {len(levels)} changed")
+        if destination:
+            await destination.send(_("Recalculated levels for {} member(s)").format(humanize_number(len(levels))))
 
-                try:
-                    await user.add_roles(*adding)
-                    roles_added += len(adding)
-                except discord.Forbidden:
-                    log.warning(
-                        f"Failed to assign the following roles to {user} in {guild}: {humanize_list([r.name for r in adding])}"
-                    )
-                    add_fails += len(adding)
+        if not guild.me.guild_permissions.manage_roles or not self.get_ladder(guild.id):
+            return
+        members = []
+        for user_id, level in levels.items():
+            if member := guild.get_member(int(user_id)):
+                members.append((member.id, level, [role.id for role in member.roles]))
+        assignable = {role.id for role in guild.roles if role < guild.me.top_role and not role.is_default()}
+        changes = await asyncio.to_thread(
+            compute_changes, self.get_ladder(guild.id), members, conf["autoremove"], assignable
+        )
+        if not changes:
+            return
 
-                try:
-                    await user.remove_roles(*removing)
-                    roles_removed += len(removing)
-                except discord.Forbidden:
-                    log.warning(
-                        f"Failed to remove the following roles from {user} in {guild}: {humanize_list([r.name for r in removing])}"
-                    )
-                    remove_fails += len(removing)
+        if (job := self.role_syncs.get(guild.id)) and job.task and not job.task.done():
+            # Superseded, this diff is taken from the members' current roles anyway
+            job.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await job.task
+        job = RoleSync(guild, changes, self.role_sync_path(guild.id))
+        self.role_syncs[guild.id] = job
+        progress = None
+        if destination:
+            msg = await destination.send(embed=self.role_sync_embed(job))
 
-        desc = _("Role initialization completed!")
-        if roles_added:
-            desc += _("\nAdded `{}`").format(roles_added)
-            if add_fails:
-                desc += _(" (`{}` failed)").format(add_fails)
+            async def progress(sync: RoleSync):
+                await msg.edit(embed=self.role_sync_embed(sync))
 
-        if roles_removed:
-            desc += _("\nRemoved `{}`").format(roles_removed)
-            if remove_fails:
-                desc += _(" (`{}` failed)").format(remove_fails)
+        job.start(progress)
 
-        if not roles_added and not roles_removed:
-            desc += _("\nNo roles needed to be added or removed!")
+    def role_sync_path(self, guild_id: int) -> Path:
+        return cog_data_path(self) / "rolesync" / f"{guild_id}.json"
 
-        embed = discord.Embed(description=desc, color=discord.Color.green())
-        td = round(perf_counter() - start)
-        delta = humanize_timedelta(seconds=td)
-        foot = _("Initialization took {} to complete.").format(delta)
-        embed.set_footer(text=foot)
-        await msg.edit(embed=embed)
+    @staticmethod
+    def role_sync_embed(job: RoleSync) -> discord.Embed:
+        desc = _("`Members:    `{}/{}\n").format(humanize_number(job.done), humanize_number(job.total))
+        desc += _("`Throughput: `{}/s\n").format(round(job.rate, 1))
+        desc += _("`Added:      `{}\n").format(humanize_number(job.added))
+        desc += _("`Removed:    `{}\n").format(humanize_number(job.removed))
+        if job.failed:
+            desc += _("`Failed:     `{}\n").format(humanize_number(job.failed))
+        if job.finished:
+            embed = discord.Embed(title=_("Role initialization completed!"), description=desc, color=discord.Color.green())
+            delta = humanize_timedelta(seconds=int(monotonic() - job.started)) or _("less than a second")
+            embed.set_footer(text=_("Initialization took {} to complete.").format(delta))
+            return embed
+        embed = discord.Embed(title=_("Assigning roles..."), description=desc, color=discord.Color.magenta())
+        if job.eta is not None:
+            embed.set_footer(text=_("About {} left").format(humanize_timedelta(seconds=job.eta) or _("a few seconds")))
+        return embed
+
+    async def resume_role_syncs(self) -> None:
+        """Pick back up any role initializations that were cut short by a restart"""
+        folder = cog_data_path(self) / "rolesync"
+        if not folder.exists():
+            return
+        for file in folder.glob("*.json"):
+            guild = self.bot.get_guild(int(file.stem))
+            if not guild or guild.id in self.role_syncs:
+                continue
+            try:
+                job = await asyncio.to_thread(RoleSync.load, guild, file)
+            except (ValueError, KeyError, OSError):
+                log.warning(f"Discarding unreadable role sync checkpoint {file.name}")
+                file.unlink(missing_ok=True)
+                continue
+            log.info(f"Resuming role initialization in {guild.name}, {len(job.pending)} members left")
+            self.role_syncs[guild.id] = job
+            job.start()
 
     @level_roles.command(name="autoremove")
     async def toggle_autoremove(self, ctx: commands.Context):
@@ -2698,6 +3109,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         else:
             overwrite = _("Set")
         self.data[ctx.guild.id]["levelroles"][level] = role.id
+        self.ladders.pop(ctx.guild.id, None)
         txt = _("Level ") + str(level) + _(" has been ") + overwrite + _(" as ") + role.mention
         await ctx.send(txt)
         await self.save_cache(ctx.guild)
@@ -2707,6 +3119,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         """Unassign a role from a level"""
         if level in self.data[ctx.guild.id]["levelroles"]:
             del self.data[ctx.guild.id]["levelroles"][level]
+            self.ladders.pop(ctx.guild.id, None)
             await ctx.send(_("Level role has been deleted!"))
             await self.save_cache(ctx.guild)
         else:
@@ -2861,7 +3274,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
             await ctx.send(_("Weekly stat tracking has been **Disabled**"))
         else:
             self.data[ctx.guild.id]["weekly"]["on"] = True
+            # Only count what happens from here on
+            self.rebase_weekly(ctx.guild.id)
             await ctx.send(_("Weekly stat tracking has been **Enabled**"))
+        self.schedule_weekly(ctx.guild.id)
         await self.save_cache(ctx.guild)
 
     @weekly_set.command(name="autoreset")
@@ -2874,6 +3290,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         else:
             self.data[ctx.guild.id]["weekly"]["autoreset"] = True
             await ctx.send(_("Weekly auto-reset has been **Enabled**"))
+        self.schedule_weekly(ctx.guild.id)
         await self.save_cache(ctx.guild)
 
     @weekly_set.command(name="hour")
@@ -2888,6 +3305,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         txt = _("Weekly stats auto reset hour is now ") + f"{hour} (UTC)"
         await ctx.send(txt)
         await ctx.tick()
+        self.schedule_weekly(ctx.guild.id)
         await self.save_cache(ctx.guild)
 
     @weekly_set.command(name="day")
@@ -2902,6 +3320,7 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         txt = _("Weekly stats auto reset day is now ") + f"**{self.daymap[day_of_the_week]}**"
         await ctx.send(txt)
         await ctx.tick()
+        self.schedule_weekly(ctx.guild.id)
         await self.save_cache(ctx.guild)
 
     @weekly_set.command(name="top")
@@ -2995,8 +3414,10 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         user = users[uid]
         level = user["level"]
         level = level + 1
-        xp = get_xp(level, base, ex)
+        xp = get_xp(level)
+        weekly = self.get_weekly_stats(gid, cached=False)
         self.data[gid]["users"][uid]["xp"] = xp
+        self.rebase_weekly(gid, weekly)
         await asyncio.sleep(2)
         txt = _("Forced ") + person.name + _(" to level up!")
         await ctx.send(txt)
@@ -3021,7 +3442,9 @@ class LevelUp(UserCommands, Generator, commands.Cog, metaclass=CompositeMetaClas
         level = user["level"]
         level = level - 1
         xp = get_xp(level)
+        weekly = self.get_weekly_stats(gid, cached=False)
         self.data[gid]["users"][uid]["xp"] = xp
+        self.rebase_weekly(gid, weekly)
         await asyncio.sleep(2)
         txt = _("Forced ") + person.name + _(" to level down!")
         await ctx.send(txt)
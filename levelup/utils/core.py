@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import math
+import threading
+from collections import OrderedDict
+from time import monotonic
 from typing import (
     TYPE_CHECKING,
     Dict,
@@ -12,9 +15,9 @@ from typing import (
     Union,
 )
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 
-from .helpers import NodeType, getsize, to_nodes
+from .helpers import Node, NodeType, getsize, to_nodes
 from .source import BaseSource, HTTPBasedSource, Twemoji, _has_requests
 
 if TYPE_CHECKING:
@@ -25,7 +28,72 @@ if TYPE_CHECKING:
 
 P = TypeVar("P", bound="Pilmoji")
 
-__all__ = ("Pilmoji",)
+__all__ = ("Pilmoji", "EmojiProvider")
+
+
+def scale_emoji(image: Image.Image, width: int) -> Image.Image:
+    image = image.convert("RGBA")
+    size = width, math.ceil(image.height / image.width * width)
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+class EmojiProvider:
+    """Shares one emoji source between renderers and keeps emojis decoded and resized.
+
+    Images are kept per emoji and pixel width, so an emoji drawn at the same size
+    again is pasted straight from memory. Images handed out must not be modified.
+    Emojis the source doesn't have are remembered for a while too, so text full of
+    unknown emojis doesn't hit the source on every render.
+
+    Parameters
+    ----------
+    source: :class:`~.BaseSource`
+        The emoji image source to use.
+    maxsize: int
+        How many resized emoji images to keep. Defaults to `512`
+    miss_ttl: float
+        Seconds to wait before asking the source again for an emoji it didn't have. Defaults to `300`
+    """
+
+    def __init__(self, source: BaseSource, maxsize: int = 512, miss_ttl: float = 300) -> None:
+        self.source: BaseSource = source
+        self.maxsize: int = maxsize
+        self.miss_ttl: float = miss_ttl
+        self._images: OrderedDict[Tuple[str, bool, int], Image.Image] = OrderedDict()
+        self._misses: OrderedDict[Tuple[str, bool], float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, emoji: str, width: int, *, discord_emoji: bool = False) -> Optional[Image.Image]:
+        """Return the emoji scaled to the given width, or None if the source doesn't have it."""
+        key = (emoji, discord_emoji, width)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            if self._misses.get(key[:2], 0) > monotonic():
+                return None
+
+        stream = self.source.get_discord_emoji(int(emoji)) if discord_emoji else self.source.get_emoji(emoji)
+        if not stream:
+            return self._miss(key[:2])
+        try:
+            with Image.open(stream) as raw:
+                image = scale_emoji(raw, width)
+        except (UnidentifiedImageError, OSError):
+            return self._miss(key[:2])
+
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.maxsize:
+                self._images.popitem(last=False)
+        return image
+
+    def _miss(self, key: Tuple[str, bool]) -> None:
+        with self._lock:
+            self._misses.pop(key, None)
+            self._misses[key] = monotonic() + self.miss_ttl
+            while len(self._misses) > self.maxsize:
+                self._misses.popitem(last=False)
 
 
 class Pilmoji:
@@ -54,6 +122,9 @@ class Pilmoji:
     emoji_position_offset: Tuple[int, int]
         A 2-tuple representing the x and y offset for emojis when rendering,
         respectively. Defaults to `(0, 0)`
+    provider: :class:`~.EmojiProvider`
+        A shared provider to get emojis from instead of the source.
+        Its source is used and is left open when this renderer closes.
     """
 
     def __init__(
@@ -66,9 +137,14 @@ class Pilmoji:
         render_discord_emoji: bool = True,
         emoji_scale_factor: float = 1.0,
         emoji_position_offset: Tuple[int, int] = (0, 0),
+        provider: Optional[EmojiProvider] = None,
     ) -> None:
         self.image: Image.Image = image
         self.draw: ImageDraw.ImageDraw = draw
+        self.provider: Optional[EmojiProvider] = provider
+
+        if provider is not None:
+            source = provider.source
 
         if isinstance(source, type):
             if not issubclass(source, BaseSource):
@@ -106,7 +182,7 @@ class Pilmoji:
         if not self._closed:
             raise ValueError("Renderer is already open.")
 
-        if _has_requests and isinstance(self.source, HTTPBasedSource):
+        if self.provider is None and _has_requests and isinstance(self.source, HTTPBasedSource):
             from requests import Session
 
             self.source._requests_session = Session()
@@ -132,7 +208,7 @@ class Pilmoji:
             del self.draw
             self.draw = None
 
-        if _has_requests and isinstance(self.source, HTTPBasedSource):
+        if self.provider is None and _has_requests and isinstance(self.source, HTTPBasedSource):
             self.source._requests_session.close()
 
         if self._cache:
@@ -180,6 +256,21 @@ class Pilmoji:
             stream.seek(0)
             return stream
 
+    def _get_asset(self, node: Node, width: int, /) -> Optional[Image.Image]:
+        discord_emoji = node.type is NodeType.discord_emoji
+        if discord_emoji and not self._render_discord_emoji:
+            return None
+
+        if self.provider is not None:
+            return self.provider.get(node.content, width, discord_emoji=discord_emoji)
+
+        stream = self._get_discord_emoji(node.content) if discord_emoji else self._get_emoji(node.content)
+        if not stream:
+            return None
+
+        with Image.open(stream) as raw:
+            return scale_emoji(raw, width)
+
     def getsize(
         self,
         text: str,
@@ -305,27 +396,15 @@ class Pilmoji:
                     x += width
                     continue
 
-                stream = None
-                if node.type is NodeType.emoji:
-                    stream = self._get_emoji(content)
-
-                elif self._render_discord_emoji and node.type is NodeType.discord_emoji:
-                    stream = self._get_discord_emoji(content)
-
-                if not stream:
+                asset = self._get_asset(node, int(emoji_scale_factor * font.size))
+                if asset is None:
                     self.draw.text((x, y), content, *args, **kwargs)
                     x += width
                     continue
 
-                with Image.open(stream).convert("RGBA") as asset:
-                    width = int(emoji_scale_factor * font.size)
-                    size = width, math.ceil(asset.height / asset.width * width)
-                    asset = asset.resize(size, Image.Resampling.LANCZOS)
-
-                    ox, oy = emoji_position_offset
-                    self.image.paste(asset, (x + ox, y + oy), asset)
-
-                x += width
+                ox, oy = emoji_position_offset
+                self.image.paste(asset, (x + ox, y + oy), asset)
+                x += asset.width
             y += spacing + font.size
 
     def __enter__(self: P) -> P:
@@ -1,7 +1,8 @@
 import logging
 import math
 import random
-from datetime import datetime, timedelta
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
 from io import StringIO
 from typing import List, Tuple, Union
 
@@ -19,11 +20,14 @@ log = logging.getLogger("red.vrt.levelup.formatter")
 
 # Get a level that would be achieved from the amount of XP
 def get_level(xp: int, base: int, exp: int) -> int:
-    for level, xp_threshold in LEVELS.items():
-        if xp >= xp_threshold:
-            current_level = level
+    return max(bisect_right(THRESHOLDS, xp) - 1, 0)
 
-    return int(current_level)
+
+# Get the XP a level starts at and the XP the next level starts at
+def get_level_bounds(level: int) -> Tuple[int, float]:
+    level = max(0, min(level, len(THRESHOLDS) - 1))
+    ceiling = THRESHOLDS[level + 1] if level + 1 < len(THRESHOLDS) else math.inf
+    return THRESHOLDS[level], ceiling
 
 
 # Get how much XP is needed to reach a level
@@ -136,9 +140,12 @@ def get_twemoji(emoji: str):
 
 
 def get_next_reset(weekday: int, hour: int):
-    now = datetime.utcnow()
-    reset = now + timedelta((weekday - now.weekday()) % 7)
-    return int(reset.replace(hour=hour, minute=0, second=0).timestamp())
+    now = datetime.now(timezone.utc)
+    reset = (now + timedelta((weekday - now.weekday()) % 7)).replace(hour=hour, minute=0, second=0, microsecond=0)
+    if reset <= now:
+        # Today is the reset day but the hour has passed
+        reset += timedelta(days=7)
+    return int(reset.timestamp())
 
 
 def get_attachments(ctx) -> List[discord.Attachment]:
@@ -1327,3 +1334,5 @@ LEVELS = {
     "998": 49825150,
     "999": 49925025,
 }
+# XP needed for each level, indexed by level
+THRESHOLDS = list(LEVELS.values())
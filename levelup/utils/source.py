@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from io import BytesIO
-from typing import Any, ClassVar, Dict, Optional
+from pathlib import Path
+from time import monotonic
+from typing import Any, Callable, ClassVar, Dict, Optional
 from urllib.error import HTTPError
 from urllib.parse import quote_plus
 from urllib.request import Request, urlopen
@@ -32,6 +34,7 @@ __all__ = (
     "OpenmojiEmojiSource",
     "TwemojiEmojiSource",
     "FacebookMessengerEmojiSource",
+    "LocalEmojiSource",
     "Twemoji",
     "Openmoji",
 )
@@ -244,6 +247,95 @@ class MozillaEmojiSource(EmojiCDNSource):
     STYLE = "mozilla"
 
 
+class LocalEmojiSource(TwitterEmojiSource):
+    """A source that reads Twemoji PNGs from local emoji packs.
+
+    Pack files are named by code point the same way Twemoji names them, like ``1f600.png``.
+    Anything not found in a pack is downloaded once and saved to ``savedir``,
+    so it is read from disk from then on. Discord emojis are saved under ``savedir/discord``.
+    Failed downloads aren't retried until ``retry_after`` seconds have passed.
+
+    Parameters
+    ----------
+    folders: :class:`pathlib.Path`
+        Emoji packs to look in, in order. Missing folders are skipped.
+    savedir: :class:`pathlib.Path`
+        Where downloaded emojis are kept.
+    retry_after: float
+        Seconds before a failed download is tried again. Defaults to `300`
+    """
+
+    def __init__(self, *folders: Path, savedir: Path, retry_after: float = 300) -> None:
+        super().__init__()
+        self.folders = (*folders, savedir)
+        self.savedir = savedir
+        self.retry_after = retry_after
+        self._failed: Dict[str, float] = {}  # Save path -> when the download can be tried again
+
+    def download(self, path: Path, fetch: Callable[..., Optional[BytesIO]], *args) -> Optional[BytesIO]:
+        key = str(path)
+        if self._failed.get(key, 0) > monotonic():
+            return None
+        try:
+            stream = fetch(*args)
+        except Exception:
+            self.failed(key)
+            raise
+        # The CDN answers some misses with an empty body rather than an error
+        if not stream or not stream.getbuffer().nbytes:
+            self.failed(key)
+            return None
+        self._failed.pop(key, None)
+        self.save(path, stream.getvalue())
+        return stream
+
+    def failed(self, key: str, /) -> None:
+        now = monotonic()
+        if len(self._failed) >= 1024:
+            self._failed = {k: v for k, v in self._failed.items() if v > now}
+        self._failed[key] = now + self.retry_after
+
+    @staticmethod
+    def twemoji_name(emoji: str, /) -> str:
+        codes = [hex(ord(char))[2:] for char in emoji]
+        # Twemoji drops the variation selector unless the emoji is a joined sequence
+        if "200d" not in codes:
+            codes = [c for c in codes if c != "fe0f"]
+        return "-".join(codes)
+
+    def discord_emoji_path(self, id: int, /) -> Path:
+        return self.savedir / "discord" / f"{id}.png"
+
+    @staticmethod
+    def save(path: Path, data: bytes, /) -> None:
+        if not data:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp")
+        try:
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except OSError:
+            # Another render saved the same emoji at the same time
+            pass
+
+    def get_emoji(self, emoji: str, /) -> Optional[BytesIO]:
+        name = self.twemoji_name(emoji) + ".png"
+        for folder in self.folders:
+            path = folder / name
+            if path.is_file():
+                return BytesIO(path.read_bytes())
+
+        return self.download(self.savedir / name, super().get_emoji, emoji)
+
+    def get_discord_emoji(self, id: int, /) -> Optional[BytesIO]:
+        path = self.discord_emoji_path(id)
+        if path.is_file():
+            return BytesIO(path.read_bytes())
+
+        return self.download(path, super().get_discord_emoji, id)
+
+
 # Aliases
 Openmoji = OpenmojiEmojiSource
 FacebookMessengerEmojiSource = MessengerEmojiSource
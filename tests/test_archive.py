@@ -0,0 +1,65 @@
+from levelup.common.archive import WeeklyArchive
+
+
+def stats(xp, messages=0, voice=0):
+    return {"xp": xp, "messages": messages, "voice": voice}
+
+
+def make_archive(tmp_path):
+    archive = WeeklyArchive(tmp_path)
+    archive.append(1, 100, {"10": stats(50, 5, 60), "20": stats(30, 3)})
+    archive.append(1, 200, {"20": stats(0, 1)})  # Nobody earned exp
+    archive.append(1, 300, {"10": stats(20, 2), "20": stats(45, 4)})
+    return archive
+
+
+def test_weeks_in_order(tmp_path):
+    archive = make_archive(tmp_path)
+    assert archive.count(1) == 3
+    assert [week.timestamp for week in archive.weeks(1)] == [100, 200, 300]
+    assert [week.timestamp for week in archive.weeks(1, last=2)] == [200, 300]
+    assert list(archive.weeks(2)) == []
+
+
+def test_top(tmp_path):
+    archive = make_archive(tmp_path)
+    assert archive.top(1, 3) == [(20, 75), (10, 70)]
+    assert archive.top(1, 1) == [(20, 45), (10, 20)]
+    assert archive.top(1, 3, "messages") == [(20, 8), (10, 7)]
+
+
+def test_history_fills_missing_weeks_with_zeros(tmp_path):
+    archive = make_archive(tmp_path)
+    assert archive.history(1, 10) == [(100, 50, 5, 60), (200, 0, 0, 0), (300, 20, 2, 0)]
+    assert archive.history(1, 10, weeks=1) == [(300, 20, 2, 0)]
+
+
+def test_streaks_break_on_a_week_without_exp(tmp_path):
+    archive = make_archive(tmp_path)
+    archive.append(1, 400, {"20": stats(10)})
+    streaks = archive.streaks(1)
+    # 10 was active in weeks 1 and 3 only, 20 in 1, 3 and 4
+    assert streaks[10] == (0, 1)
+    assert streaks[20] == (2, 2)
+
+
+def test_purge_user_rewrites_both_files(tmp_path):
+    archive = make_archive(tmp_path)
+    archive.purge_user(10)
+    weeks = list(archive.weeks(1))
+    assert [week.timestamp for week in weeks] == [100, 200, 300]
+    assert all(10 not in week.ids for week in weeks)
+    assert archive.history(1, 20) == [(100, 30, 3, 0), (200, 0, 1, 0), (300, 45, 4, 0)]
+    # The index still lines up with the rewritten records, so appends keep working
+    archive.append(1, 400, {"20": stats(5)})
+    assert [week.timestamp for week in archive.weeks(1)] == [100, 200, 300, 400]
+
+
+def test_partial_write_does_not_hide_previous_week(tmp_path):
+    archive = make_archive(tmp_path)
+    data, __ = archive.paths(1)
+    with data.open("ab") as f:
+        f.write(b"\x85\xa2ts")  # Start of a record that never made it into the index
+    assert [week.timestamp for week in archive.weeks(1)] == [100, 200, 300]
+    archive.append(1, 400, {"10": stats(1)})
+    assert [week.timestamp for week in archive.weeks(1)] == [100, 200, 300, 400]
@@ -0,0 +1,67 @@
+from levelup.common.roles import RoleLadder
+from levelup.common.rolesync import compute_changes, compute_levels
+
+
+def test_ladder_sorts_levels_numerically():
+    ladder = RoleLadder({"10": 100, "2": 20, "5": 50})
+    assert ladder.levels == [2, 5, 10]
+    assert ladder.role_ids == [20, 50, 100]
+
+
+def test_ladder_skips_invalid_levels():
+    ladder = RoleLadder({"3": 30, "abc": 99, "7": None})
+    assert ladder.levels == [3]
+
+
+def test_earned_and_highest():
+    ladder = RoleLadder({"10": 100, "2": 20, "5": 50})
+    assert ladder.earned(1) == []
+    assert ladder.earned(5) == [20, 50]
+    assert ladder.earned(99) == [20, 50, 100]
+    assert ladder.highest(1) is None
+    assert ladder.highest(9) == 50
+    assert ladder.highest(10) == 100
+
+
+def test_diff_stacks_without_autoremove():
+    ladder = RoleLadder({"2": 20, "5": 50, "10": 100})
+    add, remove = ladder.diff(10, [20, 7], autoremove=False)
+    assert add == [50, 100]
+    assert remove == []
+
+
+def test_diff_keeps_highest_only_with_autoremove():
+    ladder = RoleLadder({"2": 20, "5": 50, "10": 100})
+    add, remove = ladder.diff(6, [20, 100, 7], autoremove=True)
+    assert add == [50]
+    # Roles that aren't level roles are never touched
+    assert sorted(remove) == [20, 100]
+
+
+def test_diff_nothing_to_do():
+    ladder = RoleLadder({"2": 20, "5": 50})
+    assert ladder.diff(5, [50], autoremove=True) == ([], [])
+    assert ladder.diff(5, [20, 50], autoremove=False) == ([], [])
+
+
+def test_compute_changes_skips_unassignable_and_unchanged():
+    ladder = RoleLadder({"2": 20, "5": 50})
+    members = [
+        (1, 5, []),  # Needs both
+        (2, 5, [20, 50]),  # Already right
+        (3, 1, []),  # Nothing earned yet
+    ]
+    changes = compute_changes(ladder, members, autoremove=False, assignable={20})
+    assert changes == {"1": ([20], [])}
+
+
+def test_compute_changes_autoremove():
+    ladder = RoleLadder({"2": 20, "5": 50})
+    changes = compute_changes(ladder, [(1, 5, [20])], autoremove=True, assignable={20, 50})
+    assert changes == {"1": ([50], [20])}
+
+
+def test_compute_levels_only_returns_changes():
+    # 75 xp is level 1 and 250 is level 2 in the level table
+    users = [("1", 75, 1), ("2", 250, 1), ("3", 0, 4)]
+    assert compute_levels(users, 100, 2) == {"2": 2, "3": 0}
@@ -0,0 +1,57 @@
+from levelup.common.weekly import capture, diff
+
+
+def make_users():
+    return {
+        "1": {"xp": 100, "messages": 10, "voice": 60},
+        "2": {"xp": 50, "messages": 5, "voice": 0},
+    }
+
+
+def test_capture_is_columnar():
+    baseline = capture(make_users())
+    assert baseline == {"ids": ["1", "2"], "xp": [100, 50], "messages": [10, 5], "voice": [60, 0]}
+
+
+def test_diff_counts_gains_since_capture():
+    users = make_users()
+    baseline = capture(users)
+    assert diff(users, baseline) == {}
+    users["1"]["xp"] += 30
+    users["1"]["messages"] += 2
+    assert diff(users, baseline) == {"1": {"xp": 30, "messages": 2, "voice": 0}}
+
+
+def test_diff_counts_everything_for_users_who_joined_later():
+    users = make_users()
+    baseline = capture(users)
+    users["3"] = {"xp": 40, "messages": 4, "voice": 10}
+    assert diff(users, baseline) == {"3": {"xp": 40, "messages": 4, "voice": 10}}
+
+
+def test_diff_clamps_lowered_totals_to_zero():
+    users = make_users()
+    baseline = capture(users)
+    users["1"]["xp"] = 20  # An admin took exp away
+    users["1"]["messages"] += 1
+    assert diff(users, baseline) == {"1": {"xp": 0, "messages": 1, "voice": 0}}
+
+
+def test_rebase_keeps_carried_over_weekly_stats():
+    users = make_users()
+    baseline = capture(users)
+    users["1"]["xp"] += 30
+    weekly = diff(users, baseline)
+    # An admin edit followed by a rebase shouldn't count the edit or lose the earlier gains
+    users["1"]["xp"] += 1000
+    baseline = capture(users, weekly)
+    assert diff(users, baseline) == {"1": {"xp": 30, "messages": 0, "voice": 0}}
+    users["1"]["xp"] += 5
+    assert diff(users, baseline)["1"]["xp"] == 35
+
+
+def test_rebase_drops_removed_users():
+    users = make_users()
+    weekly = diff(users, capture(users))
+    del users["2"]
+    assert capture(users, weekly)["ids"] == ["1"]